@@ -0,0 +1,58 @@
+'''Measure the throughput of a ProducerPool with and without CPU pinning and 
+native thread limits, on a workload of numpy/scipy operations similar to 
+augmentations.
+
+Usage: python producer_pool_affinity.py [num_workers] [num_items]
+'''
+from __future__ import print_function
+
+import sys
+import time
+import numpy as np
+from scipy import ndimage
+
+from gunpowder.producer_pool import ProducerPool, get_numa_nodes
+
+def produce():
+
+    a = np.random.random((32,128,128)).astype(np.float32)
+    a = ndimage.gaussian_filter(a, 2.0)
+    b = np.dot(a.reshape(-1, 128), np.random.random((128,128)).astype(np.float32))
+    return float(b.sum())
+
+def benchmark(num_workers, num_items, **kwargs):
+
+    pool = ProducerPool([ produce for i in range(num_workers) ], queue_size=2*num_workers, **kwargs)
+    pool.start()
+
+    try:
+
+        # warm up
+        for i in range(num_workers):
+            pool.get()
+
+        start = time.time()
+        for i in range(num_items):
+            pool.get()
+        return num_items/(time.time() - start)
+
+    finally:
+        pool.stop()
+
+if __name__ == "__main__":
+
+    num_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    num_items = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print("NUMA nodes (CPUs): %s"%get_numa_nodes())
+    print("%d workers, %d items"%(num_workers, num_items))
+
+    configurations = [
+        ("no pinning, inherited threads", {}),
+        ("no pinning, 1 thread", { 'num_threads': 1 }),
+        ("pinned to cores, 1 thread", { 'cpu_affinity': 'cores', 'num_threads': 1 }),
+        ("pinned to NUMA nodes, 1 thread", { 'cpu_affinity': 'numa', 'num_threads': 1 }),
+    ]
+
+    for (name, kwargs) in configurations:
+        print("%-32s %8.2f items/s"%(name, benchmark(num_workers, num_items, **kwargs)))
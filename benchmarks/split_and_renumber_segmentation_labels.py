@@ -0,0 +1,110 @@
+'''Compare SplitAndRenumberSegmentationLabels against the previous 
+implementations based on a sparse graph of neighboring voxels and on malis 
+affinity graphs, in run time and peak memory per voxel.
+
+Usage: python split_and_renumber_segmentation_labels.py [repetitions]
+'''
+from __future__ import print_function
+
+import sys
+import time
+import tracemalloc
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from gunpowder.ext import malis
+from gunpowder.nodes.split_and_renumber_segmentation_labels import split_and_renumber
+
+def split_and_renumber_graph(labels):
+
+    index = np.arange(labels.size, dtype=np.int32).reshape(labels.shape)
+
+    u = []
+    v = []
+    for d in range(labels.ndim):
+
+        head = (slice(None),)*d + (slice(None, -1),)
+        tail = (slice(None),)*d + (slice(1, None),)
+
+        same = labels[head] == labels[tail]
+        same &= labels[head] > 0
+
+        u.append(index[head][same])
+        v.append(index[tail][same])
+
+    u = np.concatenate(u)
+    v = np.concatenate(v)
+    graph = coo_matrix(
+            (np.ones(len(u), dtype=bool), (u, v)),
+            shape=(labels.size, labels.size))
+    del u, v
+
+    _, components = connected_components(graph, directed=False)
+
+    sizes = np.bincount(components)
+    keep = sizes > 1
+    renumber = np.cumsum(keep)*keep
+
+    dtype = np.min_scalar_type(int(np.count_nonzero(keep)) + 1)
+    return renumber.astype(dtype)[components].reshape(labels.shape)
+
+def split_and_renumber_malis(labels):
+
+    simple_neighborhood = malis.mknhood3d()
+    affinities = malis.seg_to_affgraph(labels, simple_neighborhood)
+    components, _ = malis.connected_components_affgraph(affinities, simple_neighborhood)
+    return components
+
+def create_labels(shape, num_labels, block_size=(2,8,8)):
+
+    coarse_shape = tuple(s//b for s, b in zip(shape, block_size))
+    labels = np.random.randint(0, num_labels, size=coarse_shape).astype(np.uint64)
+    for d, b in enumerate(block_size):
+        labels = labels.repeat(b, axis=d)
+    return labels
+
+def same_partition(a, b):
+
+    pairs = np.unique(np.stack([a.ravel(), b.ravel()]), axis=1)
+    return len(np.unique(pairs[0])) == pairs.shape[1] == len(np.unique(pairs[1]))
+
+def benchmark(f, labels, repetitions):
+
+    start = time.time()
+    for _ in range(repetitions):
+        result = f(np.array(labels))
+    t = (time.time() - start)/repetitions
+
+    tracemalloc.start()
+    f(labels)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, t, float(peak)/labels.size
+
+if __name__ == "__main__":
+
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    np.random.seed(42)
+
+    for num_labels in [10, 1000]:
+
+        labels = create_labels((56,268,268), num_labels)
+        print("%d labels in volume of shape %s"%(num_labels, labels.shape))
+
+        result, t, peak = benchmark(lambda l: split_and_renumber(l)[0], labels, repetitions)
+        print("\tgunpowder: %.3fs, %.1f bytes/voxel, %d components, dtype %s"%(t, peak, result.max(), result.dtype))
+
+        graph_result, t, peak = benchmark(split_and_renumber_graph, labels, repetitions)
+        print("\tgraph:     %.3fs, %.1f bytes/voxel, %d components, dtype %s"%(t, peak, graph_result.max(), graph_result.dtype))
+        print("\tsame partition: %s"%same_partition(result, graph_result))
+
+        try:
+            malis_result, t, peak = benchmark(split_and_renumber_malis, labels, repetitions)
+        except ImportError:
+            print("\tmalis:     not installed")
+            continue
+
+        print("\tmalis:     %.3fs, %.1f bytes/voxel, %d components, dtype %s"%(t, peak, malis_result.max(), malis_result.dtype))
+        print("\tsame partition: %s"%same_partition(result, malis_result))
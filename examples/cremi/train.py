@@ -81,6 +81,7 @@ def train():
             prob_low_contrast=0.01,
             prob_artifact=0.03,
             artifact_source=artifact_source,
+            artifact_shape=(1,268,268),
             contrast_scale=0.1) +
         ZeroOutConstSections() +
         IntensityScaleShift(2,-1) +
@@ -1,16 +1,18 @@
 import logging
+import sys
 
 from .batch import Batch
 from .batch_provider_tree import *
 from .batch_request import BatchRequest
 from .build import build
 from .coordinate import Coordinate
-from .nodes import *
+from .dry_run import DryRunReport, VolumeDescription
 from .producer_pool import ProducerPool
+from .provider_spec import ProviderSpec
+from .ext import LazyPackage
 from .roi import Roi
-from .volume import VolumeType, Volume
-import gunpowder.caffe
-import gunpowder.tests
+from .volume import VolumeType, Volume, LazyData
+from . import nodes
 
 # logging.basicConfig(level=logging.INFO)
 
@@ -19,3 +21,29 @@ def set_verbose(verbose=True):
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
+
+# submodules with heavy dependencies, imported on first access
+_lazy_submodules = ['caffe', 'tests']
+
+__all__ = [
+    'Batch',
+    'BatchProviderTree',
+    'BatchRequest',
+    'build',
+    'Coordinate',
+    'DryRunReport',
+    'VolumeDescription',
+    'ProducerPool',
+    'ProviderSpec',
+    'Roi',
+    'VolumeType',
+    'Volume',
+    'LazyData',
+    'set_verbose',
+] + nodes.__all__
+
+# nodes are imported by gunpowder.nodes on first access
+_lazy_attributes = dict((name, ('nodes', name)) for name in nodes.__all__)
+_lazy_attributes.update((name, (name, None)) for name in _lazy_submodules)
+
+sys.modules[__name__] = LazyPackage(sys.modules[__name__], _lazy_attributes)
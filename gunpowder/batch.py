@@ -1,8 +1,14 @@
 import logging
 import multiprocessing
+import numpy as np
+import os
+import threading
 
+from .ext import ndimage
 from .freezable import Freezable
+from .producer_pool import get_worker_path
 from .profiling import ProfilingStats
+from .volume import Volume, VolumeType
 
 logger = logging.getLogger(__name__)
 
@@ -10,15 +16,88 @@ class Batch(Freezable):
     '''Contains the requested batch.
     '''
 
+    # the next id not reserved by any process
     __next_id = multiprocessing.Value('L')
 
+    # how many ids a process reserves at once
+    id_block_size = 1024
+
+    # ids reserved by the current process: pid, next id, end of block
+    __id_block = [None, 0, 0]
+
+    # ids in deterministic mode: worker path, next id
+    __deterministic_ids = False
+    __deterministic_id = [(), 0]
+
+    __id_lock = threading.Lock()
+
+    @staticmethod
+    def set_deterministic_ids(deterministic=True):
+        '''Make batch ids reproducible between runs.
+
+        In deterministic mode, ids are composed of the indices of the 
+        ProducerPools and workers the batch was created in (see 
+        'producer_pool.get_worker_path') and a counter in that worker. They 
+        are therefore the same in each run, as long as each worker creates 
+        the same sequence of batches. Workers that were restarted after a 
+        crash fall back to non-reproducible ids. Call this before the 
+        pipeline is built.
+        '''
+        Batch.__deterministic_ids = deterministic
+
     @staticmethod
     def get_next_id():
-        with Batch.__next_id.get_lock():
-            next_id = Batch.__next_id.value
-            Batch.__next_id.value += 1
+        '''Get a unique id for a new batch.
+
+        Each process reserves blocks of 'id_block_size' ids from a shared 
+        counter, such that the shared lock is only taken once per block.
+        '''
+
+        with Batch.__id_lock:
+
+            if Batch.__deterministic_ids:
+                worker_path = get_worker_path()
+                if worker_path is not None:
+                    return Batch.__get_next_deterministic_id(worker_path)
+
+            pid, next_id, end = Batch.__id_block
+
+            # reserve a new block if this one is used up, or if we are in a 
+            # forked process with a copy of the parent's block
+            if pid != os.getpid() or next_id == end:
+                with Batch.__next_id.get_lock():
+                    next_id = Batch.__next_id.value
+                    Batch.__next_id.value += Batch.id_block_size
+                pid = os.getpid()
+                end = next_id + Batch.id_block_size
+
+            Batch.__id_block[:] = [pid, next_id + 1, end]
+
+        if Batch.__deterministic_ids:
+            # don't collide with deterministic ids
+            next_id += 2**63
+
         return next_id
 
+    @staticmethod
+    def __get_next_deterministic_id(worker_path):
+
+        path, next_id = Batch.__deterministic_id
+        if path != worker_path:
+            next_id = 0
+        Batch.__deterministic_id[:] = [worker_path, next_id + 1]
+
+        # upper 31 bits encode the worker path, 12 bits per level: four for 
+        # the pool index, eight for the worker index
+        prefix = 0
+        for pool, i in worker_path:
+            assert pool < 16, "deterministic batch ids support at most 16 pools per process"
+            assert i < 255, "deterministic batch ids support at most 255 workers per pool"
+            prefix = (prefix << 12) + (pool << 8) + i + 1
+        assert prefix < 2**31 and next_id < 2**32, "deterministic batch ids exhausted"
+
+        return (prefix << 32) + next_id
+
     def __init__(self):
 
         self.id = Batch.get_next_id()
@@ -27,9 +106,69 @@ class Batch(Freezable):
         self.affinity_neighborhood = None
         self.loss = None
         self.iteration = None
+        self.num_samples = 1
 
         self.freeze()
 
+    @staticmethod
+    def stack(batches):
+        '''Stack single-sample batches with the same volume ROIs into one 
+        batch of 'len(batches)' samples. The data of each volume gets an 
+        additional leading dimension for the samples.'''
+
+        assert len(batches) > 0, "can not stack an empty list of batches"
+
+        stacked = Batch()
+        stacked.num_samples = len(batches)
+        stacked.affinity_neighborhood = batches[0].affinity_neighborhood
+        stacked.loss = batches[0].loss
+        stacked.iteration = batches[0].iteration
+
+        for (volume_type, volume) in batches[0].volumes.items():
+
+            for batch in batches[1:]:
+                assert volume_type in batch.volumes, "can not stack batches with different volumes"
+                assert batch.volumes[volume_type].roi == volume.roi, "can not stack %s with ROIs %s and %s"%(volume_type, volume.roi, batch.volumes[volume_type].roi)
+
+            stacked.volumes[volume_type] = Volume(
+                    np.stack([ batch.volumes[volume_type].data for batch in batches ]),
+                    volume.roi,
+                    volume.resolution,
+                    volume.interpolate)
+
+        for batch in batches:
+            stacked.profiling_stats.merge_with(batch.profiling_stats)
+
+        return stacked
+
+    def unstack(self):
+        '''Split a batch of several samples into a list of single-sample 
+        batches, the inverse of 'stack'. The data of the volumes are views into 
+        the data of this batch. The profiling stats go to the first sample 
+        only, such that they are not counted several times after stacking 
+        again.'''
+
+        batches = []
+        for i in range(self.num_samples):
+
+            batch = Batch()
+            batch.affinity_neighborhood = self.affinity_neighborhood
+            batch.loss = self.loss
+            batch.iteration = self.iteration
+            if i == 0:
+                batch.profiling_stats.merge_with(self.profiling_stats)
+
+            for (volume_type, volume) in self.volumes.items():
+                batch.volumes[volume_type] = Volume(
+                        volume.data[i],
+                        volume.roi,
+                        volume.resolution,
+                        volume.interpolate)
+
+            batches.append(batch)
+
+        return batches
+
     def get_total_roi(self):
         '''Get the union of all the volume ROIs in the batch.'''
 
@@ -41,6 +180,62 @@ class Batch(Freezable):
                 total_roi = total_roi.union(volume.roi)
         return total_roi
 
+    def get_nbytes(self):
+        '''Get the number of bytes of the data of all volumes in the batch.'''
+        return sum(volume.get_nbytes() for volume in self.volumes.values())
+
+    def materialize(self):
+        '''Read the data of all lazy volumes (see 'Volume.is_lazy').'''
+        for volume in self.volumes.values():
+            volume.materialize()
+
+    def get_unique_labels(self, volume_type=VolumeType.GT_LABELS):
+        '''Get the sorted unique labels of a volume and their voxel counts.
+
+        The result is cached until the volume's data is replaced or 
+        invalidated (see 'Volume.invalidate'), such that downstream nodes can 
+        reuse it.
+        '''
+        return self.volumes[volume_type].get_derived(
+                'unique_labels',
+                lambda data: np.unique(data, return_counts=True))
+
+    def get_max_label(self, volume_type=VolumeType.GT_LABELS):
+        '''Get the largest label of a volume (cached, see 
+        'get_unique_labels'). Reuses the unique labels if they are cached 
+        already.'''
+        volume = self.volumes[volume_type]
+
+        def max_label(data):
+            # empty volumes contain only background
+            if data.size == 0:
+                return data.dtype.type(0)
+            if volume.has_derived('unique_labels'):
+                return self.get_unique_labels(volume_type)[0][-1]
+            return data.max()
+
+        return volume.get_derived('max_label', max_label)
+
+    def get_label_bounding_boxes(self, volume_type=VolumeType.GT_LABELS):
+        '''Get a dictionary from each label of a volume to the tuple of slices 
+        of its bounding box (cached, see 'get_unique_labels').'''
+        return self.volumes[volume_type].get_derived(
+                'label_bounding_boxes',
+                self.__find_bounding_boxes)
+
+    def get_foreground_mask(self, volume_type=VolumeType.GT_LABELS, background=0):
+        '''Get a boolean mask of all voxels that are not 'background' (cached, 
+        see 'get_unique_labels').'''
+        return self.volumes[volume_type].get_derived(
+                ('foreground_mask', background),
+                lambda data: data != background)
+
+    def __find_bounding_boxes(self, data):
+
+        labels, inverse = np.unique(data, return_inverse=True)
+        bounding_boxes = ndimage.find_objects(inverse.reshape(data.shape) + 1)
+        return dict(zip(labels, bounding_boxes))
+
     def __repr__(self):
 
         r = ""
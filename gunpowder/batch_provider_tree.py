@@ -1,20 +1,60 @@
+import copy
 import logging
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
+from gunpowder.dry_run import DryRunReport
+from gunpowder.profiling import Timing
 from gunpowder.nodes.batch_provider import BatchProvider
+from gunpowder.nodes.pointwise_filter import PointwiseFilter, FusedPointwiseFilter
 
 logger = logging.getLogger(__name__)
 
+# marks threads that set up providers concurrently (see 'setup')
+_concurrent_setup = threading.local()
+
 class BatchProviderTree(BatchProvider):
 
+    # requests are passed to the output provider, which splits them into 
+    # samples if needed
+    supports_samples = True
+
     def __init__(self, inputs=None, output=None):
         self.inputs = inputs
         self.output = output
         self.initialized = False
+        self.fused = False
+        self.setup_timings = []
+
+    def setup(self, num_threads=None):
+        '''Set up all providers of the tree, upstream providers before 
+        downstream providers.
+
+        By default, providers are set up one after the other. With 
+        'num_threads' > 1, independent branches of the tree are set up 
+        concurrently in up to 'num_threads' threads. Providers with 
+        'setup_in_main_thread' set (e.g., those that start worker processes) 
+        are set up in the calling thread while no other setup is running.
+
+        Trees set up by a provider of another tree (e.g., the artifact source 
+        of DefectAugment) are set up one provider after the other. If they 
+        contain providers with 'setup_in_main_thread', the provider setting 
+        them up has to set 'setup_in_main_thread' as well.
+
+        The time each provider took to set up is logged and stored as a list 
+        of Timing in 'setup_timings'.
+        '''
 
-    def setup(self):
         if not self.initialized:
-            self.__rec_setup(self.output)
+            self.__fuse()
+            self.setup_timings = []
+            if num_threads is None:
+                num_threads = 1
+            if num_threads > 1 and not getattr(_concurrent_setup, 'active', False):
+                self.__parallel_setup(num_threads)
+            else:
+                self.__rec_setup(self.output)
             self.initialized = True
         else:
             logger.warning("batch provider setup() called more than once")
@@ -23,6 +63,33 @@ class BatchProviderTree(BatchProvider):
         self.__rec_teardown(self.output)
         self.initialized = False
 
+    def setup_dry_run(self):
+        self.__fuse()
+        if not self.initialized:
+            self.__rec_setup_dry_run(self.output)
+
+    def dry_provide(self, request, report):
+        return self.output.dry_provide(request, report)
+
+    def dry_run(self, request):
+        '''Pass a request through the tree without reading data or starting 
+        workers. Nodes are set up with 'setup_dry_run', unless the tree has 
+        been set up already.
+
+        Raises an exception if the request can not be satisfied (e.g., a 
+        volume type is not provided, or a ROI lies outside of a source or 
+        does not match the request of a PreCache). Otherwise, returns a 
+        DryRunReport with the volumes, array sizes, and dtypes each node 
+        receives and delivers, and estimates of the peak memory per process 
+        and per PreCache queue.
+        '''
+
+        self.setup_dry_run()
+        report = DryRunReport()
+        self.dry_provide(copy.deepcopy(request), report)
+
+        return report
+
     def add_upstream_provider(self, batch_provider):
         for input in self.inputs:
             input.add_upstream_provider(batch_provider)
@@ -63,11 +130,155 @@ class BatchProviderTree(BatchProvider):
 
         return BatchProviderTree(list(batch_providers), self.output)
 
+    def __fuse(self):
+
+        # only once, the fused filters replace the chains in the tree
+        if not self.fused:
+            self.output = self.__rec_fuse(self.output)
+            self.fused = True
+
+    def __rec_fuse(self, provider):
+        '''Replace chains of consecutive PointwiseFilters upstream of (and 
+        including) provider with FusedPointwiseFilters. Returns the provider 
+        to use in place of the given one.'''
+
+        chain = []
+        while isinstance(provider, PointwiseFilter) and len(provider.get_upstream_providers()) == 1:
+            chain.append(provider)
+            provider = provider.get_upstream_providers()[0]
+
+        upstream_providers = provider.get_upstream_providers()
+        for i in range(len(upstream_providers)):
+            upstream_providers[i] = self.__rec_fuse(upstream_providers[i])
+
+        if len(chain) == 0:
+            return provider
+
+        if len(chain) == 1:
+            return chain[0]
+
+        # chain is ordered downstream first
+        chain.reverse()
+        fused = FusedPointwiseFilter(chain)
+        fused.add_upstream_provider(provider)
+        logger.debug("fused %s"%fused)
+
+        # keep inputs pointing to the most upstream node of the tree
+        if self.inputs is not None:
+            self.inputs = [ fused if i is chain[0] else i for i in self.inputs ]
+
+        return fused
+
     def __rec_setup(self, provider):
 
         for upstream_provider in provider.get_upstream_providers():
             self.__rec_setup(upstream_provider)
+        self.__timed_setup(provider)
+
+    def __parallel_setup(self, num_threads):
+
+        # find all providers, the number of upstream providers each of them 
+        # is waiting for, and their downstream providers
+        providers = []
+        waiting = {}
+        downstream = {}
+        stack = [self.output]
+        while len(stack) > 0:
+            provider = stack.pop()
+            if id(provider) in waiting:
+                continue
+            upstream_providers = { id(u): u for u in provider.get_upstream_providers() }
+            providers.append(provider)
+            waiting[id(provider)] = len(upstream_providers)
+            for upstream_provider in upstream_providers.values():
+                downstream.setdefault(id(upstream_provider), []).append(provider)
+                stack.append(upstream_provider)
+
+        ready = [ p for p in providers if waiting[id(p)] == 0 ]
+        ready_main_thread = []
+        running = {}
+        error = None
+
+        def done(provider):
+            for downstream_provider in downstream.get(id(provider), []):
+                waiting[id(downstream_provider)] -= 1
+                if waiting[id(downstream_provider)] == 0:
+                    ready.append(downstream_provider)
+
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+
+            while True:
+
+                if error is None:
+
+                    for provider in ready:
+                        if getattr(provider, 'setup_in_main_thread', False):
+                            ready_main_thread.append(provider)
+                        else:
+                            running[executor.submit(self.__concurrent_setup, provider)] = provider
+                    del ready[:]
+
+                    # start processes only while no other thread is running, 
+                    # such that no lock is held in the forked process
+                    if len(running) == 0 and len(ready_main_thread) > 0:
+                        provider = ready_main_thread.pop(0)
+                        try:
+                            self.__timed_setup(provider)
+                        except Exception as e:
+                            error = e
+                        else:
+                            done(provider)
+                        continue
+
+                if len(running) == 0:
+                    break
+
+                finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    provider = running.pop(future)
+                    if future.exception() is not None:
+                        if error is None:
+                            error = future.exception()
+                    else:
+                        done(provider)
+
+        if error is not None:
+            raise error
+
+    def __concurrent_setup(self, provider):
+
+        _concurrent_setup.active = True
+        try:
+            self.__timed_setup(provider)
+        finally:
+            _concurrent_setup.active = False
+
+    def __timed_setup(self, provider):
+
+        if provider.setup_in_main_thread and getattr(_concurrent_setup, 'active', False):
+            raise RuntimeError(
+                    "%s has to be set up in the main thread, but is part of a tree that is set up concurrently "
+                    "with other providers. Set 'setup_in_main_thread' on the provider that sets up this tree."%type(provider).__name__)
+
+        # set up already by the default 'setup_dry_run', don't do it twice
+        if getattr(provider, 'set_up_by_dry_run', False):
+            provider.set_up_by_dry_run = False
+            logger.debug("%s was set up for a dry run already"%type(provider).__name__)
+            return
+
+        timing = Timing(provider)
+        timing.start()
         provider.setup()
+        timing.stop()
+
+        logger.info("set up %s in %.3fs"%(timing.get_name(), timing.elapsed()))
+        self.setup_timings.append(timing)
+
+    def __rec_setup_dry_run(self, provider):
+
+        for upstream_provider in provider.get_upstream_providers():
+            self.__rec_setup_dry_run(upstream_provider)
+        provider.setup_dry_run()
 
     def __rec_teardown(self, provider):
 
@@ -2,14 +2,24 @@ from .freezable import Freezable
 from .roi import Roi
 
 class BatchRequest(Freezable):
+    '''A request for a batch, given by the ROIs of the requested volumes.
 
-    def __init__(self, initial_volumes=None):
+    If 'num_samples' is larger than one, a minibatch of that many samples is 
+    requested, each with the same ROIs. The data of each volume in the 
+    provided batch will have an additional leading dimension for the samples 
+    (see 'BatchProvider.supports_samples').
+    '''
+
+    def __init__(self, initial_volumes=None, num_samples=1):
 
         if initial_volumes is None:
             self.volumes = {}
         else:
             self.volumes = initial_volumes
 
+        assert num_samples >= 1, "num_samples has to be at least 1"
+        self.num_samples = num_samples
+
         self.freeze()
 
         self.__center_rois()
@@ -31,6 +41,12 @@ class BatchRequest(Freezable):
                 total_roi = total_roi.union(roi)
         return total_roi
 
+    def get_samples_shape(self):
+        '''Get the shape of the leading sample dimensions of the requested 
+        volumes, i.e., '()' for a single sample and '(num_samples,)' 
+        otherwise.'''
+        return () if self.num_samples == 1 else (self.num_samples,)
+
     def __center_rois(self):
         '''Ensure that all ROIs are centered around the same location.'''
 
@@ -48,6 +64,8 @@ class BatchRequest(Freezable):
     def __repr__(self):
 
         r = ""
+        if self.num_samples > 1:
+            r += "%d samples\n"%self.num_samples
         for (volume_type, roi) in self.volumes.items():
             r += "%s: %s\n"%(volume_type, roi)
         return r
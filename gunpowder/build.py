@@ -1,15 +1,44 @@
+import copy
 import logging
 
+from gunpowder.batch_provider_tree import BatchProviderTree
+from gunpowder.dry_run import DryRunReport
+
 logger = logging.getLogger(__name__)
 
 class build(object):
+    '''Context manager to set up a batch provider and tear it down after use.
+
+    If 'dry_run_request' is given, the request is passed through the batch 
+    provider without reading data before it is set up, such that invalid 
+    requests fail early (see 'BatchProviderTree.dry_run'). The resulting 
+    report is logged and stored in 'dry_run_report'. Providers that are set up 
+    completely for the dry run are not set up a second time.
+
+    If 'num_setup_threads' > 1, independent branches of a BatchProviderTree 
+    are set up concurrently in up to that many threads (see 
+    'BatchProviderTree.setup').
+    '''
 
-    def __init__(self, batch_provider):
+    def __init__(self, batch_provider, dry_run_request=None, num_setup_threads=None):
         self.batch_provider = batch_provider
+        self.dry_run_request = dry_run_request
+        self.num_setup_threads = num_setup_threads
+        self.dry_run_report = None
 
     def __enter__(self):
+        if self.dry_run_request is not None:
+            self.batch_provider.setup_dry_run()
+            self.dry_run_report = DryRunReport()
+            self.batch_provider.dry_provide(copy.deepcopy(self.dry_run_request), self.dry_run_report)
+            logger.info("dry run:\n" + str(self.dry_run_report))
         try:
-            self.batch_provider.setup()
+            if isinstance(self.batch_provider, BatchProviderTree):
+                self.batch_provider.setup(num_threads=self.num_setup_threads)
+            elif getattr(self.batch_provider, 'set_up_by_dry_run', False):
+                self.batch_provider.set_up_by_dry_run = False
+            else:
+                self.batch_provider.setup()
         except:
             logger.error("something went wrong during the setup of the pipeline, calling tear down")
             self.batch_provider.teardown()
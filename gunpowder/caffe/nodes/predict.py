@@ -17,8 +17,13 @@ class PredictProcessDied(Exception):
 
 class Predict(BatchFilter):
     '''Augments the batch with the predicted affinities.
+
+    Batches of several samples (see 'BatchRequest.num_samples') are passed 
+    to the net as one minibatch.
     '''
 
+    supports_samples = True
+
     def __init__(self, prototxt, weights, use_gpu=None):
 
         for f in [prototxt, weights]:
@@ -34,9 +39,14 @@ class Predict(BatchFilter):
         self.weights = weights
         self.net_initialized = False
 
+    setup_in_main_thread = True
+
     def setup(self):
         self.worker.start()
 
+    def setup_dry_run(self):
+        pass
+
     def teardown(self):
         self.worker.stop()
 
@@ -74,12 +84,20 @@ class Predict(BatchFilter):
         batch = self.batch_in.get()
 
         self.net_io.set_inputs({
-                'data': batch.volumes[VolumeType.RAW].data[np.newaxis,np.newaxis,:],
+                'data': self.__add_sample_axis(batch, batch.volumes[VolumeType.RAW].data)[:,np.newaxis],
         })
 
         loss = self.net.forward()
         output = self.net_io.get_outputs()
         assert len(output['aff_pred'].shape) == 5, "Got affinity prediction with unexpected number of dimensions, should be 1 (direction) + 3 (spatial) + 1 (batch, not used), but is %d"%len(output['aff_pred'].shape)
-        batch.volumes[VolumeType.PRED_AFFINITIES] = Volume(output['aff_pred'][0], interpolate=True)
+        batch.volumes[VolumeType.PRED_AFFINITIES] = Volume(self.__remove_sample_axis(batch, output['aff_pred']), interpolate=True)
 
         return batch
+
+    def __add_sample_axis(self, batch, data):
+        '''The net expects a leading sample dimension, which batches with 
+        several samples have already.'''
+        return data if batch.num_samples > 1 else data[np.newaxis]
+
+    def __remove_sample_axis(self, batch, data):
+        return data if batch.num_samples > 1 else data[0]
@@ -4,6 +4,7 @@ import numpy as np
 import time
 
 from gunpowder.caffe.net_io_wrapper import NetIoWrapper
+from gunpowder.dry_run import VolumeDescription
 from gunpowder.ext import caffe
 from gunpowder.nodes.batch_filter import BatchFilter
 from gunpowder.producer_pool import ProducerPool, WorkersDied
@@ -17,8 +18,13 @@ class TrainProcessDied(Exception):
 class Train(BatchFilter):
     '''Performs one training iteration for each batch that passes through. 
     Adds the predicted affinities to the batch.
+
+    Batches of several samples (see 'BatchRequest.num_samples') are passed 
+    to the net as one minibatch.
     '''
 
+    supports_samples = True
+
     def __init__(self, solver_parameters, use_gpu=None):
 
         # start training as a producer pool, so that we can gracefully exit if 
@@ -29,9 +35,14 @@ class Train(BatchFilter):
         self.solver_parameters = solver_parameters
         self.solver_initialized = False
 
+    setup_in_main_thread = True
+
     def setup(self):
         self.worker.start()
 
+    def setup_dry_run(self):
+        pass
+
     def teardown(self):
         self.worker.stop()
 
@@ -42,6 +53,20 @@ class Train(BatchFilter):
             if volume_type in request.volumes:
                 del request.volumes[volume_type]
 
+    def dry_process(self, volumes, request):
+
+        provided = super(Train, self).dry_process(volumes, request)
+
+        for volume_type in [VolumeType.LOSS_GRADIENT, VolumeType.PRED_AFFINITIES]:
+            if volume_type in request.volumes:
+                roi = request.volumes[volume_type]
+                provided[volume_type] = VolumeDescription(
+                        roi,
+                        volumes[VolumeType.GT_AFFINITIES].shape[:-roi.dims()] + tuple(roi.get_shape()),
+                        np.float32)
+
+        return provided
+
     def process(self, batch, request):
 
         self.batch_in.put((batch,request))
@@ -85,8 +110,8 @@ class Train(BatchFilter):
         batch, request = self.batch_in.get()
 
         data = {
-            'data': batch.volumes[VolumeType.RAW].data[np.newaxis,np.newaxis,:],
-            'aff_label': batch.volumes[VolumeType.GT_AFFINITIES].data[np.newaxis,:],
+            'data': self.__add_sample_axis(batch, batch.volumes[VolumeType.RAW].data)[:,np.newaxis],
+            'aff_label': self.__add_sample_axis(batch, batch.volumes[VolumeType.GT_AFFINITIES].data),
         }
 
         if self.solver_parameters.train_state.get_stage(0) == 'euclid':
@@ -102,7 +127,7 @@ class Train(BatchFilter):
         # self.__consistency_check()
         output = self.net_io.get_outputs()
         batch.volumes[VolumeType.PRED_AFFINITIES] = Volume(
-                output['aff_pred'][0],
+                self.__remove_sample_axis(batch, output['aff_pred']),
                 batch.volumes[VolumeType.GT_AFFINITIES].roi,
                 batch.volumes[VolumeType.GT_AFFINITIES].resolution,
                 interpolate=True
@@ -112,7 +137,7 @@ class Train(BatchFilter):
         if VolumeType.LOSS_GRADIENT in request.volumes:
             diffs = self.net_io.get_output_diffs()
             batch.volumes[VolumeType.LOSS_GRADIENT] = Volume(
-                    diffs['aff_pred'][0],
+                    self.__remove_sample_axis(batch, diffs['aff_pred']),
                     batch.volumes[VolumeType.GT_AFFINITIES].roi,
                     batch.volumes[VolumeType.GT_AFFINITIES].resolution,
                     interpolate=True
@@ -129,14 +154,14 @@ class Train(BatchFilter):
         frac_pos = np.clip(gt_affinities.data, 0.05, 0.95)
         w_pos = 1.0 / (2.0 * frac_pos)
         w_neg = 1.0 / (2.0 * (1.0 - frac_pos))
-        error_scale = self.__scale_errors(gt_affinities.data, w_neg, w_pos)
+        error_scale = self.__add_sample_axis(batch, self.__scale_errors(gt_affinities.data, w_neg, w_pos))
 
         if VolumeType.GT_MASK in batch.volumes:
-            self.__mask_errors(batch, error_scale, batch.volumes[VolumeType.GT_MASK].data)
+            self.__mask_errors(batch, error_scale, self.__add_sample_axis(batch, batch.volumes[VolumeType.GT_MASK].data))
         if VolumeType.GT_IGNORE in batch.volumes:
-            self.__mask_errors(batch, error_scale, batch.volumes[VolumeType.GT_IGNORE].data)
+            self.__mask_errors(batch, error_scale, self.__add_sample_axis(batch, batch.volumes[VolumeType.GT_IGNORE].data))
 
-        data['scale'] = error_scale[np.newaxis,:]
+        data['scale'] = error_scale
 
     def __scale_errors(self, data, factor_low, factor_high):
         scaled_data = np.add((data >= 0.5) * factor_high, (data < 0.5) * factor_low)
@@ -144,12 +169,20 @@ class Train(BatchFilter):
 
     def __mask_errors(self, batch, error_scale, mask):
         for d in range(len(batch.affinity_neighborhood)):
-            error_scale[d] = np.multiply(error_scale[d], mask)
+            error_scale[:,d] = np.multiply(error_scale[:,d], mask)
+
+    def __add_sample_axis(self, batch, data):
+        '''The net expects a leading sample dimension, which batches with 
+        several samples have already.'''
+        return data if batch.num_samples > 1 else data[np.newaxis]
+
+    def __remove_sample_axis(self, batch, data):
+        return data if batch.num_samples > 1 else data[0]
 
     def __prepare_malis(self, batch, data):
 
         gt_labels = batch.volumes[VolumeType.GT_LABELS]
-        next_id = gt_labels.data.max() + 1
+        next_id = batch.get_max_label(VolumeType.GT_LABELS) + 1
 
         gt_pos_pass = gt_labels.data
 
@@ -162,7 +195,10 @@ class Train(BatchFilter):
 
             gt_neg_pass = gt_pos_pass
 
-        data['comp_label'] = np.array([[gt_neg_pass, gt_pos_pass]])
+        data['comp_label'] = np.stack([
+                self.__add_sample_axis(batch, gt_neg_pass),
+                self.__add_sample_axis(batch, gt_pos_pass)],
+                axis=1)
         data['nhood'] = batch.affinity_neighborhood[np.newaxis,np.newaxis,:]
 
         # Why don't we update gt_affinities in the same way?
@@ -0,0 +1,135 @@
+import numpy as np
+
+from .freezable import Freezable
+
+class VolumeDescription(Freezable):
+    '''Describes a volume of a batch without holding its data, as produced
+    during a dry run.'''
+
+    def __init__(self, roi, shape, dtype=None):
+        '''
+        Args:
+
+            roi: Roi
+
+                The ROI of the volume.
+
+            shape: tuple
+
+                The shape of the data, which might have additional leading
+                dimensions (e.g., for affinities).
+
+            dtype: numpy dtype or None
+
+                The dtype of the data, if known.
+        '''
+        self.roi = roi
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.freeze()
+
+    def nbytes(self):
+        '''Number of bytes of the data. If the dtype is unknown, 4 bytes per
+        element are assumed.'''
+        itemsize = 4 if self.dtype is None else self.dtype.itemsize
+        return int(np.prod(self.shape, dtype=np.int64))*itemsize
+
+    def __repr__(self):
+        return "%s, shape %s, %s, %s"%(
+                self.roi,
+                self.shape,
+                '?' if self.dtype is None else self.dtype,
+                format_bytes(self.nbytes()))
+
+class DryRunReport(Freezable):
+    '''The result of a dry run of a BatchProviderTree (see
+    'BatchProviderTree.dry_run').
+
+    For each node, lists the volumes it receives from upstream and delivers
+    downstream. Memory estimates are given per process: the main process, and
+    each worker of a PreCache. The peak memory of a process is estimated as the
+    largest sum of received and delivered volumes over its nodes.
+    '''
+
+    def __init__(self):
+
+        # list of (node name, process, received volumes, delivered volumes)
+        self.nodes = []
+
+        # list of process names, the first one is the main process
+        self.processes = ['main process']
+
+        # list of (node name, cache size, bytes per batch)
+        self.queues = []
+
+        self.current_process = 0
+
+        self.freeze()
+
+    def add_node(self, provider, received, delivered):
+        '''Record the volumes a node received from upstream and delivered
+        downstream (dicts VolumeType -> VolumeDescription).'''
+        self.nodes.append((self.__name(provider), self.current_process, received, delivered))
+
+    def enter_worker(self, provider):
+        '''Record that the following nodes run in the workers of the given
+        provider. Returns the previous process, to be passed to
+        'leave_worker'.'''
+        previous = self.current_process
+        self.processes.append("worker of %s #%d"%(self.__name(provider), len(self.processes)))
+        self.current_process = len(self.processes) - 1
+        return previous
+
+    def leave_worker(self, previous):
+        self.current_process = previous
+
+    def add_queue(self, provider, cache_size, volumes):
+        '''Record a queue of 'cache_size' batches with the given volumes.'''
+        self.queues.append((
+            self.__name(provider),
+            cache_size,
+            sum(v.nbytes() for v in volumes.values())))
+
+    def get_peak_memory(self):
+        '''Get the estimated peak memory in bytes of each process, as a list of
+        (process name, bytes).'''
+
+        peak = [0]*len(self.processes)
+        for (name, process, received, delivered) in self.nodes:
+            nbytes = sum(v.nbytes() for v in received.values()) + sum(v.nbytes() for v in delivered.values())
+            peak[process] = max(peak[process], nbytes)
+
+        return list(zip(self.processes, peak))
+
+    def get_queue_memory(self):
+        '''Get the estimated memory in bytes of each queue, as a list of
+        (node name, bytes).'''
+        return [ (name, cache_size*nbytes) for (name, cache_size, nbytes) in self.queues ]
+
+    def __name(self, provider):
+        return type(provider).__name__
+
+    def __repr__(self):
+
+        r = ""
+        for (name, process, received, delivered) in self.nodes:
+            r += "%s in %s\n"%(name, self.processes[process])
+            for (volume_type, volume) in received.items():
+                r += "    received %s: %s\n"%(volume_type, volume)
+            for (volume_type, volume) in delivered.items():
+                r += "    delivered %s: %s\n"%(volume_type, volume)
+
+        for (process, nbytes) in self.get_peak_memory():
+            r += "estimated peak memory of %s: %s\n"%(process, format_bytes(nbytes))
+        for (name, cache_size, nbytes) in self.queues:
+            r += "estimated memory of queue of %s: %d x %s = %s\n"%(name, cache_size, format_bytes(nbytes), format_bytes(cache_size*nbytes))
+
+        return r
+
+def format_bytes(nbytes):
+
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if nbytes < 1024:
+            return "%.1f%s"%(nbytes, unit)
+        nbytes /= 1024.0
+    return "%.1fTB"%nbytes
@@ -1,3 +1,6 @@
+import importlib
+import types
+
 class NoSuchModule(object):
 
     def __init__(self, name):
@@ -6,27 +9,78 @@ class NoSuchModule(object):
     def __getattr__(self, item):
         raise ImportError('Module {0} is not installed'.format(self.__name))
 
-try:
-    import dvision
-except ImportError:
-    dvision = NoSuchModule('dvision')
-
-try:
-    import h5py
-except ImportError:
-    h5py = NoSuchModule('h5py')
-
-try:
-    import caffe
-except ImportError:
-    caffe = NoSuchModule('caffe')
-
-try:
-    import malis
-except ImportError:
-    malis = NoSuchModule('malis')
-
-try:
-    import augment
-except ImportError:
-    augment = NoSuchModule('augment')
+class LazyModule(object):
+    '''Imports a module on first attribute access, such that optional 
+    dependencies are only loaded if they are used. Raises an ImportError then, 
+    if the module is not installed.'''
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, item):
+
+        if self.__module is None:
+            try:
+                self.__module = importlib.import_module(self.__name)
+            except ImportError:
+                raise ImportError('Module {0} is not installed'.format(self.__name))
+
+        return getattr(self.__module, item)
+
+class LazyPackage(types.ModuleType):
+    '''Stands in for a package in 'sys.modules' and imports some of its 
+    attributes from submodules on first access, such that the dependencies of 
+    unused submodules are not loaded. Works without a module-level 
+    '__getattr__', which needs Python 3.7.'''
+
+    def __init__(self, package, lazy_attributes):
+        '''
+        Args:
+
+            package: module
+
+                The package to stand in for.
+
+            lazy_attributes: dict, name -> (submodule, attribute)
+
+                The attributes to import on first access. 'attribute' is the 
+                name of the attribute in 'submodule', or None for the 
+                submodule itself.
+        '''
+
+        super(LazyPackage, self).__init__(package.__name__, package.__doc__)
+        self.__dict__.update(package.__dict__)
+
+        # keep the package alive, Python 2 clears the globals of modules that 
+        # get garbage collected
+        self.__package = package
+        self.__lazy_attributes = lazy_attributes
+
+    def __getattr__(self, name):
+
+        if name not in self.__lazy_attributes:
+            raise AttributeError("module %s has no attribute %s"%(self.__name__, name))
+
+        submodule, attribute = self.__lazy_attributes[name]
+        value = importlib.import_module('.' + submodule, self.__name__)
+        if attribute is not None:
+            value = getattr(value, attribute)
+        setattr(self, name, value)
+
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__.keys()) | set(self.__lazy_attributes.keys()))
+
+dvision = LazyModule('dvision')
+h5py = LazyModule('h5py')
+caffe = LazyModule('caffe')
+malis = LazyModule('malis')
+augment = LazyModule('augment')
+threadpoolctl = LazyModule('threadpoolctl')
+
+# parts of scipy that take long to import, loaded when they are used
+ndimage = LazyModule('scipy.ndimage')
+sparse = LazyModule('scipy.sparse')
+csgraph = LazyModule('scipy.sparse.csgraph')
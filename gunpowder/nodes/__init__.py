@@ -1,22 +1,39 @@
-from .add_gt_affinities import AddGtAffinities
-from .batch_filter import BatchFilter
-from .batch_provider import BatchProvider
-from .chunk import Chunk
-from .defect_augment import DefectAugment
-from .elastic_augment import ElasticAugment
-from .exclude_labels import ExcludeLabels
-from .grow_boundary import GrowBoundary
-from .hdf5_source import Hdf5Source
-from .intensity_augment import IntensityAugment
-from .intensity_scale_shift import IntensityScaleShift
-from .normalize import Normalize
-from .pad import Pad
-from .precache import PreCache
-from .print_profiling_stats import PrintProfilingStats
-from .random_location import RandomLocation
-from .random_provider import RandomProvider
-from .reject import Reject
-from .simple_augment import SimpleAugment
-from .snapshot import Snapshot
-from .split_and_renumber_segmentation_labels import SplitAndRenumberSegmentationLabels
-from .zero_out_const_sections import ZeroOutConstSections
+import sys
+
+from gunpowder.ext import LazyPackage
+
+# nodes are imported from their modules on first access, such that the 
+# dependencies of unused nodes are not loaded
+_nodes = {
+    'AddGtAffinities': 'add_gt_affinities',
+    'BalancedRandomLocation': 'balanced_random_location',
+    'BatchFilter': 'batch_filter',
+    'BatchProvider': 'batch_provider',
+    'Cast': 'pointwise_filter',
+    'Chunk': 'chunk',
+    'DefectAugment': 'defect_augment',
+    'ElasticAugment': 'elastic_augment',
+    'ExcludeLabels': 'exclude_labels',
+    'GrowBoundary': 'grow_boundary',
+    'Hdf5Source': 'hdf5_source',
+    'IntensityAugment': 'intensity_augment',
+    'IntensityScaleShift': 'intensity_scale_shift',
+    'Normalize': 'normalize',
+    'Pad': 'pad',
+    'PointwiseFilter': 'pointwise_filter',
+    'PreCache': 'precache',
+    'PrintProfilingStats': 'print_profiling_stats',
+    'RandomLocation': 'random_location',
+    'RandomProvider': 'random_provider',
+    'Reject': 'reject',
+    'SimpleAugment': 'simple_augment',
+    'Snapshot': 'snapshot',
+    'SplitAndRenumberSegmentationLabels': 'split_and_renumber_segmentation_labels',
+    'ZeroOutConstSections': 'zero_out_const_sections',
+}
+
+__all__ = sorted(_nodes.keys())
+
+sys.modules[__name__] = LazyPackage(
+        sys.modules[__name__],
+        dict((name, (module, name)) for name, module in _nodes.items()))
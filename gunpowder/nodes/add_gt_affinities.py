@@ -1,19 +1,39 @@
-import copy
 import logging
 import numpy as np
 
 from .batch_filter import BatchFilter
 from gunpowder.coordinate import Coordinate
-from gunpowder.ext import malis
+from gunpowder.dry_run import VolumeDescription
 from gunpowder.volume import Volume, VolumeType
 
 logger = logging.getLogger(__name__)
 
 class AddGtAffinities(BatchFilter):
+    '''Add GT_AFFINITIES computed from GT_LABELS.
 
-    def __init__(self, affinity_neighborhood):
+    An affinity for offset ``o`` at voxel ``p`` is 1 if ``p`` and ``p + o`` 
+    have the same, non-zero label, and 0 otherwise.
+    '''
 
-        self.affinity_neighborhood = affinity_neighborhood
+    pure_prepare = True
+    supports_samples = True
+
+    def __init__(self, affinity_neighborhood, dtype=np.float32):
+        '''
+        Args:
+
+            affinity_neighborhood: array-like
+
+                One offset per row, defining the affinities to compute.
+
+            dtype:
+
+                The dtype of the affinities, e.g., np.uint8 or bool to reduce 
+                the size of batches, np.float32 to pass them to the net.
+        '''
+
+        self.affinity_neighborhood = np.array(affinity_neighborhood)
+        self.dtype = dtype
 
         dims = self.affinity_neighborhood.shape[1]
         self.padding_neg = Coordinate(
@@ -29,14 +49,14 @@ class AddGtAffinities(BatchFilter):
         logger.debug("padding neg: " + str(self.padding_neg))
         logger.debug("padding pos: " + str(self.padding_pos))
 
-        self.skip_next = False
+    def is_shift_invariant(self, request):
+        return True
 
     def prepare(self, request):
 
         # do nothing if no gt affinities were requested
         if not VolumeType.GT_AFFINITIES in request.volumes:
             logger.warn("no GT_AFFINITIES requested, will do nothing")
-            self.skip_next = True
             return
 
         assert VolumeType.GT_LABELS in request.volumes, "AddGtAffinities can only be used if you request GT_LABELS"
@@ -46,9 +66,6 @@ class AddGtAffinities(BatchFilter):
         gt_labels_roi = request.volumes[VolumeType.GT_LABELS]
         logger.debug("downstream GT_LABELS request: " + str(gt_labels_roi))
 
-        # remember requested GT_LABELS ROI
-        self.gt_labels_roi = copy.deepcopy(gt_labels_roi)
-
         # shift GT_LABELS ROI by padding_neg
         gt_labels_roi = gt_labels_roi.shift(self.padding_neg)
         # increase shape
@@ -59,34 +76,65 @@ class AddGtAffinities(BatchFilter):
 
         logger.debug("upstream GT_LABELS request: " + str(gt_labels_roi))
 
+    def dry_process(self, volumes, request):
+
+        provided = super(AddGtAffinities, self).dry_process(volumes, request)
+
+        if VolumeType.GT_AFFINITIES in request.volumes:
+            roi = request.volumes[VolumeType.GT_AFFINITIES]
+            provided[VolumeType.GT_AFFINITIES] = VolumeDescription(
+                    roi,
+                    request.get_samples_shape() + (len(self.affinity_neighborhood),) + tuple(roi.get_shape()),
+                    self.dtype)
+
+        return provided
+
     def process(self, batch, request):
 
         # do nothing if no gt affinities were requested
-        if self.skip_next:
-            self.skip_next = False
+        if not VolumeType.GT_AFFINITIES in request.volumes:
             return
 
-        logger.debug("computing ground-truth affinities from labels")
-        gt_affinities = malis.seg_to_affgraph(
-                batch.volumes[VolumeType.GT_LABELS].data.astype(np.int32),
-                self.affinity_neighborhood
-        ).astype(np.float32)
+        gt_labels = batch.volumes[VolumeType.GT_LABELS]
+        gt_labels_roi = request.volumes[VolumeType.GT_LABELS]
 
         # crop to original GT_LABELS ROI
-        offset = self.gt_labels_roi.get_offset()
+        offset = gt_labels_roi.get_offset()
         shift = -offset - self.padding_neg
-        crop_roi = self.gt_labels_roi.shift(shift)
-        crop = crop_roi.get_bounding_box()
-
-        logger.debug("cropping with " + str(crop))
-        gt_affinities = gt_affinities[(slice(None),)+crop]
-
-        logger.debug("reset GT_LABELS ROI to " + str(self.gt_labels_roi))
-        batch.volumes[VolumeType.GT_LABELS].data = batch.volumes[VolumeType.GT_LABELS].data[crop]
-        batch.volumes[VolumeType.GT_LABELS].roi = self.gt_labels_roi
+        crop_roi = gt_labels_roi.shift(shift)
+        crop = (Ellipsis,) + crop_roi.get_bounding_box()
+
+        logger.debug("computing ground-truth affinities from labels in " + str(crop))
+        labels = gt_labels.data[crop]
+        if gt_labels.get_dtype().kind == 'u' and gt_labels.has_derived(('foreground_mask', 0)):
+            # same as labels > 0, found by an upstream node already
+            foreground = batch.get_foreground_mask()[crop]
+        else:
+            foreground = labels > 0
+
+        # with several samples, the affinities are stored as (sample, 
+        # neighbor, spatial dimensions)
+        samples_shape = request.get_samples_shape()
+        samples = (slice(None),)*len(samples_shape)
+        gt_affinities = np.empty(
+                samples_shape + (len(self.affinity_neighborhood),) + labels.shape[len(samples_shape):],
+                dtype=self.dtype)
+
+        for (e, neighbor_offset) in enumerate(self.affinity_neighborhood):
+
+            neighbor_crop = (Ellipsis,) + crop_roi.shift(Coordinate(neighbor_offset)).get_bounding_box()
+            neighbor_labels = gt_labels.data[neighbor_crop]
+
+            # affinity is 1 iff both voxels share the same foreground label
+            affinities = gt_affinities[samples + (e,)]
+            np.equal(labels, neighbor_labels, out=affinities)
+            np.multiply(affinities, foreground, out=affinities)
+
+        logger.debug("reset GT_LABELS ROI to " + str(gt_labels_roi))
+        gt_labels.crop(gt_labels_roi)
         batch.volumes[VolumeType.GT_AFFINITIES] = Volume(
                 gt_affinities,
-                self.gt_labels_roi, 
-                batch.volumes[VolumeType.GT_LABELS].resolution,
+                gt_labels_roi,
+                gt_labels.resolution,
                 interpolate=False)
         batch.affinity_neighborhood = self.affinity_neighborhood
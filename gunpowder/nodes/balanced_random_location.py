@@ -0,0 +1,122 @@
+from random import randint, random
+import logging
+import numpy as np
+
+from .random_location import RandomLocation
+from gunpowder.batch_request import BatchRequest
+from gunpowder.coordinate import Coordinate
+from gunpowder.volume import VolumeType
+
+logger = logging.getLogger(__name__)
+
+class BalancedRandomLocation(RandomLocation):
+    '''Choses a batch at a random location, such that a voxel of a randomly 
+    selected label is contained in it.
+
+    Labels are selected with the given weights, independent of how many voxels 
+    they have. This way, rare labels (small structures, specific ids, or 
+    classes in a mask) are seen as often as wanted during training.
+    '''
+
+    def __init__(self, volume_type=VolumeType.GT_LABELS, weights=None):
+        '''Create a balanced random location sampler.
+
+        During setup, the complete volume of `volume_type` is requested once 
+        to index the voxels of each label.
+
+        Args:
+
+            volume_type: The volume type whose labels to balance. Has to be 
+            part of every request.
+
+            weights: Dictionary from label to the probability (not necessarily 
+            normalized) of selecting a voxel of this label. Labels not in the 
+            dictionary are never selected. If not given, all labels found in 
+            the volume are selected with equal probability.
+
+        Locations too close to the boundary to be contained in a valid 
+        request are approximated by the closest valid shift.
+        '''
+        super(BalancedRandomLocation, self).__init__()
+        self.volume_type = volume_type
+        self.weights = weights
+
+    def setup(self):
+
+        super(BalancedRandomLocation, self).setup()
+
+        assert self.volume_type in self.get_spec().volumes, "Upstream provider does not have %s"%self.volume_type
+        self.labels_roi = self.get_spec().volumes[self.volume_type]
+
+        logger.info("requesting complete %s..."%self.volume_type)
+
+        labels_request = BatchRequest({self.volume_type: self.labels_roi})
+        labels_batch = self.get_upstream_provider().request_batch(labels_request)
+        labels_data = labels_batch.volumes[self.volume_type].data
+
+        logger.info("indexing voxels per label...")
+
+        labels, inverse = np.unique(labels_data, return_inverse=True)
+        inverse = inverse.ravel()
+
+        if self.weights is None:
+            weights = np.ones(len(labels))
+        else:
+            weights = np.array([ self.weights.get(label, 0.0) for label in labels ], dtype=np.float64)
+
+        selected = weights > 0
+        if not selected.any():
+            raise RuntimeError("None of the labels with positive weight is contained in %s"%self.volume_type)
+
+        # flat indices of voxels of selected labels, grouped by label
+        voxels = np.flatnonzero(selected[inverse])
+        voxels = voxels[np.argsort(inverse[voxels], kind='stable')]
+        self.label_voxels = voxels.astype(np.min_scalar_type(labels_data.size))
+
+        # label i owns label_voxels[label_begin[i]:label_begin[i+1]]
+        counts = np.bincount(inverse[voxels], minlength=len(labels))[selected]
+        self.label_begin = np.concatenate([[0], np.cumsum(counts)])
+
+        self.labels = labels[selected]
+        self.cumulative_weights = np.cumsum(weights[selected])
+
+        logger.info("indexed %d voxels of %d labels"%(len(self.label_voxels), len(self.labels)))
+
+    def choose_random_shift(self, request, shift_roi):
+
+        assert self.volume_type in request.volumes, "BalancedRandomLocation needs %s in the request."%self.volume_type
+        request_roi = request.volumes[self.volume_type]
+
+        # choose a label, then a voxel of this label (with the random module, 
+        # which is seeded differently in each forked process, unlike numpy's 
+        # global random state)
+        r = random()*self.cumulative_weights[-1]
+        i = int(np.searchsorted(self.cumulative_weights, r, side='right'))
+        i = min(i, len(self.labels) - 1)
+        j = self.label_voxels[randint(self.label_begin[i], self.label_begin[i + 1] - 1)]
+
+        location = self.labels_roi.get_offset() + Coordinate(
+                int(c) for c in np.unravel_index(j, self.labels_roi.get_shape()))
+
+        logger.debug("centering batch around label %s at %s"%(self.labels[i], location))
+
+        # all shifts that place the location inside the requested ROI
+        location_shift_begin = location - request_roi.get_end() + (1,)*location.dims()
+        location_shift_end = location - request_roi.get_begin() + (1,)*location.dims()
+
+        random_shift = []
+        for lb, le, sb, se in zip(location_shift_begin, location_shift_end, shift_roi.get_begin(), shift_roi.get_end()):
+
+            begin = max(lb, sb)
+            end = min(le, se)
+
+            if begin < end:
+                random_shift.append(randint(begin, end - 1))
+            else:
+                # location can not be reached (e.g., it is too close to the 
+                # boundary for the other requested volumes), take the closest 
+                # valid shift
+                logger.debug("location %s can not be contained in %s, using closest valid shift"%(location, self.volume_type))
+                random_shift.append(min(begin, se - 1))
+
+        return Coordinate(random_shift)
@@ -1,8 +1,15 @@
+import collections
 import copy
+import logging
 
 from .batch_provider import BatchProvider
+from gunpowder.batch import Batch
+from gunpowder.batch_request import BatchRequest
+from gunpowder.dry_run import VolumeDescription
 from gunpowder.profiling import Timing
 
+logger = logging.getLogger(__name__)
+
 class BatchFilter(BatchProvider):
     '''Convenience wrapper for BatchProviders with exactly one input provider.
 
@@ -28,8 +35,25 @@ class BatchFilter(BatchProvider):
             Prepare for a batch request. Always called before each 
             'process'. Use it to modify a batch spec to be passed 
             upstream.
+
+    Subclasses whose 'prepare' changes the request only depending on the 
+    request itself (i.e., not on random numbers or other state, and without 
+    storing anything for 'process') should set 'pure_prepare' to True. The 
+    upstream request is then computed only once for each downstream request 
+    and reused afterwards. Filters whose 'prepare' only shifts or grows the 
+    requested ROIs can also override 'is_shift_invariant', such that the 
+    upstream request is reused for shifted downstream requests as well (e.g., 
+    when placed upstream of RandomLocation). For requests of several samples, 
+    such filters (and 
+    filters without 'prepare') that do not support samples request all 
+    samples at once from upstream and call 'process' for each sample.
     '''
 
+    pure_prepare = False
+
+    # how many upstream requests to remember per filter with pure 'prepare'
+    max_request_plans = 16
+
     def get_upstream_provider(self):
         assert len(self.get_upstream_providers()) == 1, "BatchFilters need to have exactly one upstream provider"
         return self.get_upstream_providers()[0]
@@ -39,14 +63,10 @@ class BatchFilter(BatchProvider):
 
     def provide(self, request):
 
-        # operate on a copy of the request, to provide the original request to 
-        # 'process' for convenience
-        upstream_request = copy.deepcopy(request)
-
         timing = Timing(self)
 
         timing.start()
-        self.prepare(upstream_request)
+        upstream_request = self.__get_upstream_request(request)
         timing.stop()
 
         batch = self.get_upstream_provider().request_batch(upstream_request)
@@ -59,6 +79,164 @@ class BatchFilter(BatchProvider):
 
         return batch
 
+    def provide_samples(self, request):
+
+        # filters that override 'provide' instead of implementing 'process' 
+        # (e.g., PreCache, Chunk) have to see each sample request themselves
+        if type(self).provide != BatchFilter.provide or type(self).process == BatchFilter.process:
+            return super(BatchFilter, self).provide_samples(request)
+
+        # the upstream request of a filter with stateful 'prepare' can differ 
+        # between samples, request each sample separately then
+        if type(self).prepare != BatchFilter.prepare and not self.pure_prepare:
+            return super(BatchFilter, self).provide_samples(request)
+
+        # otherwise, request all samples at once and process them one by one
+        logger.debug("%s does not support samples, processing %d single samples"%(type(self).__name__,request.num_samples))
+
+        timing = Timing(self)
+
+        timing.start()
+        sample_request = copy.deepcopy(request)
+        sample_request.num_samples = 1
+        upstream_request = copy.deepcopy(self.__get_upstream_request(sample_request))
+        upstream_request.num_samples = request.num_samples
+        timing.stop()
+
+        batch = self.get_upstream_provider().request_batch(upstream_request)
+
+        timing.start()
+        samples = batch.unstack()
+        for sample in samples:
+            self.process(sample, sample_request)
+        batch = Batch.stack(samples)
+        timing.stop()
+
+        batch.profiling_stats.add(timing)
+
+        return batch
+
+    def dry_provide(self, request, report):
+
+        upstream_request = copy.deepcopy(request)
+        self.dry_prepare(upstream_request)
+
+        upstream_volumes = self.get_upstream_provider().dry_provide(upstream_request, report)
+
+        volumes = self.dry_process(upstream_volumes, request)
+
+        for (volume_type, roi) in request.volumes.items():
+            if volume_type not in volumes:
+                raise RuntimeError("%s requested, but %s would not provide it"%(volume_type, type(self).__name__))
+            if volumes[volume_type].roi != roi:
+                raise RuntimeError("%s ROI %s requested, but %s would provide %s"%(volume_type, roi, type(self).__name__, volumes[volume_type].roi))
+
+        report.add_node(self, upstream_volumes, volumes)
+        return volumes
+
+    def dry_prepare(self, request):
+        '''Change the request as 'prepare' would during a dry run. Defaults to 
+        'prepare', subclasses that need data to prepare (e.g., to find a 
+        location) should override it.
+        '''
+        self.prepare(request)
+
+    def dry_process(self, volumes, request):
+        '''Get the volumes this filter would provide during a dry run, given 
+        the volumes provided upstream (a dict from VolumeType to 
+        VolumeDescription).
+
+        By default, each requested volume keeps the dtype and additional 
+        leading dimensions of the upstream volume of the same type. Subclasses 
+        that add volumes or change dtypes should override it.
+        '''
+
+        provided = {}
+        for (volume_type, roi) in request.volumes.items():
+
+            if volume_type not in volumes:
+                continue
+
+            upstream = volumes[volume_type]
+            dims = roi.dims()
+            provided[volume_type] = VolumeDescription(
+                    roi,
+                    upstream.shape[:-dims] + tuple(roi.get_shape()),
+                    upstream.dtype)
+
+        return provided
+
+    def __get_upstream_request(self, request):
+
+        # 'request' is a copy already (see BatchProvider.request_batch) and 
+        # will be copied again by the upstream provider, it can be passed on 
+        # as it is if 'prepare' does not change it
+        if type(self).prepare == BatchFilter.prepare:
+            return request
+
+        if not self.pure_prepare:
+
+            # operate on a copy of the request, to provide the original request 
+            # to 'process' for convenience
+            upstream_request = copy.deepcopy(request)
+            self.prepare(upstream_request)
+            return upstream_request
+
+        if not hasattr(self, 'request_plans'):
+            self.request_plans = collections.OrderedDict()
+
+        # plans of shift invariant requests are stored relative to the offset 
+        # of the total ROI, all others by their absolute ROIs
+        shift_invariant = len(request.volumes) > 0 and self.is_shift_invariant(request)
+        if shift_invariant:
+            reference = request.get_total_roi().get_offset()
+            offsets = dict((volume_type, roi.get_offset() - reference) for volume_type, roi in request.volumes.items())
+        else:
+            offsets = dict((volume_type, roi.get_offset()) for volume_type, roi in request.volumes.items())
+
+        key = (request.num_samples, shift_invariant, frozenset(
+                (volume_type, tuple(offsets[volume_type]), tuple(roi.get_shape()))
+                for volume_type, roi in request.volumes.items()))
+
+        if key in self.request_plans:
+
+            upstream_plan = self.request_plans.pop(key)
+
+        else:
+
+            upstream_plan = copy.deepcopy(request)
+            self.prepare(upstream_plan)
+
+            if shift_invariant:
+                for volume_type, roi in upstream_plan.volumes.items():
+                    upstream_plan.volumes[volume_type] = roi.shift(-reference)
+
+            if len(self.request_plans) >= self.max_request_plans:
+                self.request_plans.popitem(last=False)
+
+        # most recently used last
+        self.request_plans[key] = upstream_plan
+
+        if not shift_invariant:
+            return upstream_plan
+
+        # don't use the constructor, it would center the ROIs
+        upstream_request = BatchRequest(num_samples=upstream_plan.num_samples)
+        for volume_type, roi in upstream_plan.volumes.items():
+            upstream_request.volumes[volume_type] = roi.shift(reference)
+
+        return upstream_request
+
+    def is_shift_invariant(self, request):
+        '''To be implemented in subclasses with 'pure_prepare'.
+
+        Return True if 'prepare' commutes with shifts for 'request', i.e., if 
+        for every shifted version of 'request' that is shift invariant as 
+        well, the upstream request is the same shifted version of the upstream 
+        request of 'request'. Defaults to False.
+        '''
+        return False
+
     def prepare(self, request):
         '''To be implemented in subclasses.
 
@@ -1,10 +1,23 @@
 import copy
 import logging
 
+from gunpowder.batch import Batch
+from gunpowder.dry_run import VolumeDescription
+
 logger = logging.getLogger(__name__)
 
 class BatchProvider(object):
 
+    # set to True in subclasses that start processes in 'setup', such that 
+    # they are not set up concurrently with other providers
+    setup_in_main_thread = False
+
+    # set to True in subclasses that can provide batches of several samples 
+    # (see 'BatchRequest.num_samples') at once, with a leading sample 
+    # dimension in the data of each volume; for other providers, 
+    # 'provide_samples' is called instead of 'provide'
+    supports_samples = False
+
     def add_upstream_provider(self, provider):
         self.get_upstream_providers().append(provider)
         return provider
@@ -30,17 +43,77 @@ class BatchProvider(object):
         '''
         pass
 
+    def setup_dry_run(self):
+        '''Called instead of 'setup' before a dry run (see 'dry_provide'). 
+        Afterwards, 'get_spec' has to work, but no data should be read and no 
+        workers started. There will be no call to 'teardown' after a dry run.
+
+        Defaults to 'setup', subclasses that read data or start workers in 
+        'setup' should override it. Providers set up this way are not set up 
+        again by a BatchProviderTree that is set up afterwards.
+        '''
+        self.setup()
+        self.set_up_by_dry_run = True
+
     def get_spec(self):
         '''To be implemented in subclasses.
         '''
         raise NotImplementedError("Class %s does not implement 'get_spec'"%type(self).__name__)
 
+    def dry_provide(self, request, report):
+        '''Validate a request against this provider and everything upstream 
+        of it, without reading any data. Returns a dict from VolumeType to 
+        VolumeDescription of the volumes that would be provided, and adds the 
+        nodes involved to the DryRunReport 'report'.
+
+        By default, providers without upstream providers (sources) check that 
+        the requested volumes are in their spec, and providers with upstream 
+        providers pass the request on to each of them. Subclasses that change 
+        the request, add volumes, or change dtypes should override it.
+        '''
+
+        upstream_providers = self.get_upstream_providers()
+
+        if len(upstream_providers) == 0:
+
+            spec = self.get_spec()
+            for (volume_type, roi) in request.volumes.items():
+                if volume_type not in spec.volumes:
+                    raise RuntimeError("%s requested from %s, which does not provide it"%(volume_type, type(self).__name__))
+                if spec.volumes[volume_type] is not None and not spec.volumes[volume_type].contains(roi):
+                    raise RuntimeError("%s ROI %s requested from %s, which provides it only in %s"%(volume_type, roi, type(self).__name__, spec.volumes[volume_type]))
+
+            volumes = dict(
+                    (volume_type, VolumeDescription(roi, request.get_samples_shape() + tuple(roi.get_shape())))
+                    for (volume_type, roi) in request.volumes.items())
+
+            report.add_node(self, {}, volumes)
+            return volumes
+
+        volumes = None
+        for provider in upstream_providers:
+            upstream_volumes = provider.dry_provide(copy.deepcopy(request), report)
+            if volumes is None:
+                volumes = upstream_volumes
+
+        report.add_node(self, volumes, volumes)
+        return volumes
+
     def request_batch(self, request):
 
         logger.debug("%s got request %s"%(type(self).__name__,request))
 
         upstream_request = copy.deepcopy(request)
-        batch = self.provide(upstream_request)
+        if request.num_samples > 1 and not self.supports_samples:
+            batch = self.provide_samples(upstream_request)
+        else:
+            batch = self.provide(upstream_request)
+
+        assert batch.num_samples == request.num_samples, "%d samples requested, but %d provided by %s."%(
+                request.num_samples,
+                batch.num_samples,
+                type(self).__name__
+        )
 
         for (volume_type,roi) in request.volumes.items():
             assert volume_type in batch.volumes, "%s requested, but %s did not provide it."%(volume_type,type(self).__name__)
@@ -54,17 +127,40 @@ class BatchProvider(object):
             # ensure that the spatial dimensions are the same (other dimensions 
             # on top are okay, e.g., for affinities)
             dims = len(roi.get_shape())
-            assert volume.data.shape[-dims:] == roi.get_shape(), "%s ROI %s requested, but shape of volume is %s provided by %s."%(
+            assert volume.get_shape()[-dims:] == roi.get_shape(), "%s ROI %s requested, but shape of volume is %s provided by %s."%(
                     volume_type,
                     roi,
-                    volume.data.shape,
+                    volume.get_shape(),
                     type(self).__name__
             )
+            if request.num_samples > 1:
+                assert volume.get_shape()[0] == request.num_samples, "%d samples requested, but shape of %s is %s provided by %s."%(
+                        request.num_samples,
+                        volume_type,
+                        volume.get_shape(),
+                        type(self).__name__
+                )
 
         logger.debug("%s provides %s"%(type(self).__name__,batch))
 
         return batch
 
+    def provide_samples(self, request):
+        '''Called instead of 'provide' with requests of several samples, if 
+        'supports_samples' is False. By default, each sample is requested 
+        separately from this provider, and the results are stacked.
+        '''
+
+        logger.debug("%s does not support samples, requesting %d single samples"%(type(self).__name__,request.num_samples))
+
+        batches = []
+        for i in range(request.num_samples):
+            sample_request = copy.deepcopy(request)
+            sample_request.num_samples = 1
+            batches.append(self.request_batch(sample_request))
+
+        return Batch.stack(batches)
+
     def provide(self, request):
         '''To be implemented in subclasses.
 
@@ -1,16 +1,22 @@
 import logging
 import numpy as np
+import os
 import random
+import time
 
 from .batch_filter import BatchFilter
 from gunpowder.batch_request import BatchRequest
 from gunpowder.build import build
+from gunpowder.producer_pool import ProducerPool, get_worker_path
 from gunpowder.volume import VolumeType
 
 logger = logging.getLogger(__name__)
 
 class DefectAugment(BatchFilter):
 
+    # the artifact bank starts processes in 'setup'
+    setup_in_main_thread = True
+
     def __init__(
             self,
             prob_missing=0.05,
@@ -18,7 +24,10 @@ class DefectAugment(BatchFilter):
             prob_artifact=0.0,
             contrast_scale=0.1,
             artifact_source=None,
-            axis=0):
+            axis=0,
+            artifact_cache_size=10,
+            num_artifact_workers=1,
+            artifact_shape=None):
         '''Create a new DefectAugment node.
 
         Args
@@ -41,6 +50,24 @@ class DefectAugment(BatchFilter):
             axis:
 
                 Along which axis sections a cut.
+
+            artifact_cache_size:
+
+                How many artifact sections to keep ready in the artifact bank.
+
+            num_artifact_workers:
+
+                How many processes to spawn in 'setup' to fill the artifact 
+                bank in the background. If 0, artifacts are requested from the 
+                artifact source whenever they are needed.
+
+            artifact_shape:
+
+                The shape of the artifact sections in the bank, with size 1 
+                along 'axis'. Artifacts for smaller sections are cropped from 
+                them at random. If not given, there is no artifact bank. 
+                Artifacts for sections that do not fit into the bank are 
+                requested from the artifact source directly.
         '''
         self.prob_missing = prob_missing
         self.prob_low_contrast = prob_low_contrast
@@ -48,14 +75,47 @@ class DefectAugment(BatchFilter):
         self.contrast_scale = contrast_scale
         self.artifact_source = artifact_source
         self.axis = axis
+        self.artifact_cache_size = artifact_cache_size
+        self.num_artifact_workers = num_artifact_workers
+        self.artifact_shape = None if artifact_shape is None else tuple(artifact_shape)
+
+        # ProducerPool of artifact batches of 'artifact_shape'
+        self.artifact_pool = None
+        # number of artifacts from the bank, total production time
+        self.artifact_stats = [0, 0.0]
+        # the process the random number generators were seeded in
+        self.__seeded_pid = None
 
     def setup(self):
 
-        if self.artifact_source is not None:
-            self.artifact_source.setup()
+        if self.artifact_source is None:
+            return
+
+        self.artifact_source.setup()
+
+        if self.prob_artifact == 0 or self.num_artifact_workers == 0 or self.artifact_shape is None:
+            return
+
+        # the workers are forked from this process and would draw the same 
+        # random numbers, give each its own seed
+        seeds = [ int(seed) for seed in np.random.randint(2**31, size=self.num_artifact_workers) ]
+
+        logger.info("starting artifact bank for sections of shape %s"%(self.artifact_shape,))
+        self.artifact_pool = ProducerPool(
+                [ lambda seed=seed: self.__produce_seeded_artifact_batch(seed) for seed in seeds ],
+                queue_size=self.artifact_cache_size)
+        self.artifact_pool.start()
+
+    def setup_dry_run(self):
+        pass
 
     def teardown(self):
 
+        if self.artifact_pool is not None:
+            self.__report_artifact_throughput()
+            self.artifact_pool.stop()
+            self.artifact_pool = None
+
         if self.artifact_source is not None:
             self.artifact_source.teardown()
 
@@ -69,49 +129,124 @@ class DefectAugment(BatchFilter):
 
         raw = batch.volumes[VolumeType.RAW]
 
-        for c in range(batch.get_total_roi().get_shape()[self.axis]):
+        # draw the defect type for all sections at once
+        num_sections = raw.data.shape[self.axis]
+        r = np.random.random(num_sections)
+        missing = r < prob_missing_threshold
+        low_contrast = np.logical_and(r >= prob_missing_threshold, r < prob_low_contrast_threshold)
+        artifact = np.logical_and(r >= prob_low_contrast_threshold, r < prob_artifact_threshold)
+
+        # all dimensions except the section axis
+        in_plane = tuple(d for d in range(raw.data.ndim) if d != self.axis)
+
+        if missing.any():
+
+            logger.debug("Zero-out sections " + str(np.nonzero(missing)[0]))
+            raw.data[self.__sections_selector(missing)] = 0
+
+        if low_contrast.any():
+
+            logger.debug("Lower contrast sections " + str(np.nonzero(low_contrast)[0]))
+            selector = self.__sections_selector(low_contrast)
+            sections = raw.data[selector]
+
+            mean = sections.mean(axis=in_plane, keepdims=True)
+            sections -= mean
+            sections *= self.contrast_scale
+            sections += mean
+
+            raw.data[selector] = sections
+
+        for c in np.nonzero(artifact)[0]:
+
+            section_selector = self.__sections_selector(slice(c, c+1))
+
+            logger.debug("Add artifact " + str(section_selector))
+            section = raw.data[section_selector]
+
+            artifact_raw, artifact_alpha = self.__get_artifact(section.shape)
+
+            assert artifact_raw.dtype == section.dtype
+            assert artifact_alpha.dtype == np.float32
+            assert artifact_alpha.min() >= 0.0
+            assert artifact_alpha.max() <= 1.0
+
+            raw.data[section_selector] = section*(1.0 - artifact_alpha) + artifact_raw*artifact_alpha
+
+        raw.invalidate()
+
+    def __sections_selector(self, sections):
+        '''Create an index that selects the given sections (a slice or boolean 
+        mask) along the section axis.'''
+
+        return (slice(None),)*self.axis + (sections,)
+
+    def __get_artifact(self, shape):
+        '''Get the raw data and alpha mask of an artifact section.'''
+
+        if self.artifact_pool is None or any(s > a for s, a in zip(shape, self.artifact_shape)):
+
+            if self.artifact_pool is not None:
+                logger.warning(
+                        "section of shape %s does not fit into artifact bank of shape %s, requesting artifact directly"%(
+                            shape, self.artifact_shape))
+
+            artifact_batch, _ = self.__produce_artifact_batch(shape)
+            crop = tuple(slice(None) for _ in shape)
+
+        else:
+
+            artifact_batch, production_time = self.artifact_pool.get()
 
-            r = random.random()
+            self.artifact_stats[0] += 1
+            self.artifact_stats[1] += production_time
+            if self.artifact_stats[0]%100 == 0:
+                self.__report_artifact_throughput()
 
-            section_selector = tuple(
-                    slice(None if d != self.axis else c, None if d != self.axis else c+1)
-                    for d in range(batch.get_total_roi().dims())
-            )
+            offset = [ np.random.randint(a - s + 1) for s, a in zip(shape, self.artifact_shape) ]
+            crop = tuple(slice(o, o + s) for o, s in zip(offset, shape))
 
-            if r < prob_missing_threshold:
+        return (
+            artifact_batch.volumes[VolumeType.RAW].data[crop],
+            artifact_batch.volumes[VolumeType.ALPHA_MASK].data[crop])
 
-                logger.debug("Zero-out " + str(section_selector))
-                raw.data[section_selector] = 0
+    def __produce_seeded_artifact_batch(self, seed):
 
-            elif r < prob_low_contrast_threshold:
+        # seed once per worker, restarted workers are seeded randomly by the 
+        # pool already
+        if self.__seeded_pid != os.getpid():
+            if get_worker_path() is not None:
+                np.random.seed(seed)
+                random.seed(seed)
+            else:
+                random.seed()
+            self.__seeded_pid = os.getpid()
 
-                logger.debug("Lower contrast " + str(section_selector))
-                section = raw.data[section_selector]
+        return self.__produce_artifact_batch(self.artifact_shape)
 
-                mean = section.mean()
-                section -= mean
-                section *= self.contrast_scale
-                section += mean
+    def __produce_artifact_batch(self, shape):
 
-                raw.data[section_selector] = section
+        start = time.time()
 
-            elif r < prob_artifact_threshold:
+        artifact_request = BatchRequest()
+        artifact_request.add_volume_request(VolumeType.RAW, shape)
+        artifact_request.add_volume_request(VolumeType.ALPHA_MASK, shape)
+        logger.debug("Requesting artifact batch " + str(artifact_request))
 
-                logger.debug("Add artifact " + str(section_selector))
-                section = raw.data[section_selector]
+        artifact_batch = self.artifact_source.request_batch(artifact_request)
 
-                artifact_request = BatchRequest()
-                artifact_request.add_volume_request(VolumeType.RAW, section.shape)
-                artifact_request.add_volume_request(VolumeType.ALPHA_MASK, section.shape)
-                logger.debug("Requesting artifact batch " + str(artifact_request))
+        return artifact_batch, time.time() - start
 
-                artifact_batch = self.artifact_source.request_batch(artifact_request)
-                artifact_alpha = artifact_batch.volumes[VolumeType.ALPHA_MASK].data
-                artifact_raw   = artifact_batch.volumes[VolumeType.RAW].data
+    def __report_artifact_throughput(self):
 
-                assert artifact_raw.dtype == section.dtype
-                assert artifact_alpha.dtype == np.float32
-                assert artifact_alpha.min() >= 0.0
-                assert artifact_alpha.max() <= 1.0
+        num_artifacts, production_time = self.artifact_stats
+        if num_artifacts == 0 or production_time == 0:
+            return
 
-                raw.data[section_selector] = section*(1.0 - artifact_alpha) + artifact_raw*artifact_alpha
+        logger.info(
+                "artifact bank for sections of shape %s: used %d artifacts, %.3fs per artifact, %.2f artifacts/s with %d workers"%(
+                    self.artifact_shape,
+                    num_artifacts,
+                    production_time/num_artifacts,
+                    self.num_artifact_workers*num_artifacts/production_time,
+                    self.num_artifact_workers))
@@ -1,9 +1,12 @@
 import copy
 import logging
+import math
 import numpy as np
-from scipy.ndimage.morphology import distance_transform_edt
 
 from .batch_filter import BatchFilter
+from gunpowder.coordinate import Coordinate
+from gunpowder.dry_run import VolumeDescription
+from gunpowder.ext import ndimage
 from gunpowder.volume import Volume, VolumeType
 
 logger = logging.getLogger(__name__)
@@ -16,6 +19,8 @@ class ExcludeLabels(BatchFilter):
     away from not excluded locations.
     '''
 
+    pure_prepare = True
+
     def __init__(self, labels, ignore_mask_erode, background_value=0):
         '''
         Args:
@@ -39,6 +44,9 @@ class ExcludeLabels(BatchFilter):
     def get_spec(self):
         return self.spec
 
+    def is_shift_invariant(self, request):
+        return True
+
     def prepare(self, request):
 
         assert VolumeType.GT_IGNORE in request.volumes, "If you use ExcludeLabels, you need to request VolumeType.GT_IGNORE."
@@ -46,38 +54,79 @@ class ExcludeLabels(BatchFilter):
         # we add it, don't request upstream
         del request.volumes[VolumeType.GT_IGNORE]
 
-    def process(self, batch, request):
+    def dry_process(self, volumes, request):
 
-        gt = batch.volumes[VolumeType.GT_LABELS]
+        provided = super(ExcludeLabels, self).dry_process(volumes, request)
 
-        # 0 marks included regions (to be used directly with distance transform 
-        # later)
-        include_mask = np.ones(gt.data.shape)
+        roi = request.volumes[VolumeType.GT_IGNORE]
+        provided[VolumeType.GT_IGNORE] = VolumeDescription(roi, request.get_samples_shape() + tuple(roi.get_shape()), np.uint8)
 
-        gt_labels = np.unique(gt.data)
-        logger.debug("batch contains GT labels: " + str(gt_labels))
-        for label in gt_labels:
-            if label in self.labels:
-                logger.debug("excluding label " + str(label))
-                gt.data[gt.data==label] = self.background_value
-            else:
-                include_mask[gt.data==label] = 0
+        return provided
 
-        distance_to_include = distance_transform_edt(include_mask, sampling=gt.resolution)
-        logger.debug("max distance to foreground is " + str(distance_to_include.max()))
-
-        # 1 marks included regions, plus a context area around them
-        include_mask = distance_to_include<self.ignore_mask_erode
+    def process(self, batch, request):
 
-        # include mask was computed on GT_LABELS ROI, we need to copy it to the 
-        # requested GT_IGNORE ROI
+        gt = batch.volumes[VolumeType.GT_LABELS]
         gt_ignore_roi = request.volumes[VolumeType.GT_IGNORE]
 
+        # only look for excluded labels that are present, if an upstream node 
+        # found the labels already
+        labels = self.labels
+        if gt.has_derived('unique_labels'):
+            ids, _ = batch.get_unique_labels()
+            labels = labels.intersection(ids.tolist())
+
+        # True marks excluded regions (to be used directly with distance 
+        # transform later)
+        exclude_mask = np.isin(gt.data, list(labels))
+
+        gt_ignore = np.zeros(gt_ignore_roi.get_shape(), dtype=np.uint8)
+        batch.volumes[VolumeType.GT_IGNORE] = Volume(gt_ignore, gt_ignore_roi, gt.resolution, interpolate=False)
+
         intersection = gt.roi.intersect(gt_ignore_roi)
-        intersection_in_gt = (intersection - gt.roi.get_offset()).get_bounding_box()
+        if intersection is None:
+            logger.debug("GT_LABELS and GT_IGNORE do not intersect")
+            return
         intersection_in_gt_ignore = (intersection - gt_ignore_roi.get_offset()).get_bounding_box()
 
-        gt_ignore = np.zeros(gt_ignore_roi.get_shape(), dtype=np.uint8)
-        gt_ignore[intersection_in_gt_ignore] = include_mask[intersection_in_gt]
+        if not exclude_mask.any():
+
+            logger.debug("batch does not contain excluded labels")
+            if self.ignore_mask_erode > 0:
+                gt_ignore[intersection_in_gt_ignore] = 1
+            return
+
+        logger.debug("excluding %d voxels"%np.count_nonzero(exclude_mask))
+        gt.data[exclude_mask] = self.background_value
+        gt.invalidate()
+
+        if exclude_mask.all():
+
+            # Without any included voxel, the distance transform measures 
+            # distances to a virtual voxel before the first corner of its 
+            # input. Compute it on the whole GT_LABELS ROI, as it always was, 
+            # such that the result doesn't depend on the cropping below.
+            logger.debug("all voxels are excluded")
+            distance_to_include = ndimage.distance_transform_edt(exclude_mask, sampling=gt.resolution)
+            intersection_in_gt = (intersection - gt.roi.get_offset()).get_bounding_box()
+            gt_ignore[intersection_in_gt_ignore] = distance_to_include[intersection_in_gt]<self.ignore_mask_erode
+            return
+
+        # only voxels closer than ignore_mask_erode to the GT_IGNORE ROI can 
+        # affect the distances inside of it
+        margin = Coordinate(
+                int(math.ceil(float(self.ignore_mask_erode)/r))
+                for r in gt.resolution)
+        context = intersection.grow(margin, margin).intersect(gt.roi)
+        context_in_gt = (context - gt.roi.get_offset()).get_bounding_box()
+        intersection_in_context = (intersection - context.get_offset()).get_bounding_box()
+
+        exclude_mask = exclude_mask[context_in_gt]
+        if exclude_mask.all():
+            logger.debug("no included labels close to GT_IGNORE")
+            return
+
+        distance_to_include = ndimage.distance_transform_edt(exclude_mask, sampling=gt.resolution)
+        logger.debug("max distance to foreground is " + str(distance_to_include.max()))
 
-        batch.volumes[VolumeType.GT_IGNORE] = Volume(gt_ignore, gt_ignore_roi, gt.resolution, interpolate=False)
+        # 1 marks included regions, plus a context area around them
+        gt_ignore[intersection_in_gt_ignore] = distance_to_include[intersection_in_context]<self.ignore_mask_erode
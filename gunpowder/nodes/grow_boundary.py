@@ -1,5 +1,4 @@
 import numpy as np
-from scipy import ndimage
 
 from .batch_filter import BatchFilter
 from gunpowder.volume import Volume, VolumeType
@@ -35,33 +34,74 @@ class GrowBoundary(BatchFilter):
 
             self.__grow(gt.data, only_xy=self.only_xy)
 
+        gt.invalidate()
+
     def __grow(self, gt, gt_mask=None, only_xy=False):
         if gt_mask is not None:
             assert gt.shape == gt_mask.shape, "GT_LABELS and GT_MASK do not have the same size."
 
+        # A voxel stays foreground if all (not masked-out) voxels within 
+        # city-block distance 'steps' have the same, non-background label. 
+        # This is equivalent to eroding each label separately with a cross 
+        # structuring element, but independent of the number of labels: the 
+        # smallest and largest label in the neighborhood are found by 
+        # repeatedly comparing each voxel with its direct neighbors.
+
         if only_xy:
             assert len(gt.shape) == 3
-            for z in range(gt.shape[0]):
-                self.__grow(gt[z], None if gt_mask is None else gt_mask[z])
-            return
+            # don't look across sections
+            axes = range(1, gt.ndim)
+        else:
+            axes = range(gt.ndim)
 
-        # get all foreground voxels by erosion of each component
-        foreground = np.zeros(shape=gt.shape, dtype=np.bool)
-        masked = None
+        if np.issubdtype(gt.dtype, np.integer):
+            lowest = np.iinfo(gt.dtype).min
+            highest = np.iinfo(gt.dtype).max
+        else:
+            lowest = -np.inf
+            highest = np.inf
+
+        # masked-out voxels don't constrain the labels in their neighborhood
+        min_label = np.array(gt)
+        max_label = np.array(gt)
         if gt_mask is not None:
             masked = np.equal(gt_mask, 0)
-        for label in np.unique(gt):
-            if label == self.background:
-                continue
-            label_mask = gt==label
-            # Assume that masked out values are the same as the label we are
-            # eroding in this iteration. This ensures that at the boundary to
-            # a masked region the value blob is not shrinking.
-            if masked is not None:
-                label_mask = np.logical_or(label_mask, masked)
-            eroded_label_mask = ndimage.binary_erosion(label_mask, iterations=self.steps, border_value=1)
-            foreground = np.logical_or(eroded_label_mask, foreground)
+            min_label[masked] = highest
+            max_label[masked] = lowest
+
+        # 'steps' < 1 erodes until nothing changes anymore, as 
+        # ndimage.binary_erosion does
+        i = 0
+        while self.steps < 1 or i < self.steps:
+
+            next_min_label = self.__neighborhood_reduce(min_label, axes, np.minimum)
+            next_max_label = self.__neighborhood_reduce(max_label, axes, np.maximum)
+
+            if self.steps < 1:
+                if np.array_equal(next_min_label, min_label) and np.array_equal(next_max_label, max_label):
+                    break
+
+            min_label = next_min_label
+            max_label = next_max_label
+            i += 1
+
+        # neighborhood fully masked out, or of a single foreground label
+        foreground = np.logical_or(
+                min_label > max_label,
+                np.logical_and(min_label == max_label, min_label != self.background))
 
         # label new background
         background = np.logical_not(foreground)
         gt[background] = self.background
+
+    def __neighborhood_reduce(self, a, axes, ufunc):
+        '''Reduce each voxel with its direct neighbors along the given axes. 
+        Voxels outside the volume are ignored.'''
+
+        reduced = np.array(a)
+        for d in axes:
+            head = (slice(None),)*d + (slice(None, -1),)
+            tail = (slice(None),)*d + (slice(1, None),)
+            ufunc(reduced[tail], a[head], out=reduced[tail])
+            ufunc(reduced[head], a[tail], out=reduced[head])
+        return reduced
@@ -1,3 +1,4 @@
+import functools
 import logging
 import numpy as np
 
@@ -8,7 +9,7 @@ from gunpowder.ext import h5py
 from gunpowder.profiling import Timing
 from gunpowder.provider_spec import ProviderSpec
 from gunpowder.roi import Roi
-from gunpowder.volume import Volume, VolumeType
+from gunpowder.volume import LazyData, Volume, VolumeType
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +19,8 @@ class Hdf5Source(BatchProvider):
             self,
             filename,
             datasets,
-            resolution=None):
+            resolution=None,
+            lazy=False):
         '''Create a new Hdf5Source
 
         Args
@@ -28,12 +30,19 @@ class Hdf5Source(BatchProvider):
             datasets: Dictionary of VolumeType -> dataset names that this source offers.
 
             resolution: tuple, to overwrite the resolution stored in the HDF5 datasets.
+
+            lazy: bool, if set, volumes are provided with LazyData that is read 
+            from the file only when the data of the volume is accessed. Crops 
+            and casts of downstream nodes are applied before reading, and 
+            volumes that are never accessed are never read.
         '''
 
         self.filename = filename
         self.datasets = datasets
         self.specified_resolution = resolution
+        self.lazy = lazy
         self.resolutions = {}
+        self.dtypes = {}
 
     def setup(self):
 
@@ -48,6 +57,7 @@ class Hdf5Source(BatchProvider):
 
             dims = f[ds].shape
             self.spec.volumes[volume_type] = Roi((0,)*len(dims), dims)
+            self.dtypes[volume_type] = f[ds].dtype
 
             if self.ndims is None:
                 self.ndims = len(dims)
@@ -71,6 +81,13 @@ class Hdf5Source(BatchProvider):
     def get_spec(self):
         return self.spec
 
+    def dry_provide(self, request, report):
+
+        volumes = super(Hdf5Source, self).dry_provide(request, report)
+        for (volume_type, volume) in volumes.items():
+            volume.dtype = self.dtypes[volume_type]
+        return volumes
+
     def provide(self, request):
 
         timing = Timing(self)
@@ -80,7 +97,9 @@ class Hdf5Source(BatchProvider):
 
         batch = Batch()
 
-        with h5py.File(self.filename, 'r') as f:
+        f = None if self.lazy else h5py.File(self.filename, 'r')
+
+        try:
 
             for (volume_type, roi) in request.volumes.items():
 
@@ -97,13 +116,27 @@ class Hdf5Source(BatchProvider):
                     VolumeType.ALPHA_MASK: True,
                 }[volume_type]
 
-                logger.debug("Reading %s in %s..."%(volume_type,roi))
+                if self.lazy:
+                    logger.debug("Deferring read of %s in %s"%(volume_type,roi))
+                    data = LazyData(
+                            functools.partial(read_dataset, self.filename, self.datasets[volume_type]),
+                            roi.get_offset(),
+                            roi.get_shape(),
+                            self.dtypes[volume_type])
+                else:
+                    logger.debug("Reading %s in %s..."%(volume_type,roi))
+                    data = self.__read(f, self.datasets[volume_type], roi)
+
                 batch.volumes[volume_type] = Volume(
-                        self.__read(f, self.datasets[volume_type], roi),
+                        data,
                         roi=roi,
                         resolution=self.resolutions[volume_type],
                         interpolate=interpolate)
 
+        finally:
+            if f is not None:
+                f.close()
+
         logger.debug("done")
 
         timing.stop()
@@ -118,3 +151,9 @@ class Hdf5Source(BatchProvider):
     def __repr__(self):
 
         return self.filename
+
+def read_dataset(filename, dataset, bounding_box):
+    '''Read a region of an HDF5 dataset, used to read LazyData.'''
+
+    with h5py.File(filename, 'r') as f:
+        return np.array(f[dataset][bounding_box])
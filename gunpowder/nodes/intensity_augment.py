@@ -1,9 +1,8 @@
 import numpy as np
 
-from .batch_filter import BatchFilter
-from gunpowder.volume import VolumeType
+from .pointwise_filter import PointwiseFilter
 
-class IntensityAugment(BatchFilter):
+class IntensityAugment(PointwiseFilter):
 
     def __init__(self, scale_min, scale_max, shift_min, shift_max, z_section_wise=False):
         self.scale_min = scale_min
@@ -12,30 +11,39 @@ class IntensityAugment(BatchFilter):
         self.shift_max = shift_max
         self.z_section_wise = z_section_wise
 
-    def process(self, batch, request):
-
-        raw = batch.volumes[VolumeType.RAW]
+    def process_raw(self, raw):
 
         assert not self.z_section_wise or raw.roi.dims() == 3, "If you specify 'z_section_wise', I expect 3D data."
         assert raw.data.dtype == np.float32 or raw.data.dtype == np.float64, "Intensity augmentation requires float types for the raw volume (not " + str(raw.data.dtype) + "). Consider using Normalize before."
         assert raw.data.min() >= 0 and raw.data.max() <= 1, "Intensity augmentation expects raw values in [0,1]. Consider using Normalize before."
 
         if self.z_section_wise:
-            for z in range(raw.roi.get_shape()[0]):
-                raw.data[z] = self.__augment(
-                        raw.data[z],
-                        np.random.uniform(low=self.scale_min, high=self.scale_max),
-                        np.random.uniform(low=self.shift_min, high=self.shift_max))
+
+            # one scale and shift per section, broadcast over the other 
+            # dimensions
+            num_sections = raw.data.shape[0]
+            param_shape = (num_sections,) + (1,)*(raw.data.ndim - 1)
+            in_plane = tuple(range(1, raw.data.ndim))
+
+            scale = np.random.uniform(low=self.scale_min, high=self.scale_max, size=num_sections).reshape(param_shape)
+            shift = np.random.uniform(low=self.shift_min, high=self.shift_max, size=num_sections).reshape(param_shape)
+            mean = raw.data.mean(axis=in_plane, keepdims=True)
+
         else:
-            raw.data = self.__augment(
-                    raw.data,
-                    np.random.uniform(low=self.scale_min, high=self.scale_max),
-                    np.random.uniform(low=self.shift_min, high=self.shift_max))
+
+            scale = np.random.uniform(low=self.scale_min, high=self.scale_max)
+            shift = np.random.uniform(low=self.shift_min, high=self.shift_max)
+            mean = raw.data.mean()
+
+        self.__augment(raw.data, mean, scale, shift)
 
         # clip values, we might have pushed them out of [0,1]
-        raw.data[raw.data>1] = 1
-        raw.data[raw.data<0] = 0
+        np.clip(raw.data, 0, 1, out=raw.data)
+        raw.invalidate()
 
-    def __augment(self, a, scale, shift):
+    def __augment(self, a, mean, scale, shift):
+        '''Compute ``mean + (a - mean)*scale + shift`` in-place.'''
 
-        return a.mean() + (a-a.mean())*scale + shift
+        a -= mean
+        a *= scale
+        a += mean + shift
@@ -1,18 +1,34 @@
-from .batch_filter import BatchFilter
-from gunpowder.volume import VolumeType
+import numpy as np
 
-class IntensityScaleShift(BatchFilter):
+from .pointwise_filter import PointwiseFilter
+
+class IntensityScaleShift(PointwiseFilter):
     '''Scales the intensities of a batch by 'scale', then adds 'shift'.
 
     This is useful to transform your intensities into the interval [-1,1], as is 
     needed before passing them to the CNN.
     '''
 
+    supports_samples = True
+    deferrable = True
+
     def __init__(self, scale, shift):
         self.scale = scale
         self.shift = shift
 
-    def process(self, batch, request):
+    def get_raw_dtype(self, dtype):
+        if dtype is None or np.issubdtype(dtype, np.floating):
+            return dtype
+        return np.result_type(dtype, self.scale, self.shift)
+
+    def replaces_raw(self, dtype):
+        return not np.issubdtype(dtype, np.floating)
+
+    def process_raw(self, raw):
 
-        raw = batch.volumes[VolumeType.RAW]
-        raw.data = raw.data*self.scale + self.shift
+        if np.issubdtype(raw.data.dtype, np.floating):
+            raw.data *= self.scale
+            raw.data += self.shift
+            raw.invalidate()
+        else:
+            raw.data = raw.data*self.scale + self.shift
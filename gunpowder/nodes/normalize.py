@@ -1,27 +1,34 @@
 import logging
 import numpy as np
 
-from .batch_filter import BatchFilter
-from gunpowder.volume import VolumeType
+from .pointwise_filter import PointwiseFilter
 
 logger = logging.getLogger(__name__)
 
-class Normalize(BatchFilter):
+class Normalize(PointwiseFilter):
     '''Normalize the raw volume to values between 0 and 1.
     '''
 
+    supports_samples = True
+    deferrable = True
+
     def __init__(self, factor=None, dtype=np.float32):
 
         self.factor = factor
         self.dtype = dtype
 
-    def process(self, batch, request):
+    def get_raw_dtype(self, dtype):
+        return np.dtype(self.dtype)
+
+    def replaces_raw(self, dtype):
+        return np.dtype(dtype) != np.dtype(self.dtype)
+
+    def process_raw(self, raw):
 
         factor = self.factor
 
         if factor is None:
 
-            raw = batch.volumes[VolumeType.RAW]
             logger.debug("automatically normalizing raw data with dtype=" + str(raw.data.dtype))
 
             if raw.data.dtype == np.uint8:
@@ -33,4 +40,7 @@ class Normalize(BatchFilter):
                 raise RuntimeError("Automatic normalization for " + str(raw.data.dtype) + " not implemented, please provide a factor.")
 
         logger.debug("scaling raw data with " + str(factor))
-        raw.data = raw.data.astype(self.dtype)*factor
+        raw.data = raw.data.astype(self.dtype, copy=False)
+        if factor != 1.0:
+            raw.data *= factor
+            raw.invalidate()
@@ -15,6 +15,8 @@ class Pad(BatchFilter):
     your source provides.
     '''
 
+    pure_prepare = True
+
     def __init__(self, pad_sizes, pad_values=None):
         '''
         Args:
@@ -56,14 +58,19 @@ class Pad(BatchFilter):
     def get_spec(self):
         return self.spec
 
+    def is_shift_invariant(self, request):
+
+        # requests that don't reach into the padding are passed on unchanged
+        return all(
+                self.upstream_spec.volumes[volume_type].contains(request.volumes[volume_type])
+                for volume_type in self.pad_sizes.keys()
+                if volume_type in request.volumes)
+
     def prepare(self, request):
 
         logger.debug("request: %s"%request)
         logger.debug("upstream spec: %s"%self.upstream_spec)
 
-        # remember request
-        self.request = copy.deepcopy(request)
-
         for volume_type in self.pad_sizes.keys():
 
             if volume_type not in request.volumes:
@@ -100,10 +107,10 @@ class Pad(BatchFilter):
             volume.data = self.__expand(
                     volume.data,
                     volume.roi,
-                    self.request.volumes[volume_type],
+                    request.volumes[volume_type],
                     self.pad_values[volume_type] if volume_type in self.pad_values else 0
             )
-            volume.roi = self.request.volumes[volume_type]
+            volume.roi = request.volumes[volume_type]
 
     def __expand(self, a, from_roi, to_roi, value):
 
@@ -0,0 +1,161 @@
+import logging
+import numpy as np
+
+from .batch_filter import BatchFilter
+from gunpowder.profiling import Timing
+from gunpowder.volume import VolumeType
+
+logger = logging.getLogger(__name__)
+
+def copy_shared_raw(filters, raw):
+    '''Copy the data of the raw volume once before a chain of pointwise 
+    filters, if a filter would write to it in-place before another one 
+    replaces it with a new array. Upstream nodes might still hold the array 
+    (e.g., a cache or another branch).'''
+
+    # lazy data is read into a new array
+    if raw.is_lazy():
+        return
+
+    dtype = raw.get_dtype()
+    for f in filters:
+        if f.replaces_raw(dtype):
+            return
+        if f.in_place:
+            raw.data = raw.data.copy()
+            return
+        dtype = f.get_raw_dtype(dtype)
+
+class PointwiseFilter(BatchFilter):
+    '''Base class for filters that only change the intensities of the raw 
+    volume, without changing the request or the spec.
+
+    Subclasses implement 'process_raw' and should modify the data of the raw 
+    volume in-place where possible. The data is copied once before the first 
+    in-place filter of a chain (see 'in_place' and 'replaces_raw'). 
+    Consecutive pointwise filters in a BatchProviderTree are fused into a 
+    single FusedPointwiseFilter when the tree is set up.
+    '''
+
+    # set to False in subclasses whose 'process_raw' never writes to the raw 
+    # data in-place
+    in_place = True
+
+    # set to True in subclasses whose 'process_raw' does not depend on random 
+    # choices or the location of a voxel, such that it can be applied to lazy 
+    # data only when it is read (see 'Volume.defer')
+    deferrable = False
+
+    def process(self, batch, request):
+        raw = batch.volumes[VolumeType.RAW]
+        copy_shared_raw([self], raw)
+        self.process_or_defer(raw)
+
+    def process_or_defer(self, raw):
+        '''Call 'process_raw' on the raw volume, or defer it until the data 
+        is read if the filter is deferrable and the data lazy.'''
+
+        if self.deferrable and raw.is_lazy():
+            raw.defer(self.process_raw, self.get_raw_dtype(raw.get_dtype()))
+        else:
+            self.process_raw(raw)
+
+    def process_raw(self, raw):
+        '''To be implemented in subclasses.
+
+        Change the intensities of the given raw volume.
+        '''
+        raise RuntimeError("Class %s does not implement 'process_raw'"%self.__class__)
+
+    def get_raw_dtype(self, dtype):
+        '''Get the dtype of the raw volume after 'process_raw', given the dtype 
+        before (or None, if unknown). Used for dry runs, subclasses that change 
+        the dtype should override it.
+        '''
+        return dtype
+
+    def replaces_raw(self, dtype):
+        '''Whether 'process_raw' replaces the raw data with a new array 
+        (before writing to it), given the dtype of the raw data. Subclasses 
+        that allocate a new array for some dtypes should override it.
+        '''
+        return False
+
+    def dry_process(self, volumes, request):
+
+        volumes = super(PointwiseFilter, self).dry_process(volumes, request)
+        if VolumeType.RAW in volumes:
+            volumes[VolumeType.RAW].dtype = self.get_raw_dtype(volumes[VolumeType.RAW].dtype)
+        return volumes
+
+class FusedPointwiseFilter(BatchFilter):
+    '''Applies a chain of pointwise filters to the raw volume in one node.
+
+    Created automatically by BatchProviderTree for consecutive 
+    PointwiseFilters. The request is passed upstream only once, and the 
+    filters operate in-place on the same raw buffer.
+    '''
+
+    def __init__(self, filters):
+        '''
+        Args:
+
+            filters: list of PointwiseFilter
+
+                The filters to apply, upstream first.
+        '''
+        self.filters = filters
+        self.supports_samples = all(f.supports_samples for f in filters)
+
+    def setup(self):
+        for f in self.filters:
+            f.setup()
+
+    def teardown(self):
+        for f in self.filters:
+            f.teardown()
+
+    def dry_process(self, volumes, request):
+
+        volumes = super(FusedPointwiseFilter, self).dry_process(volumes, request)
+        if VolumeType.RAW in volumes:
+            for f in self.filters:
+                volumes[VolumeType.RAW].dtype = f.get_raw_dtype(volumes[VolumeType.RAW].dtype)
+        return volumes
+
+    def process(self, batch, request):
+
+        raw = batch.volumes[VolumeType.RAW]
+        copy_shared_raw(self.filters, raw)
+
+        for f in self.filters:
+            timing = Timing(f)
+            timing.start()
+            f.process_or_defer(raw)
+            timing.stop()
+            batch.profiling_stats.add(timing)
+
+    def __repr__(self):
+        return "FusedPointwiseFilter(" + ", ".join(type(f).__name__ for f in self.filters) + ")"
+
+class Cast(PointwiseFilter):
+    '''Cast the raw volume to another dtype.
+
+    Use it after the last intensity manipulation to reduce the size of the 
+    batches, e.g., with ``np.float16`` before a ``PreCache``. Consecutive 
+    pointwise filters operate on a float32 buffer, such that only this node 
+    allocates a new array.
+    '''
+
+    supports_samples = True
+    deferrable = True
+    in_place = False
+
+    def __init__(self, dtype=np.float16):
+        self.dtype = dtype
+
+    def get_raw_dtype(self, dtype):
+        return np.dtype(self.dtype)
+
+    def process_raw(self, raw):
+        raw.cast(self.dtype)
@@ -3,7 +3,8 @@ import logging
 import multiprocessing
 
 from .batch_filter import BatchFilter
-from gunpowder.profiling import Timing
+from gunpowder.dry_run import DryRunReport, VolumeDescription
+from gunpowder.profiling import MemoryUsage, Timing
 from gunpowder.producer_pool import ProducerPool
 
 logger = logging.getLogger(__name__)
@@ -13,7 +14,7 @@ class WorkersDiedException(Exception):
 
 class PreCache(BatchFilter):
 
-    def __init__(self, request, cache_size=50, num_workers=20):
+    def __init__(self, request, cache_size=50, num_workers=20, max_bytes=None, min_workers=None, cpu_affinity=None, num_threads=None, max_restarts=None, restart_window=3600):
         '''
             request:
 
@@ -26,17 +27,107 @@ class PreCache(BatchFilter):
             num_workers: int
 
                 How many processes to spawn to fill the cache.
+
+            max_bytes: int
+
+                How many bytes of batches (summed over all volumes) to 
+                pre-cache at most. Workers wait until batches are consumed if 
+                this budget is reached. At least one batch is cached, even if 
+                it is larger than the budget.
+
+            min_workers: int
+
+                If given, start with 'min_workers' workers and add or retire 
+                workers (up to 'num_workers') depending on how long batches are 
+                waited for and how full the cache is. Decisions are logged, 
+                such that they can be used to choose a fixed 'num_workers'.
+
+            cpu_affinity: None, 'cores', 'numa', or list of lists of int
+
+                Pin workers to CPUs, see ``ProducerPool``.
+
+            num_threads: int
+
+                Limit the threads of native libraries (OpenMP, MKL, OpenBLAS) 
+                in each worker, see ``ProducerPool``.
+
+            max_restarts: int
+
+                If given, restart workers that died (e.g., because they ran 
+                out of memory), unless more than 'max_restarts' died in the 
+                last 'restart_window' seconds, see ``ProducerPool``.
+
+            restart_window: float
+
+                Time window in seconds to count worker restarts in.
         '''
         self.request = copy.deepcopy(request)
+
+        # if the pre-cached batches have several samples, they can only be 
+        # requested as they are, otherwise single samples are pulled from the 
+        # cache and stacked (see 'BatchProvider.supports_samples')
+        self.supports_samples = request.num_samples > 1
+        self.cache_size = cache_size
+        self.max_bytes = max_bytes
         self.batches = multiprocessing.Queue(maxsize=cache_size)
-        self.workers = ProducerPool([ lambda i=i: self.__run_worker(i) for i in range(num_workers) ], queue_size=cache_size)
+        self.workers = ProducerPool(
+                [ lambda i=i: self.__run_worker(i) for i in range(num_workers) ],
+                queue_size=cache_size,
+                max_bytes=max_bytes,
+                get_nbytes=lambda batch: batch.get_nbytes(),
+                min_workers=min_workers,
+                cpu_affinity=cpu_affinity,
+                num_threads=num_threads,
+                max_restarts=max_restarts,
+                restart_window=restart_window)
+
+    setup_in_main_thread = True
 
     def setup(self):
+
+        # pass the request upstream once without data, such that upstream 
+        # nodes can prepare for it before the workers are forked (e.g., 
+        # RandomLocation builds its index of valid locations)
+        self.get_upstream_provider().dry_provide(copy.deepcopy(self.request), DryRunReport())
+
         self.workers.start()
 
+    def setup_dry_run(self):
+        pass
+
     def teardown(self):
         self.workers.stop()
 
+    def dry_provide(self, request, report):
+
+        for (volume_type, roi) in request.volumes.items():
+            if volume_type not in self.request.volumes:
+                raise RuntimeError("%s requested from PreCache, but not in the PreCache request"%volume_type)
+            if self.request.volumes[volume_type] != roi:
+                raise RuntimeError("%s ROI %s requested from PreCache, but PreCache request has ROI %s"%(volume_type, roi, self.request.volumes[volume_type]))
+        if self.request.num_samples > 1 and self.request.num_samples != request.num_samples:
+            raise RuntimeError("%d samples requested from PreCache, but PreCache request has %d samples"%(request.num_samples, self.request.num_samples))
+
+        previous = report.enter_worker(self)
+        volumes = self.get_upstream_provider().dry_provide(copy.deepcopy(self.request), report)
+        report.leave_worker(previous)
+
+        cache_size = self.cache_size
+        if self.max_bytes is not None:
+            batch_bytes = sum(v.nbytes() for v in volumes.values())
+            cache_size = min(cache_size, max(1, self.max_bytes//max(1, batch_bytes)))
+
+        report.add_queue(self, cache_size, volumes)
+
+        if request.num_samples > self.request.num_samples:
+            volumes = dict(
+                    (volume_type, VolumeDescription(v.roi, request.get_samples_shape() + v.shape, v.dtype))
+                    for (volume_type, v) in volumes.items())
+
+        report.add_node(self, {}, volumes)
+
+        return volumes
+
     def provide(self, request):
 
         timing = Timing(self)
@@ -48,9 +139,17 @@ class PreCache(BatchFilter):
         timing.stop()
         batch.profiling_stats.add(timing)
 
+        current_bytes, peak_bytes = self.workers.get_queued_bytes()
+        batch.profiling_stats.add(MemoryUsage(self, current_bytes, peak_bytes))
+
         return batch
 
     def __run_worker(self, i):
 
         request = copy.deepcopy(self.request)
-        return self.get_upstream_provider().request_batch(request)
+        batch = self.get_upstream_provider().request_batch(request)
+
+        # read lazy volumes in the worker, not in the consuming process
+        batch.materialize()
+
+        return batch
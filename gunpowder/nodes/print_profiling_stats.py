@@ -6,5 +6,7 @@ logger = logging.getLogger(__name__)
 
 class PrintProfilingStats(BatchFilter):
 
+    supports_samples = True
+
     def process(self, batch, request):
         logger.info(batch.profiling_stats)
@@ -1,11 +1,16 @@
 from random import randint
-from skimage.transform import integral_image, integrate
+import bisect
+import hashlib
+import itertools
 import logging
 import numpy as np
+import os
 
 from .batch_filter import BatchFilter
+from gunpowder.producer_pool import get_worker_path
 from gunpowder.batch_request import BatchRequest
 from gunpowder.coordinate import Coordinate
+from gunpowder.roi import Roi
 from gunpowder.volume import VolumeType
 
 logger = logging.getLogger(__name__)
@@ -18,7 +23,17 @@ class RandomLocation(BatchFilter):
     inside the provider's roi.
     '''
 
-    def __init__(self, min_masked=0, mask_volume_type=VolumeType.GT_MASK):
+    # marks stored indices that contain the number of valid shifts per block
+    index_name_prefix = 'blocks_'
+
+    def __init__(
+            self,
+            min_masked=0,
+            mask_volume_type=VolumeType.GT_MASK,
+            index_file=None,
+            index_requests=None,
+            mask_integral_cache_dir=None,
+            mask_downsample=None):
         '''Create a random location sampler.
 
         If `min_masked` (and optionally `mask_volume_type`) are set, only 
@@ -26,16 +41,55 @@ class RandomLocation(BatchFilter):
         voxels. This is in general faster than using the ``Reject`` node, at the 
         expense of storing an integral volume of the complete mask.
 
+        For each request shape, the shifts that satisfy `min_masked` are 
+        counted once in blocks of `mask_downsample` shifts and stored in an 
+        index. Locations are drawn by choosing a block proportional to its 
+        count, and then one of the valid shifts inside of it.
+
         Args:
 
             min_masked: If non-zero, require that the random sample contains at 
             least that ratio of masked-in voxels.
 
             mask_volume_type: The volume type to use for mask checks.
+
+            index_file: If given, indices of valid shifts are loaded from this 
+            file (an .npz archive, see `save_index`) during setup, and newly 
+            computed indices are added to it.
+
+            index_requests: List of BatchRequests (as they arrive at this 
+            node) to compute indices of valid shifts for during setup. If this 
+            node is upstream of a ``PreCache``, the index for the PreCache 
+            request is computed during its setup already, before the workers 
+            are started (see ``PreCache.setup``). Pass requests here only if 
+            upstream nodes change their requests randomly (e.g., transposing 
+            augmentations with different sizes per dimension), such that 
+            workers would otherwise compute indices for them each.
+
+            mask_integral_cache_dir: If given, the integral volume of the mask 
+            is stored in this directory and memory-mapped read-only, such that 
+            all processes (and later runs) share a single copy. Files are 
+            named after the file and dataset the mask is read from (the 
+            upstream source needs `filename` and `datasets` attributes, like 
+            ``Hdf5Source``), the mask ROI, and `mask_downsample`. Nodes 
+            between the source and this node are assumed not to change the 
+            mask.
+
+            mask_downsample: Coordinate, factors to downsample the mask by 
+            before computing the integral volume. The integral volume and the 
+            index of valid shifts shrink by the product of the factors. Mask 
+            ratios are then estimated by weighting blocks that are only 
+            partially covered by the mask ROI with the covered fraction, 
+            i.e., they are only approximately checked.
         '''
         self.min_masked = min_masked
         self.mask_volume_type = mask_volume_type
-
+        self.index_file = index_file
+        self.index_requests = [] if index_requests is None else index_requests
+        self.mask_integral_cache_dir = mask_integral_cache_dir
+        self.mask_downsample = None if mask_downsample is None else Coordinate(mask_downsample)
+        self.valid_shifts = {}
+        self.mask_integral = None
 
     def setup(self):
 
@@ -48,27 +102,95 @@ class RandomLocation(BatchFilter):
             assert self.mask_volume_type in self.get_spec().volumes, "Upstream provider does not have %s"%self.mask_volume_type
             self.mask_roi = self.get_spec().volumes[self.mask_volume_type]
 
-            logger.info("requesting complete mask...")
+            if self.mask_downsample is None:
+                self.mask_downsample = Coordinate((1,)*self.mask_roi.dims())
+            assert self.mask_downsample.dims() == self.mask_roi.dims(), "mask_downsample needs to have %d dimensions"%self.mask_roi.dims()
+
+            cache_key = None
+            if self.mask_integral_cache_dir is not None:
+                cache_key = self.__get_mask_integral_cache_key()
+
+            if cache_key is None:
+
+                self.mask_integral = self.__create_mask_integral()
+
+            else:
+
+                filename = os.path.join(
+                        self.mask_integral_cache_dir,
+                        cache_key + '.npy')
+
+                if not os.path.isfile(filename):
+
+                    mask_integral = self.__create_mask_integral()
+
+                    logger.info("storing mask integral volume in " + filename)
+                    try:
+                        os.makedirs(self.mask_integral_cache_dir)
+                    except OSError:
+                        pass
+                    tmp_filename = filename + '.%d.tmp.npy'%os.getpid()
+                    np.save(tmp_filename, mask_integral)
+                    os.rename(tmp_filename, filename)
+                    del mask_integral
+
+                logger.info("memory-mapping mask integral volume from " + filename)
+                self.mask_integral = np.load(filename, mmap_mode='r')
+
+            if self.index_file is not None and os.path.isfile(self.index_file):
+                self.load_index(self.index_file)
+
+            for request in self.index_requests:
+                assert self.mask_volume_type in request.volumes, "index_requests need to contain %s"%self.mask_volume_type
+                self.__get_valid_shifts(
+                        request.volumes[self.mask_volume_type],
+                        self.get_shift_roi(request))
+
+    def setup_dry_run(self):
 
-            mask_request = BatchRequest({self.mask_volume_type: self.mask_roi})
-            mask_batch = self.get_upstream_provider().request_batch(mask_request)
+        # don't read the mask
+        self.roi = self.get_spec().get_total_roi()
+        if self.roi is None:
+            raise RuntimeError("Can not draw random samples from a provider that does not have a bounding box.")
 
-            logger.info("allocating mask integral volume...")
+    def dry_prepare(self, request):
 
-            mask_data = mask_batch.volumes[self.mask_volume_type].data
-            mask_integral_dtype = np.uint64
-            logger.debug("mask size is " + str(mask_data.size))
-            if mask_data.size < 2**32:
-                mask_integral_dtype = np.uint32
-            if mask_data.size < 2**16:
-                mask_integral_dtype = np.uint16
-            logger.debug("chose %s as integral volume dtype"%mask_integral_dtype)
+        # if we were set up, build the index for this request now (e.g., in 
+        # the setup of a downstream PreCache, such that its workers share it)
+        if self.min_masked > 0 and self.mask_integral is not None and self.mask_volume_type in request.volumes:
+            self.__get_valid_shifts(
+                    request.volumes[self.mask_volume_type],
+                    self.get_shift_roi(request))
 
-            self.mask_integral = np.array(mask_data>0, dtype=mask_integral_dtype)
-            self.mask_integral = integral_image(self.mask_integral)
+        # any valid location will do
+        shift = self.get_shift_roi(request).get_begin()
+        for (volume_type, roi) in request.volumes.items():
+            request.volumes[volume_type] = roi.shift(shift)
 
     def prepare(self, request):
 
+        shift_roi = self.get_shift_roi(request)
+        random_shift = self.choose_random_shift(request, shift_roi)
+
+        logger.debug("random shift: " + str(random_shift))
+
+        # shift request ROIs
+        for (volume_type, roi) in request.volumes.items():
+            roi = roi.shift(random_shift)
+            logger.debug("new %s ROI: %s"%(volume_type,roi))
+            request.volumes[volume_type] = roi
+            assert self.roi.contains(roi)
+
+    def process(self, batch, request):
+
+        # reset ROIs to request
+        for (volume_type,roi) in request.volumes.items():
+            batch.volumes[volume_type].roi = roi
+
+    def get_shift_roi(self, request):
+        '''Get the ROI of all shifts that move each requested ROI inside the 
+        upstream provider's ROI for the same volume type.'''
+
         shift_roi = None
 
         for volume_type, request_roi in request.volumes.items():
@@ -85,57 +207,328 @@ class RandomLocation(BatchFilter):
 
         logger.debug("valid shifts for request in " + str(shift_roi))
 
-        assert shift_roi.size() > 0, "Can not satisfy batch request, no location covers all requested ROIs."
+        assert shift_roi is not None and shift_roi.size() > 0, "Can not satisfy batch request, no location covers all requested ROIs."
+
+        return shift_roi
+
+    def choose_random_shift(self, request, shift_roi):
+        '''Choose a random shift out of shift_roi for the given request. 
+        Subclasses can override this to sample differently.'''
+
+        if self.min_masked > 0:
+
+            assert self.mask_volume_type in request.volumes, "RandomLocation with min_masked > 0 needs %s in the request."%self.mask_volume_type
+
+            # select a random point from all points with enough masked-in 
+            # voxels
+            return self.__draw_valid_shift(request.volumes[self.mask_volume_type], shift_roi)
+
+        # select a random point inside ROI
+        return Coordinate(
+                randint(begin, end-1)
+                for begin, end in zip(shift_roi.get_begin(), shift_roi.get_end())
+        )
+
+    def save_index(self, filename):
+        '''Save the indices of valid shifts computed so far to an .npz 
+        archive. Indices already stored in the archive are kept.'''
+
+        index = {}
+        if os.path.isfile(filename):
+            with np.load(filename) as stored:
+                for name in stored.files:
+                    if name.startswith(self.index_name_prefix):
+                        index[name] = stored[name]
+        for key, valid_shifts in self.valid_shifts.items():
+            index[self.__key_to_name(key)] = valid_shifts
+
+        # write to a temporary file in the same directory first and rename it, 
+        # such that other processes never read a partially written file
+        tmp_filename = filename + '.%d.tmp.npz'%os.getpid()
+        try:
+            np.savez(tmp_filename, **index)
+            os.rename(tmp_filename, filename)
+        finally:
+            if os.path.isfile(tmp_filename):
+                os.remove(tmp_filename)
+
+    def load_index(self, filename):
+        '''Load indices of valid shifts saved with `save_index`.'''
+
+        logger.info("loading valid shifts from " + filename)
+        with np.load(filename) as index:
+            for name in index.files:
+                if not name.startswith(self.index_name_prefix):
+                    logger.warning("skipping index %s in %s, it was stored in an old format"%(name, filename))
+                    continue
+                self.valid_shifts[self.__name_to_key(name)] = index[name]
+
+    def __get_valid_shifts(self, request_mask_roi, shift_roi):
+        '''Get the number of valid shifts in each block of mask_downsample 
+        shifts, starting at the begin of shift_roi, and the key they are 
+        stored under.'''
+
+        key = (
+                self.min_masked,
+                tuple(self.mask_downsample),
+                tuple(request_mask_roi.get_begin()),
+                tuple(request_mask_roi.get_shape()),
+                tuple(shift_roi.get_begin()),
+                tuple(shift_roi.get_shape()))
+
+        if key not in self.valid_shifts:
+
+            if get_worker_path() != ():
+                logger.warning("computing valid shifts for mask ROI %s in a worker process, pass the request as it arrives here as 'index_requests' to compute them once during setup"%request_mask_roi)
+
+            logger.info("finding all locations with at least %f masked-in voxels for mask ROI %s..."%(self.min_masked, request_mask_roi))
+
+            dims = shift_roi.dims()
+            block_shape = self.mask_downsample
+            num_shifts = shift_roi.get_shape()
+            num_blocks = tuple(-(-n//b) for n, b in zip(num_shifts, block_shape))
+            valid_shifts = np.zeros(num_blocks, dtype=np.min_scalar_type(np.prod(block_shape)))
+
+            # one slab of blocks at a time, to keep the temporary per-shift 
+            # arrays small
+            for k in range(num_blocks[0]):
+
+                slab_begin = k*block_shape[0]
+                slab_roi = Roi(
+                        shift_roi.get_begin() + ((slab_begin,) + (0,)*(dims - 1)),
+                        (min(block_shape[0], num_shifts[0] - slab_begin),) + tuple(num_shifts[1:]))
+
+                valid = self.__find_valid(request_mask_roi, slab_roi).astype(valid_shifts.dtype)
+                for d in range(1, dims):
+                    if block_shape[d] > 1:
+                        valid = np.add.reduceat(valid, np.arange(0, num_shifts[d], block_shape[d]), axis=d)
+                valid_shifts[k] = valid.sum(axis=0)
+
+            num_valid = int(valid_shifts.sum(dtype=np.uint64))
+            logger.info("found %d out of %d locations"%(num_valid, shift_roi.size()))
+
+            if num_valid == 0:
+                raise RuntimeError("No location has at least %f masked-in voxels in %s for mask ROI %s"%(self.min_masked, self.mask_volume_type, request_mask_roi))
+
+            self.valid_shifts[key] = valid_shifts
+
+            if self.index_file is not None:
+                self.save_index(self.index_file)
+
+        return key, self.valid_shifts[key]
+
+    def __draw_valid_shift(self, request_mask_roi, shift_roi):
+
+        key, valid_shifts = self.__get_valid_shifts(request_mask_roi, shift_roi)
+
+        # number of valid shifts up to each row of blocks (along the last 
+        # dimension), to find the row of the drawn shift quickly
+        if not hasattr(self, 'row_cumulatives'):
+            self.row_cumulatives = {}
+        rows = valid_shifts.reshape(-1, valid_shifts.shape[-1])
+        if key not in self.row_cumulatives:
+            self.row_cumulatives[key] = np.cumsum(rows.sum(axis=1, dtype=np.int64))
+        row_cumulative = self.row_cumulatives[key]
+
+        # the r-th valid shift, counting block by block
+        r = randint(0, int(row_cumulative[-1]) - 1)
+        row = bisect.bisect_right(row_cumulative, r)
+        if row > 0:
+            r -= int(row_cumulative[row - 1])
+        block_cumulative = np.cumsum(rows[row], dtype=np.int64)
+        column = bisect.bisect_right(block_cumulative, r)
+        if column > 0:
+            r -= int(block_cumulative[column - 1])
+
+        # find the valid shifts in this block again
+        block = np.unravel_index(row*rows.shape[1] + column, valid_shifts.shape)
+        block_roi = Roi(
+                shift_roi.get_begin() + Coordinate(int(b)*s for b, s in zip(block, self.mask_downsample)),
+                self.mask_downsample).intersect(shift_roi)
+        i = np.flatnonzero(self.__find_valid(request_mask_roi, block_roi))[r]
+
+        return block_roi.get_begin() + Coordinate(
+                int(c) for c in np.unravel_index(i, block_roi.get_shape()))
+
+    def __find_valid(self, request_mask_roi, shift_roi):
+        '''Find the shifts in shift_roi with enough masked-in voxels.'''
+
+        num_masked_in, size = self.__count_masked_in(request_mask_roi, shift_roi)
+        return num_masked_in >= self.min_masked*size
+
+    def __create_mask_integral(self):
+
+        logger.info("requesting complete mask...")
+
+        mask_request = BatchRequest({self.mask_volume_type: self.mask_roi})
+        mask_batch = self.get_upstream_provider().request_batch(mask_request)
+
+        logger.info("allocating mask integral volume...")
+
+        mask_data = mask_batch.volumes[self.mask_volume_type].data
+        mask_integral_dtype = np.uint64
+        logger.debug("mask size is " + str(mask_data.size))
+        if mask_data.size < 2**32:
+            mask_integral_dtype = np.uint32
+        if mask_data.size < 2**16:
+            mask_integral_dtype = np.uint16
+        logger.debug("chose %s as integral volume dtype"%mask_integral_dtype)
+
+        mask_data = (mask_data > 0).astype(mask_integral_dtype)
+
+        # count masked-in voxels in blocks of size mask_downsample
+        for d, factor in enumerate(self.mask_downsample):
+            if factor > 1:
+                mask_data = np.add.reduceat(mask_data, np.arange(0, mask_data.shape[d], factor), axis=d)
+
+        # integral volume with a leading zero plane in each dimension, such 
+        # that mask_integral[p] is the number of masked-in voxels in [0,p) 
+        # (in blocks)
+        dims = mask_data.ndim
+        mask_integral = np.zeros(tuple(s + 1 for s in mask_data.shape), dtype=mask_integral_dtype)
+        integral = mask_integral[(slice(1, None),)*dims]
+        integral[:] = mask_data
+        for d in range(dims):
+            np.cumsum(integral, axis=d, out=integral)
+
+        return mask_integral
+
+    def __get_mask_integral_cache_key(self):
+        '''Get a key that identifies the mask integral volume by the file and 
+        dataset the mask is read from, or None if they can not be determined.
+        '''
+
+        mask_sources = [
+                source
+                for source in self.__get_sources(self)
+                if self.mask_volume_type in source.get_spec().volumes ]
+
+        if len(mask_sources) != 1:
+            logger.warning("%s is provided by %d sources, the mask integral volume will not be cached"%(self.mask_volume_type, len(mask_sources)))
+            return None
+
+        source = mask_sources[0]
+        filename = getattr(source, 'filename', None)
+        datasets = getattr(source, 'datasets', None)
+
+        if filename is None or not os.path.isfile(filename) or datasets is None or self.mask_volume_type not in datasets:
+            logger.warning("can not determine the file and dataset %s is read from in %s, the mask integral volume will not be cached"%(self.mask_volume_type, type(source).__name__))
+            return None
 
-        good_location_found = False
-        while not good_location_found:
+        description = [
+                os.path.abspath(filename),
+                # invalidate the cache if the file changes
+                str(os.path.getmtime(filename)),
+                str(os.path.getsize(filename)),
+                str(datasets[self.mask_volume_type]),
+                str(self.mask_roi),
+                'mask>0',
+                str(self.mask_downsample)]
 
-            # select a random point inside ROI
-            random_shift = Coordinate(
-                    randint(begin, end-1)
-                    for begin, end in zip(shift_roi.get_begin(), shift_roi.get_end())
-            )
+        return hashlib.sha1('\n'.join(description).encode('utf-8')).hexdigest()
 
-            logger.debug("random shift: " + str(random_shift))
+    def __get_sources(self, provider):
 
-            if self.min_masked > 0:
+        upstream_providers = provider.get_upstream_providers()
+        if len(upstream_providers) == 0:
+            return [provider]
+        return [ s for p in upstream_providers for s in self.__get_sources(p) ]
 
-                # get randomly chosen mask ROI
-                request_mask_roi = request.volumes[self.mask_volume_type]
-                request_mask_roi = request_mask_roi.shift(random_shift)
+    def __count_masked_in(self, request_mask_roi, shift_roi):
+        '''Count the masked-in voxels of the request mask ROI for each shift in 
+        shift_roi (estimated, if the mask is downsampled). Returns the counts 
+        and the number of voxels they were counted in.'''
 
-                # get coordinates inside mask volume
-                request_mask_roi_in_volume = request_mask_roi.shift(-self.mask_roi.get_offset())
+        dims = request_mask_roi.dims()
 
-                # get number of masked-in voxels
-                num_masked_in = integrate(
-                        self.mask_integral,
-                        [request_mask_roi_in_volume.get_begin()],
-                        [request_mask_roi_in_volume.get_end()-(1,)*self.mask_integral.ndim]
-                )[0]
+        # begin and end of mask ROI for the first shift, in mask coordinates
+        begin = request_mask_roi.get_begin() + shift_roi.get_begin() - self.mask_roi.get_offset()
+        end = begin + request_mask_roi.get_shape()
+        num_shifts = shift_roi.get_shape()
 
-                mask_ratio = float(num_masked_in)/request_mask_roi.size()
-                logger.debug("mask ratio is %f"%mask_ratio)
+        if self.mask_downsample == (1,)*dims:
 
-                if mask_ratio >= self.min_masked:
-                    logger.debug("good batch found")
-                    good_location_found = True
+            # inclusion-exclusion over the corners of the mask ROI, for all 
+            # shifts at once (intermediate values might wrap around, the 
+            # result doesn't)
+            num_masked_in = np.zeros(num_shifts, dtype=self.mask_integral.dtype)
+            for corner in itertools.product([0, 1], repeat=dims):
+
+                values = self.mask_integral[np.ix_(*[
+                    np.arange(num_shifts[d]) + (end[d] if corner[d] else begin[d])
+                    for d in range(dims)])]
+
+                if (dims - sum(corner))%2 == 0:
+                    num_masked_in += values
                 else:
-                    logger.debug("bad batch found")
+                    num_masked_in -= values
+
+            return num_masked_in, request_mask_roi.size()
+
+        # Per dimension, express the weighted sum over the blocks touched by 
+        # the mask ROI as a linear combination of integral volume positions. 
+        # Blocks that are only partially covered (at the ROI boundary) are 
+        # weighted with the covered fraction of their voxels (blocks at the 
+        # end of the mask can be smaller than the others). With I the 
+        # integral, first block k0 with weight w0, last block k1 with weight 
+        # w1, and interior blocks with weight 1:
+        #
+        #   sum = -w0*I[k0] + (w0 - 1)*I[k0+1] + (1 - w1)*I[k1] + w1*I[k1+1]
+        #
+        # or, if the ROI lies in a single block k0:
+        #
+        #   sum = -w0*I[k0] + w0*I[k0+1]
+        terms = []
+        for d in range(dims):
+
+            factor = self.mask_downsample[d]
+            mask_size = self.mask_roi.get_shape()[d]
+            b = begin[d] + np.arange(num_shifts[d])
+            e = end[d] + np.arange(num_shifts[d])
+
+            k0 = b//factor
+            k1 = (e - 1)//factor
+            size0 = np.minimum((k0 + 1)*factor, mask_size) - k0*factor
+            size1 = np.minimum((k1 + 1)*factor, mask_size) - k1*factor
+
+            single = k0 == k1
+            w0 = np.where(single, e - b, (k0 + 1)*factor - b)/size0
+            w1 = np.where(single, 0, (e - k1*factor)/size1)
+
+            terms.append([
+                (k0, -w0),
+                (k0 + 1, np.where(single, w0, w0 - 1)),
+                (k1, np.where(single, 0, 1 - w1)),
+                (k1 + 1, w1)])
+
+        # the weights are separable, apply the combinations one dimension at a 
+        # time (the first steps operate on the small integral volume)
+        num_masked_in = self.mask_integral
+        for d in range(dims):
+
+            contracted = None
+            for position, weight in terms[d]:
+                values = np.take(num_masked_in, position, axis=d).astype(np.float64)
+                values *= weight.reshape((1,)*d + (-1,) + (1,)*(dims - d - 1))
+                if contracted is None:
+                    contracted = values
+                else:
+                    contracted += values
 
-            else:
+            num_masked_in = contracted
 
-                good_location_found = True
+        return num_masked_in, request_mask_roi.size()
 
-        # shift request ROIs
-        for (volume_type, roi) in request.volumes.items():
-            roi = roi.shift(random_shift)
-            logger.debug("new %s ROI: %s"%(volume_type,roi))
-            request.volumes[volume_type] = roi
-            assert self.roi.contains(roi)
+    def __key_to_name(self, key):
+        return self.index_name_prefix + '_'.join(str(x) for x in [key[0]] + [c for t in key[1:] for c in t])
 
-    def process(self, batch, request):
+    def __name_to_key(self, name):
 
-        # reset ROIs to request
-        for (volume_type,roi) in request.volumes.items():
-            batch.volumes[volume_type].roi = roi
+        values = name[len(self.index_name_prefix):].split('_')
+        min_masked = float(values[0])
+        coordinates = [ int(v) for v in values[1:] ]
+        dims = len(coordinates)//5
+
+        return (min_masked,) + tuple(
+                tuple(coordinates[i*dims:(i+1)*dims])
+                for i in range(5))
@@ -1,12 +1,45 @@
+import bisect
 import copy
+import logging
+import numpy as np
 import random
+import time
 
 from .batch_provider import BatchProvider
 
+logger = logging.getLogger(__name__)
+
 class RandomProvider(BatchProvider):
     '''Randomly selects one of the upstream providers.
     '''
 
+    def __init__(self, weights=None, adaptive=False, tolerance=0.05):
+        '''
+        Args:
+
+            weights: list of float
+
+                Relative probabilities to select each upstream provider, in the 
+                order the providers were added. If not given, providers are 
+                selected proportional to the size of their total ROI (or 
+                uniformly, if a provider does not have a ROI).
+
+            adaptive: bool
+
+                If set, keep track of the time each upstream provider needs to 
+                deliver a batch and prefer faster ones, as long as the 
+                fraction of batches from each provider stays within 
+                'tolerance' of its probability.
+
+            tolerance: float
+
+                By how much the fraction of batches from each provider is 
+                allowed to deviate from its probability in adaptive mode.
+        '''
+        self.weights = weights
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+
     def setup(self):
 
         self.spec = None
@@ -22,8 +55,89 @@ class RandomProvider(BatchProvider):
                     if volume_type not in provider.get_spec().volumes:
                         del self.spec.volumes[volume_type]
 
+        num_providers = len(self.get_upstream_providers())
+
+        if self.weights is not None:
+            assert len(self.weights) == num_providers, "RandomProvider got %d weights for %d upstream providers"%(len(self.weights), num_providers)
+            weights = self.weights
+        else:
+            rois = [ provider.get_spec().get_total_roi() for provider in self.get_upstream_providers() ]
+            if any(roi is None for roi in rois):
+                weights = [1]*num_providers
+            else:
+                weights = [ roi.size() for roi in rois ]
+
+        self.probabilities = np.array(weights, dtype=np.float64)
+        assert (self.probabilities >= 0).all() and self.probabilities.sum() > 0, "RandomProvider weights need to be non-negative and not all zero"
+        self.probabilities /= self.probabilities.sum()
+        logger.debug("selecting upstream providers with probabilities " + str(self.probabilities))
+
+        # for adaptive mode
+        self.num_selected = np.zeros(num_providers, dtype=np.int64)
+        self.latencies = np.full(num_providers, np.nan)
+
     def get_spec(self):
         return self.spec
 
     def provide(self, request):
-        return random.choice(self.get_upstream_providers()).request_batch(request)
+
+        if self.adaptive:
+            i = self.__choose_adaptive()
+        else:
+            i = self.__choose(self.probabilities)
+
+        start = time.time()
+        batch = self.get_upstream_providers()[i].request_batch(request)
+        latency = time.time() - start
+
+        self.num_selected[i] += 1
+        if np.isnan(self.latencies[i]):
+            self.latencies[i] = latency
+        else:
+            # exponential moving average
+            self.latencies[i] = 0.9*self.latencies[i] + 0.1*latency
+
+        return batch
+
+    def __choose_adaptive(self):
+
+        total = self.num_selected.sum()
+        if total == 0:
+            return self.__choose(self.probabilities)
+
+        deficit = self.probabilities - self.num_selected.astype(np.float64)/total
+
+        # catch up with providers that fell behind too much
+        if deficit.max() > self.tolerance:
+            return int(np.argmax(deficit))
+
+        # otherwise, prefer fast providers among the ones that are not 
+        # overrepresented
+        allowed = np.logical_and(deficit > -self.tolerance, self.probabilities > 0)
+
+        # providers without measured latency are assumed to be fast
+        latencies = np.array(self.latencies)
+        measured = np.logical_not(np.isnan(latencies))
+        fastest = latencies[measured].min() if measured.any() else 1.0
+        latencies[np.logical_not(measured)] = fastest
+        latencies = np.maximum(latencies, 1e-6)
+
+        preference = allowed*self.probabilities/latencies
+        if preference.sum() == 0:
+            return int(np.argmax(deficit))
+
+        return self.__choose(preference/preference.sum())
+
+    def __choose(self, probabilities):
+
+        # use the random module, which (unlike numpy's global random state) 
+        # is seeded differently in each forked process, such that PreCache 
+        # workers draw independently
+        cumulative = np.cumsum(probabilities)
+        i = bisect.bisect_right(cumulative, random.random()*cumulative[-1])
+
+        # the product can round up to the total
+        if i == len(probabilities):
+            i = int(np.flatnonzero(probabilities)[-1])
+
+        return i
@@ -7,20 +7,64 @@ from gunpowder.volume import VolumeType
 logger = logging.getLogger(__name__)
 
 class Reject(BatchProvider):
-
-    def __init__(self, min_masked=0.5, mask_volume_type=VolumeType.GT_MASK):
+    '''Reject batches with less than a minimal ratio of masked-in voxels.
+
+    Each candidate is requested in full, there is no separate request of 
+    the mask alone: random choices of upstream nodes (locations, 
+    augmentations) can depend on the requested volumes, such that a mask-only 
+    request would not reproduce the accepted candidate. Only the mask of a 
+    candidate is accessed, though. Work on the other volumes of rejected 
+    candidates is therefore only saved if the upstream source provides lazy 
+    volumes (e.g., ``Hdf5Source(lazy=True)``) and the nodes in between do not 
+    touch them (deferrable pointwise filters like Normalize don't, 
+    augmentations do). Otherwise, use the acceptance statistics (see 
+    'get_statistics') to decide whether ``RandomLocation`` with 'min_masked' 
+    is the better choice.
+    '''
+
+    def __init__(self, min_masked=0.5, mask_volume_type=VolumeType.GT_MASK, report_every=100):
+        '''
+        Args:
+
+            min_masked: The minimal ratio of masked-in voxels a batch needs to 
+            have to be accepted.
+
+            mask_volume_type: The volume type to use for mask checks.
+
+            report_every: Log acceptance statistics every that many batches.
+        '''
         self.min_masked = min_masked
         self.mask_volume_type = mask_volume_type
+        self.report_every = report_every
+
+        self.num_batches = 0
+        self.num_candidates = 0
+        self.num_accepted = 0
 
     def setup(self):
         assert self.mask_volume_type in self.get_spec().volumes, "Reject can only be used if %s is provided"%self.mask_volume_type
         assert len(self.get_upstream_providers()) == 1, "Reject can only be used with exactly one upstream provider."
         self.upstream_provider = self.get_upstream_providers()[0]
 
+    def teardown(self):
+        self.__report_statistics()
+
     def get_spec(self):
         assert len(self.get_upstream_providers()) == 1, "Reject can only be used with exactly one upstream provider."
         return self.get_upstream_providers()[0].get_spec()
 
+    def get_statistics(self):
+        '''Get the number of delivered batches, candidates seen, and 
+        candidates accepted so far, together with the acceptance rate 
+        (accepted candidates over all candidates).'''
+
+        return {
+            'batches': self.num_batches,
+            'candidates': self.num_candidates,
+            'accepted': self.num_accepted,
+            'acceptance_rate': float(self.num_accepted)/max(1, self.num_candidates)
+        }
+
     def provide(self, request):
 
         report_next_timeout = 10
@@ -36,6 +80,8 @@ class Reject(BatchProvider):
 
             batch = self.upstream_provider.request_batch(request)
             mask_ratio = batch.volumes[self.mask_volume_type].data.mean()
+
+            self.num_candidates += 1
             have_good_batch = mask_ratio>=self.min_masked
 
             if not have_good_batch:
@@ -50,7 +96,25 @@ class Reject(BatchProvider):
 
         logger.debug("good batch with mask ratio %f found at "%mask_ratio + str(batch.volumes[self.mask_volume_type].roi))
 
+        self.num_accepted += 1
+        self.num_batches += 1
+        if self.report_every > 0 and self.num_batches%self.report_every == 0:
+            self.__report_statistics()
+
         timing.stop()
         batch.profiling_stats.add(timing)
 
         return batch
+
+    def __report_statistics(self):
+
+        if self.num_candidates == 0:
+            return
+
+        statistics = self.get_statistics()
+        logger.info(
+                "delivered %d batches, accepted %d out of %d candidates (acceptance rate %.3f)"%(
+                    statistics['batches'],
+                    statistics['accepted'],
+                    statistics['candidates'],
+                    statistics['acceptance_rate']))
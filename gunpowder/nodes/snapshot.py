@@ -11,6 +11,8 @@ logger = logging.getLogger(__name__)
 class Snapshot(BatchFilter):
     '''Save a passing batch in an HDF file.'''
 
+    pure_prepare = True
+
     def __init__(
             self,
             output_dir='snapshots',
@@ -48,9 +50,6 @@ class Snapshot(BatchFilter):
 
     def prepare(self, request):
 
-        self.record_snapshot = self.n%self.every == 0
-        self.n += 1
-
         # append additional volume requests, don't overwrite existing ones
         for volume_type, roi in self.additional_request.volumes.items():
             if volume_type not in request.volumes:
@@ -58,7 +57,10 @@ class Snapshot(BatchFilter):
 
     def process(self, batch, request):
 
-        if self.record_snapshot:
+        record_snapshot = self.n%self.every == 0
+        self.n += 1
+
+        if record_snapshot:
 
             try:
                 os.makedirs(self.output_dir)
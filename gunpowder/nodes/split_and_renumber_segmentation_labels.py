@@ -1,17 +1,137 @@
+import logging
+import numpy as np
+
 from .batch_filter import BatchFilter
-from gunpowder.ext import malis
+from gunpowder.ext import csgraph, sparse
 from gunpowder.volume import VolumeType
 
+logger = logging.getLogger(__name__)
+
 class SplitAndRenumberSegmentationLabels(BatchFilter):
+    '''Split GT_LABELS into face-connected components of the same label and 
+    number them consecutively, starting at 1.
+
+    Voxels with a label <= 0 are background and stay 0. As with malis' 
+    connected components, components of a single voxel are set to background 
+    as well. The relabelled volume uses the smallest unsigned dtype 
+    that can hold the largest id plus one.
+    '''
 
     def process(self, batch, request):
-        components = batch.volumes[VolumeType.GT_LABELS].data
-        dtype = components.dtype
-        simple_neighborhood = malis.mknhood3d()
-        affinities_from_components = malis.seg_to_affgraph(
-            components,
-            simple_neighborhood)
-        components, _ = malis.connected_components_affgraph(
-            affinities_from_components,
-            simple_neighborhood)
-        batch.volumes[VolumeType.GT_LABELS].data = components.astype(dtype)
+
+        gt_labels = batch.volumes[VolumeType.GT_LABELS]
+        components, counts = split_and_renumber(gt_labels.data)
+        gt_labels.data = components
+
+        # let downstream nodes reuse what we know about the new labels
+        ids = np.arange(len(counts), dtype=components.dtype)
+        gt_labels.set_derived('unique_labels', (ids[counts > 0], counts[counts > 0]))
+        gt_labels.set_derived('max_label', ids[-1])
+
+def split_and_renumber(labels, chunk_size=2**18):
+    '''Relabel face-connected components of the same foreground label with 
+    consecutive ids. See SplitAndRenumberSegmentationLabels.
+
+    Components are found in chunks of about 'chunk_size' voxels along the 
+    first axis and merged across the chunk faces afterwards, such that the 
+    memory needed apart from the result is 4 bytes per voxel plus a constant 
+    amount per chunk.
+
+    Returns the relabelled volume and the number of voxels for each id.
+    '''
+
+    index_dtype = np.int32 if labels.size < 2**31 else np.int64
+
+    # foreground components of each chunk, with ids unique over all chunks
+    components = np.zeros(labels.shape, dtype=index_dtype)
+    num_components = 0
+    chunks = list(get_chunks(labels, chunk_size))
+    for chunk in chunks:
+        chunk_components, n = find_components(labels[chunk], index_dtype)
+        chunk_components[chunk_components > 0] += num_components
+        components[chunk] = chunk_components
+        num_components += n
+
+    # merge components of the same label that touch across chunk faces
+    u = []
+    v = []
+    for chunk in chunks[1:]:
+        head = labels[chunk[0].start - 1]
+        tail = labels[chunk[0].start]
+        same = (head == tail) & (head > 0)
+        u.append(components[chunk[0].start - 1][same])
+        v.append(components[chunk[0].start][same])
+
+    if len(u) > 0:
+        u = np.concatenate(u)
+        v = np.concatenate(v)
+    graph = sparse.coo_matrix(
+            (np.ones(len(u), dtype=bool), (u, v)),
+            shape=(num_components + 1, num_components + 1))
+    del u, v
+
+    # merged components are numbered in the order of their first voxel, the 
+    # background stays 0
+    _, merged = csgraph.connected_components(graph, directed=False)
+    sizes = np.bincount(merged, weights=np.bincount(components.ravel(), minlength=num_components + 1)).astype(np.int64)
+
+    # set single-voxel components to background and number the others 
+    # consecutively
+    keep = sizes > 1
+    keep[0] = False
+    num_components = int(np.count_nonzero(keep))
+    renumber = np.cumsum(keep)*keep
+
+    logger.debug("split labels into %d components"%num_components)
+
+    counts = np.concatenate([[labels.size - sizes[keep].sum()], sizes[keep]])
+
+    dtype = np.min_scalar_type(num_components + 1)
+    return renumber.astype(dtype)[merged][components], counts
+
+def find_components(labels, index_dtype):
+    '''Find face-connected components of the same foreground label. Returns 
+    the components, numbered from 1 in the order of their first voxel with 0 
+    for background, and the number of components.'''
+
+    index = np.arange(labels.size, dtype=index_dtype).reshape(labels.shape)
+
+    # edges between face neighbors with the same foreground label
+    u = []
+    v = []
+    for d in range(labels.ndim):
+
+        head = (slice(None),)*d + (slice(None, -1),)
+        tail = (slice(None),)*d + (slice(1, None),)
+
+        same = labels[head] == labels[tail]
+        same &= labels[head] > 0
+
+        u.append(index[head][same])
+        v.append(index[tail][same])
+
+    u = np.concatenate(u)
+    v = np.concatenate(v)
+    graph = sparse.coo_matrix(
+            (np.ones(len(u), dtype=bool), (u, v)),
+            shape=(labels.size, labels.size))
+    del u, v, index
+
+    # background voxels have no edges and end up in single-voxel components
+    num_components, components = csgraph.connected_components(graph, directed=False)
+
+    foreground = np.zeros((num_components,), dtype=bool)
+    foreground[components[labels.ravel() > 0]] = True
+    renumber = (np.cumsum(foreground)*foreground).astype(index_dtype)
+
+    return renumber[components].reshape(labels.shape), int(np.count_nonzero(foreground))
+
+def get_chunks(volume, chunk_size):
+    '''Split a volume along its first axis into chunks of about 'chunk_size' 
+    voxels.'''
+
+    section_size = max(1, volume.size//max(1, volume.shape[0]))
+    step = max(1, chunk_size//section_size)
+    return [
+        (slice(begin, min(volume.shape[0], begin + step)),)
+        for begin in range(0, volume.shape[0], step) ]
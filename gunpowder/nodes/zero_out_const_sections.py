@@ -1,7 +1,8 @@
-from .batch_filter import BatchFilter
-from gunpowder.volume import VolumeType
+import numpy as np
 
-class ZeroOutConstSections(BatchFilter):
+from .pointwise_filter import PointwiseFilter
+
+class ZeroOutConstSections(PointwiseFilter):
     '''Every z-section that has constant values only will be set to 0.
 
     This is to handle blank (missing) sections in a less invasive way: Instead 
@@ -12,12 +13,13 @@ class ZeroOutConstSections(BatchFilter):
     intensity manipulations.
     '''
 
-    def process(self, batch, request):
+    def process_raw(self, raw):
 
-        assert batch.get_total_roi().dims() == 3, "This filter only works on 3D data."
+        assert raw.roi.dims() == 3, "This filter only works on 3D data."
 
-        raw = batch.volumes[VolumeType.RAW]
+        # a section is constant if its in-plane value range is zero
+        in_plane = tuple(range(1, raw.data.ndim))
+        const_sections = np.ptp(raw.data, axis=in_plane) == 0
 
-        for z in range(batch.get_total_roi().get_shape()[0]):
-            if raw.data[z].min() == raw.data[z].max():
-                raw.data[z] = 0
+        raw.data[const_sections] = 0
+        raw.invalidate()
@@ -4,13 +4,45 @@ except:
     import queue as Queue
 import logging
 import multiprocessing
+from multiprocessing.connection import wait
+from multiprocessing.reduction import ForkingPickler
+import numpy as np
 import os
 import sys
+import threading
 import time
 import traceback
 
+from gunpowder.ext import threadpoolctl
+
 logger = logging.getLogger(__name__)
 
+# (pool index, worker index) pairs this process was started as, outermost 
+# pool first (empty in the main process), or None in a restarted worker
+_worker_path = ()
+
+# indices of the pools currently running in this process
+_pool_indices = set()
+_pool_indices_lock = threading.Lock()
+
+def get_worker_path():
+    '''Get the workers the current process was started as in (possibly 
+    nested) producer pools, as a tuple of (pool index, worker index) pairs, 
+    outermost pool first. Pools running side by side in the same process get 
+    different pool indices, which are reused once a pool is stopped. The path 
+    is empty in the main process, and None in workers that were restarted 
+    (see 'max_restarts').'''
+    return _worker_path
+
+# environment variables to limit the threads of native libraries
+THREAD_LIMIT_VARIABLES = [
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS'
+]
+
 class NoResult(Exception):
     pass
 
@@ -19,10 +51,146 @@ class WorkersDied(Exception):
 
 class ProducerPool(object):
 
-    def __init__(self, callables, queue_size=10):
+    def __init__(
+            self,
+            callables,
+            queue_size=10,
+            max_bytes=None,
+            get_nbytes=None,
+            min_workers=None,
+            autoscale_window=20,
+            autoscale_wait=0.01,
+            autoscale_patience=2,
+            cpu_affinity=None,
+            num_threads=None,
+            max_restarts=None,
+            restart_window=3600):
+        '''Create a pool of producers.
+
+        Args:
+
+            callables: list of callables
+
+                One per worker, each call should return the next item.
+
+            queue_size: int
+
+                How many items to keep in the result queue at most.
+
+            max_bytes: int or None
+
+                How many bytes of items to keep in the result queue at most, 
+                as measured by 'get_nbytes'. Workers wait with placing their 
+                items until enough bytes have been consumed. A single item is 
+                always placed, even if it exceeds the budget.
+
+            get_nbytes: callable or None
+
+                Returns the number of bytes of an item. If given, the current 
+                and peak bytes in the result queue are tracked (see 
+                'get_queued_bytes').
+
+            min_workers: int or None
+
+                If given, the number of running workers is scaled between 
+                'min_workers' and the number of callables, starting with 
+                'min_workers'. Every 'autoscale_window' calls to 'get', a worker 
+                is added if the caller waited on average longer than 
+                'autoscale_wait' seconds for an item, and a worker is retired 
+                if the caller did not wait and the result queue is more than 
+                3/4 full. Either has to happen 'autoscale_patience' times in a 
+                row before the number of workers is changed.
+
+            cpu_affinity: None, 'cores', 'numa', or list of lists of int
+
+                How to pin workers to CPUs (Linux only). With 'cores', each 
+                worker gets its own block of the available CPUs, not spanning 
+                several NUMA nodes. With 'numa', workers are assigned to NUMA 
+                nodes round-robin and can run on all CPUs of their node. A 
+                list gives the CPUs for each callable explicitly.
+
+            num_threads: int or None
+
+                If given, limit the threads of OpenMP, MKL, OpenBLAS, and 
+                similar libraries in each worker. The limit is set through 
+                environment variables (for libraries loaded by the worker) and 
+                through threadpoolctl, if installed (for libraries already 
+                loaded).
+
+            max_restarts: int or None
+
+                If None (the default), the pool shuts down as soon as one of 
+                the workers dies (e.g., killed because it ran out of memory), 
+                and 'get' raises WorkersDied. Otherwise, dead workers are 
+                restarted, unless more than 'max_restarts' restarts happened 
+                in the last 'restart_window' seconds. The item a worker was 
+                producing when it died is lost, the restarted worker produces 
+                a new one.
+
+            restart_window: float
+
+                The time window in seconds to count restarts in.
+        '''
+        assert max_bytes is None or get_nbytes is not None, "max_bytes needs get_nbytes"
+        assert min_workers is None or 0 < min_workers <= len(callables), "min_workers has to be between 1 and the number of callables"
+
         self.__watch_dog = multiprocessing.Process(target=self.__run_watch_dog, args=(callables,))
-        self.__stop = multiprocessing.Event()
-        self.__result_queue = multiprocessing.Queue(queue_size)
+
+        # each worker sends its items through its own pipe to the watchdog, 
+        # which forwards them through this pipe to the caller, such that a 
+        # worker dying in the middle of sending an item only breaks its own 
+        # pipe
+        self.__result_reader, self.__result_writer = multiprocessing.Pipe(duplex=False)
+
+        # in the watchdog, the pipes from the workers as [connection, size of 
+        # the next item or None if not announced yet]
+        self.__channels = []
+
+        # taken by callers of 'get', which can be in several processes forked 
+        # after 'start'
+        self.__get_lock = multiprocessing.Lock()
+        self.__owner_pid = None
+        self.__pool_index = None
+
+        # messages from the caller to the watchdog ('stop', 'scale', or 
+        # 'consumed'), such that it can wait for them together with its 
+        # workers
+        self.__control_reader, self.__control_writer = multiprocessing.Pipe(duplex=False)
+
+        self.__max_bytes = max_bytes
+        self.__get_nbytes = get_nbytes
+        # bytes of items forwarded by the watchdog but not consumed yet, only 
+        # increased by the watchdog and only decreased by the caller
+        self.__queued_bytes = multiprocessing.Value('L', 0)
+        self.__peak_bytes = multiprocessing.Value('L', 0)
+
+        # number of items forwarded by the watchdog and consumed by the caller
+        self.__num_forwarded = multiprocessing.Value('L', 0)
+        self.__num_consumed = multiprocessing.Value('L', 0)
+
+        self.__max_restarts = max_restarts
+        self.__restart_window = restart_window
+        self.__restart_times = []
+        self.__num_restarts = multiprocessing.Value('i', 0)
+
+        self.__queue_size = queue_size
+        self.__min_workers = min_workers
+        self.__max_workers = len(callables)
+        self.__num_workers = multiprocessing.Value('i', len(callables) if min_workers is None else min_workers)
+        self.__retire = [ multiprocessing.Event() for c in callables ]
+        self.__autoscale_window = autoscale_window
+        self.__autoscale_wait = autoscale_wait
+        self.__autoscale_patience = autoscale_patience
+        self.__waits = []
+        self.__votes = 0
+
+        self.__num_threads = num_threads
+        if cpu_affinity is None or isinstance(cpu_affinity, list):
+            self.__cpu_affinity = cpu_affinity
+        else:
+            self.__cpu_affinity = assign_cpus(len(callables), cpu_affinity)
+        if self.__cpu_affinity is not None:
+            assert len(self.__cpu_affinity) == len(callables), "cpu_affinity needs one list of CPUs per callable"
 
     def __del__(self):
         self.stop()
@@ -34,49 +202,114 @@ class ProducerPool(object):
             logger.warning("trying to start workers, but they are already running")
             return
 
-        self.__stop.clear()
+        # take the smallest free index, such that pipelines that are built 
+        # again get the same indices
+        with _pool_indices_lock:
+            self.__pool_index = 0
+            while self.__pool_index in _pool_indices:
+                self.__pool_index += 1
+            _pool_indices.add(self.__pool_index)
+
         self.__watch_dog.start()
+        self.__owner_pid = os.getpid()
+
+        # only the watchdog sends results, such that reading from the pipe 
+        # fails instead of blocking if it dies in the middle of sending one
+        self.__result_writer.close()
 
     def get(self, timeout=0):
         '''Return the next result from the producer pool.
 
         If timeout is set and there is not result after the given number of 
-        seconds, exception NoResult is raised.
+        seconds, exception NoResult is raised. Can also be called from 
+        processes forked after 'start', each item is returned only once.
         '''
 
-        block = False
-        if timeout == 0:
-            timeout = 1
-            block = True
+        start = time.time()
+        deadline = None if timeout == 0 else start + timeout
 
-        item = None
-        while item == None:
+        while True:
 
             if not self.alive():
                 raise WorkersDied()
 
-            try:
-                item = self.__result_queue.get(timeout=timeout)
-            except Queue.Empty:
-                if not block:
-                    raise NoResult()
+            with self.__get_lock:
+                # another caller might have taken the item in the meantime
+                if self.__result_reader.poll():
+                    item = self.__take_result()
+                    break
+
+            # wait until either an item arrives or the watchdog exits (because 
+            # it was stopped or one of the workers died)
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if len(wait([self.__result_reader, self.__watch_dog.sentinel], remaining)) == 0:
+                raise NoResult()
+
+        if self.__min_workers is not None:
+            self.__autoscale(time.time() - start)
 
         if isinstance(item, Exception):
             raise item
         return item
 
+    def __take_result(self):
+
+        try:
+            nbytes = self.__result_reader.recv()
+            item = self.__result_reader.recv()
+        except (EOFError, OSError):
+            # the watchdog died while sending the item
+            raise WorkersDied()
+
+        if nbytes > 0:
+            with self.__queued_bytes.get_lock():
+                self.__queued_bytes.value -= nbytes
+        self.__num_consumed.value += 1
+
+        # let the watchdog forward the next item
+        self.__control_writer.send('consumed')
+
+        return item
+
+    def get_num_workers(self):
+        '''Get the number of workers that should be running.'''
+        return self.__num_workers.value
+
+    def get_num_restarts(self):
+        '''Get the number of times a dead worker was restarted.'''
+        return self.__num_restarts.value
+
+    def get_queued_bytes(self):
+        '''Get the current and peak number of bytes of items in the result 
+        queue (only tracked if 'get_nbytes' was given).'''
+        return (self.__queued_bytes.value, self.__peak_bytes.value)
+
     def stop(self):
         '''Stop the pool of producers.
 
         Items currently being produced will not be waited for and be discarded.'''
 
-        self.__stop.set()
+        # never started, or called in a forked process
+        if self.__watch_dog.pid is None or os.getpid() != self.__owner_pid:
+            return
+
+        self.__control_writer.send('stop')
         self.__watch_dog.join()
 
+        # release the index only once, another pool might have taken it 
+        # since
+        with _pool_indices_lock:
+            if self.__pool_index is not None:
+                _pool_indices.discard(self.__pool_index)
+                self.__pool_index = None
+
     def alive(self):
         '''Test if the pool is alive (i.e., all workers are running).
         '''
-        return self.__watch_dog.is_alive()
+        if self.__watch_dog.pid is None:
+            return False
+        # unlike 'is_alive', works in forked processes as well
+        return len(wait([self.__watch_dog.sentinel], 0)) == 0
 
     def __run_watch_dog(self, callables):
 
@@ -85,26 +318,50 @@ class ProducerPool(object):
         logger.debug("watchdog started with PID " + str(os.getpid()))
         logger.debug("parent PID " + str(parent_pid))
 
-        workers = [ multiprocessing.Process(target=self.__run_worker, args=(c,)) for c in callables ]
+        # one slot per callable, None if no worker is running for it
+        workers = [None]*len(callables)
+        restarted = [False]*len(callables)
 
-        try:
+        # forwarded items waiting to be sent to the caller
+        results = Queue.Queue()
+        sender = threading.Thread(target=self.__send_results, args=(results,))
+        sender.daemon = True
+        sender.start()
 
-            logger.debug("starting %d workers"%len(workers))
-            for worker in workers:
-                worker.start()
+        try:
 
-            while not self.__stop.wait(1):
+            while True:
                 if os.getppid() != parent_pid:
                     logger.error("parent of producer pool died, shutting down")
                     break
-                if not self.__all_workers_alive(workers):
+                if not self.__supervise_workers(workers, restarted, callables):
                     logger.error("at least one of my workers died, shutting down")
                     break
+
+                self.__receive_results(results)
+
+                # wake up as soon as a worker exits, a worker has an item that 
+                # can be forwarded, or the caller sends a message, and every 
+                # second to check on the parent
+                sentinels = [ worker.sentinel for worker in workers if worker is not None ]
+                channels = [
+                    connection for connection, nbytes in self.__channels
+                    if nbytes is None or self.__may_forward(nbytes) ]
+                wait([self.__control_reader] + sentinels + channels, 1)
+
+                stop = False
+                while self.__control_reader.poll():
+                    if self.__control_reader.recv() == 'stop':
+                        stop = True
+                if stop:
+                    break
         except:
             pass
 
         finally:
 
+            workers = [ worker for worker in workers if worker is not None ]
+
             logger.info("terminating workers...")
             for worker in workers:
                 worker.terminate()
@@ -115,42 +372,307 @@ class ProducerPool(object):
 
             logger.info("done")
 
-    def __run_worker(self, target):
+    def __supervise_workers(self, workers, restarted, callables):
+        '''Start and retire workers to match the requested number of workers. 
+        Returns False if a worker died without being asked to.'''
+
+        for i, worker in enumerate(workers):
+            if worker is not None and not worker.is_alive():
+
+                worker.join()
+                workers[i] = None
+
+                if self.__retire[i].is_set():
+                    logger.debug("worker %d retired"%i)
+                    continue
+
+                if not self.__may_restart():
+                    return False
+
+                self.__num_restarts.value += 1
+                restarted[i] = True
+                logger.warning(
+                        "worker %d died with exit code %s, restarting it (%d restarts so far)"%(
+                            i, worker.exitcode, self.__num_restarts.value))
+
+        running = [
+            i for i, worker in enumerate(workers)
+            if worker is not None and not self.__retire[i].is_set() ]
+        num_workers = self.__num_workers.value
+
+        for i, worker in enumerate(workers):
+            if len(running) >= num_workers:
+                break
+            if worker is None:
+                logger.debug("starting worker %d"%i)
+                self.__retire[i].clear()
+                reader, writer = multiprocessing.Pipe(duplex=False)
+                workers[i] = multiprocessing.Process(target=self.__run_worker, args=(i, callables[i], writer, self.__retire[i], restarted[i]))
+                workers[i].start()
+                # the pipe is closed once the worker exited
+                writer.close()
+                self.__channels.append([reader, None])
+                running.append(i)
+
+        while len(running) > num_workers:
+            i = running.pop()
+            logger.debug("retiring worker %d"%i)
+            self.__retire[i].set()
+
+        return True
+
+    def __receive_results(self, results):
+        '''Forward the items the workers sent, as long as they fit in the 
+        result queue. Pipes of exited workers are closed once they are empty, 
+        such that items of retired workers are not lost.'''
+
+        for channel in list(self.__channels):
+
+            connection, nbytes = channel
+
+            try:
+
+                if nbytes is None:
+                    if not connection.poll():
+                        continue
+                    nbytes = channel[1] = connection.recv()
+
+                if not self.__may_forward(nbytes):
+                    continue
+
+                item = connection.recv_bytes()
+
+            except (EOFError, OSError):
+                # the worker exited, possibly in the middle of sending an item
+                connection.close()
+                self.__channels.remove(channel)
+                continue
+
+            with self.__queued_bytes.get_lock():
+                self.__queued_bytes.value += nbytes
+                self.__peak_bytes.value = max(self.__peak_bytes.value, self.__queued_bytes.value)
+            self.__num_forwarded.value += 1
+
+            results.put((nbytes, item))
+            channel[1] = None
+
+    def __may_forward(self, nbytes):
+
+        if self.__num_forwarded.value - self.__num_consumed.value >= self.__queue_size:
+            return False
+
+        if self.__max_bytes is None:
+            return True
+
+        queued_bytes = self.__queued_bytes.value
+        return queued_bytes == 0 or queued_bytes + nbytes <= self.__max_bytes
+
+    def __send_results(self, results):
+
+        while True:
+            nbytes, item = results.get()
+            try:
+                self.__result_writer.send(nbytes)
+                self.__result_writer.send_bytes(item)
+            except (EOFError, OSError):
+                # the caller is gone, the watchdog notices that as well
+                return
+
+    def __may_restart(self):
+
+        if self.__max_restarts is None:
+            return False
+
+        now = time.time()
+        self.__restart_times = [ t for t in self.__restart_times if t > now - self.__restart_window ]
+        if len(self.__restart_times) >= self.__max_restarts:
+            logger.error("more than %d workers died in the last %ds, giving up"%(self.__max_restarts, self.__restart_window))
+            return False
+
+        self.__restart_times.append(now)
+        return True
+
+    def __autoscale(self, wait):
+
+        self.__waits.append(wait)
+        if len(self.__waits) < self.__autoscale_window:
+            return
+
+        mean_wait = sum(self.__waits)/len(self.__waits)
+        self.__waits = []
+
+        fill = float(self.__num_forwarded.value - self.__num_consumed.value)/self.__queue_size
+
+        num_workers = self.__num_workers.value
+
+        if mean_wait > self.__autoscale_wait and num_workers < self.__max_workers:
+            self.__votes = max(1, self.__votes + 1)
+        elif mean_wait < 0.1*self.__autoscale_wait and fill > 0.75 and num_workers > self.__min_workers:
+            self.__votes = min(-1, self.__votes - 1)
+        else:
+            self.__votes = 0
+
+        if abs(self.__votes) < self.__autoscale_patience:
+            return
+
+        change = 1 if self.__votes > 0 else -1
+        self.__votes = 0
+        self.__num_workers.value = num_workers + change
+        self.__control_writer.send('scale')
+
+        logger.info(
+                "waited %.3fs per item, result queue %d%% full: %s worker, %d workers now"%(
+                    mean_wait,
+                    100*fill,
+                    "adding a" if change > 0 else "retiring a",
+                    num_workers + change))
+
+    def __run_worker(self, i, target, connection, retire, restarted):
+
+        global _worker_path, _pool_indices
+        if restarted or _worker_path is None:
+            _worker_path = None
+        else:
+            _worker_path = _worker_path + ((self.__pool_index, i),)
+
+        # pools started in this worker are one level down
+        _pool_indices = set()
+
+        # keep only our own end of the pipes, such that the caller notices 
+        # when the watchdog dies, and we notice when the watchdog dies while 
+        # we are sending
+        self.__result_writer.close()
+        for other, _ in self.__channels:
+            other.close()
 
         parent_pid = os.getppid()
 
         logger.debug("worker started with PID " + str(os.getpid()))
         logger.debug("parent PID " + str(parent_pid))
 
-        result = None
+        self.__limit_resources(i)
+
+        if restarted:
+            # don't replay the random numbers of the worker that died
+            np.random.seed()
+
         while True:
 
             if os.getppid() != parent_pid:
                 logger.debug("worker %d: watch-dog died, stopping"%os.getpid())
                 break
 
-            if result is None:
-
-                try:
-                    result = target()
-                except Exception as e:
-                    result = e
-                    traceback.print_exc()
-                    # don't stop on normal exceptions -- place them in result queue 
-                    # and let them be handled by caller
-                except:
-                    logger.error("received error: " + str(sys.exc_info()[0]))
-                    # this is most likely a keyboard interrupt, stop process
-                    break
+            if retire.is_set():
+                logger.debug("worker %d: retiring"%os.getpid())
+                break
+
+            try:
+                result = target()
+            except Exception as e:
+                result = e
+                traceback.print_exc()
+                # don't stop on normal exceptions -- place them in result queue 
+                # and let them be handled by caller
+            except:
+                logger.error("received error: " + str(sys.exc_info()[0]))
+                # this is most likely a keyboard interrupt, stop process
+                break
+
+            if self.__get_nbytes is None or isinstance(result, Exception):
+                nbytes = 0
+            else:
+                nbytes = self.__get_nbytes(result)
 
+            # announce the size first, such that the watchdog can wait with 
+            # receiving the item until it fits in the result queue
             try:
-                self.__result_queue.put(result, timeout=1)
-                result = None
-            except Queue.Full:
-                logger.debug("worker %d: result queue is full, waiting to place my result"%os.getpid())
+                connection.send(nbytes)
+                connection.send_bytes(ForkingPickler.dumps(result))
+            except (EOFError, OSError):
+                logger.debug("worker %d: watch-dog died, stopping"%os.getpid())
+                break
 
+        # everything sent is in the pipe now, the watchdog will still receive 
+        # it after we exit
         logger.debug("worker with PID " + str(os.getpid()) + " exiting")
         os._exit(1)
 
-    def __all_workers_alive(self, workers):
-        return all([ worker.is_alive() for worker in workers ])
+    def __limit_resources(self, i):
+
+        if self.__cpu_affinity is not None:
+            cpus = self.__cpu_affinity[i]
+            logger.debug("worker %d: running on CPUs %s"%(os.getpid(), cpus))
+            os.sched_setaffinity(0, cpus)
+
+        if self.__num_threads is not None:
+            logger.debug("worker %d: limiting native libraries to %d threads"%(os.getpid(), self.__num_threads))
+            for variable in THREAD_LIMIT_VARIABLES:
+                os.environ[variable] = str(self.__num_threads)
+            try:
+                threadpoolctl.threadpool_limits(self.__num_threads)
+            except ImportError:
+                pass
+
+def get_numa_nodes():
+    '''Get the CPUs this process is allowed to run on, as a list of lists, one 
+    per NUMA node. If the NUMA topology is not known, all CPUs are assumed to 
+    be on the same node.'''
+
+    available = os.sched_getaffinity(0)
+
+    nodes = []
+    node_dir = '/sys/devices/system/node'
+    if os.path.isdir(node_dir):
+        for name in sorted(os.listdir(node_dir)):
+            if not name.startswith('node') or not name[4:].isdigit():
+                continue
+            with open(os.path.join(node_dir, name, 'cpulist')) as f:
+                cpus = parse_cpu_list(f.read())
+            cpus = [ cpu for cpu in cpus if cpu in available ]
+            if len(cpus) > 0:
+                nodes.append(cpus)
+
+    if len(nodes) == 0:
+        nodes = [sorted(available)]
+
+    return nodes
+
+def parse_cpu_list(cpu_list):
+    '''Parse a CPU list like "0-3,8,10-11".'''
+
+    cpus = []
+    for part in cpu_list.strip().split(','):
+        if part == '':
+            continue
+        if '-' in part:
+            begin, end = part.split('-')
+            cpus += range(int(begin), int(end) + 1)
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def assign_cpus(num_workers, strategy):
+    '''Get a list of CPUs for each worker, following the given strategy 
+    ('cores' or 'numa', see ProducerPool).'''
+
+    nodes = get_numa_nodes()
+
+    if strategy == 'numa':
+        return [ nodes[i%len(nodes)] for i in range(num_workers) ]
+
+    if strategy != 'cores':
+        raise RuntimeError("unknown CPU affinity strategy %s"%strategy)
+
+    # split each node into blocks, with the number of blocks per node 
+    # proportional to its number of CPUs
+    num_cpus = sum(len(cpus) for cpus in nodes)
+    blocks = []
+    for cpus in nodes:
+        num_blocks = max(1, int(round(float(num_workers)*len(cpus)/num_cpus)))
+        block_size = max(1, len(cpus)//num_blocks)
+        for b in range(min(num_blocks, len(cpus))):
+            end = len(cpus) if b == num_blocks - 1 else (b + 1)*block_size
+            blocks.append(cpus[b*block_size:end])
+
+    # more workers than CPUs share blocks
+    return [ blocks[i%len(blocks)] for i in range(num_workers) ]
@@ -1,5 +1,6 @@
 import time
 
+from .dry_run import format_bytes
 from .freezable import Freezable
 
 class Timing(Freezable):
@@ -32,6 +33,20 @@ class Timing(Freezable):
     def __repr__(self):
         return self.__name + ": " + str(self.__time)
 
+class MemoryUsage(Freezable):
+
+    def __init__(self, instance, current_bytes, peak_bytes):
+        self.__name = type(instance).__name__
+        self.current_bytes = current_bytes
+        self.peak_bytes = peak_bytes
+        self.freeze()
+
+    def get_name(self):
+        return self.__name
+
+    def __repr__(self):
+        return self.__name + ": " + format_bytes(self.current_bytes) + " (peak " + format_bytes(self.peak_bytes) + ")"
+
 class ProfilingStats(Freezable):
 
     def __init__(self):
@@ -41,6 +56,10 @@ class ProfilingStats(Freezable):
     def add(self, timing):
         self.__timings.append(timing)
 
+    def merge_with(self, other):
+        '''Add all timings of another ProfilingStats.'''
+        self.__timings += other.__timings
+
     def __repr__(self):
         rep = ""
         for t in self.__timings:
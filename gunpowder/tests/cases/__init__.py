@@ -1,2 +1,21 @@
 from .provider_test import ProviderTest
 from .normalize import TestNormalize
+from .pointwise_fusion import TestPointwiseFusion
+from .grow_boundary import TestGrowBoundary
+from .add_gt_affinities import TestAddGtAffinities
+from .split_and_renumber_segmentation_labels import TestSplitAndRenumberSegmentationLabels
+from .random_location import TestRandomLocation
+from .balanced_random_location import TestBalancedRandomLocation
+from .reject import TestReject
+from .dry_run import TestDryRun
+from .precache import TestPreCache
+from .import_time import TestImportTime
+from .parallel_setup import TestParallelSetup
+from .lazy_volume import TestLazyVolume
+from .minibatch import TestMinibatch
+from .producer_pool import TestProducerPool
+from .derived_data import TestDerivedData
+from .defect_augment import TestDefectAugment
+from .exclude_labels import TestExcludeLabels
+from .random_provider import TestRandomProvider
+from .pad import TestPad
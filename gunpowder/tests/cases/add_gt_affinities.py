@@ -0,0 +1,37 @@
+from .provider_test import ProviderTest, TestSourceLabels
+from gunpowder import *
+import numpy as np
+
+class TestAddGtAffinities(ProviderTest):
+
+    def test_output(self):
+
+        np.random.seed(42)
+        labels = np.random.randint(0, 4, size=(20,20,20)).astype(np.uint64)
+
+        neighborhood = np.array([
+                [-1, 0, 0], [0, -1, 0], [0, 0, -1],
+                [2, 0, 0], [0, -3, 1]])
+
+        request = BatchRequest()
+        request.volumes[VolumeType.GT_LABELS] = Roi((5,5,5), (10,10,10))
+        request.volumes[VolumeType.GT_AFFINITIES] = Roi((5,5,5), (10,10,10))
+
+        for dtype in [np.float32, np.uint8, bool]:
+
+            pipeline = (
+                    TestSourceLabels(labels) +
+                    AddGtAffinities(neighborhood, dtype=dtype))
+
+            with build(pipeline):
+                batch = pipeline.request_batch(request)
+
+            affinities = batch.volumes[VolumeType.GT_AFFINITIES].data
+            self.assertEqual(affinities.dtype, dtype)
+            self.assertEqual(affinities.shape, (5,10,10,10))
+
+            for e, (dz, dy, dx) in enumerate(neighborhood):
+                for (z, y, x) in [(0,0,0), (3,4,5), (9,9,9), (9,0,4)]:
+                    a = labels[5+z, 5+y, 5+x]
+                    b = labels[5+z+dz, 5+y+dy, 5+x+dx]
+                    self.assertEqual(affinities[e,z,y,x], a == b and a > 0)
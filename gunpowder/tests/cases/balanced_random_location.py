@@ -0,0 +1,73 @@
+from .provider_test import ProviderTest, TestSourceLabels
+from gunpowder import *
+from gunpowder.producer_pool import get_worker_path
+import numpy as np
+
+class WorkerSourceLabels(TestSourceLabels):
+    '''Provides the index of the ProducerPool worker as GT_MASK.'''
+
+    def provide(self, request):
+
+        batch = super(WorkerSourceLabels, self).provide(request)
+        if VolumeType.GT_MASK in batch.volumes and get_worker_path():
+            batch.volumes[VolumeType.GT_MASK].data[:] = get_worker_path()[-1][1]
+        return batch
+
+class TestBalancedRandomLocation(ProviderTest):
+
+    def test_output(self):
+
+        labels = np.zeros((20,20,20), dtype=np.uint64)
+        labels[10,10,10] = 1
+        labels[5:8,5:8,5:8] = 2
+
+        request = BatchRequest()
+        request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (4,4,4))
+
+        pipeline = (
+                TestSourceLabels(labels) +
+                BalancedRandomLocation(weights={1: 1.0, 2: 1.0}))
+
+        found = {1: 0, 2: 0}
+        with build(pipeline):
+            for i in range(100):
+                batch = pipeline.request_batch(request)
+                data = batch.volumes[VolumeType.GT_LABELS].data
+                self.assertTrue(data.max() > 0)
+                for label in found:
+                    if label in data:
+                        found[label] += 1
+
+        # the single-voxel label is seen roughly half of the time
+        self.assertTrue(found[1] > 20)
+        self.assertTrue(found[2] > 20)
+
+    def test_precache(self):
+
+        # single voxels of five labels, far enough apart to be contained in a 
+        # batch one at a time
+        labels = np.zeros((40,40,40), dtype=np.uint64)
+        for label in range(1, 6):
+            labels[label*6,label*6,label*6] = label
+        mask = np.zeros(labels.shape, dtype=np.uint8)
+
+        request = BatchRequest()
+        request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (4,4,4))
+        request.volumes[VolumeType.GT_MASK] = Roi((0,0,0), (4,4,4))
+
+        pipeline = (
+                WorkerSourceLabels(labels, mask) +
+                BalancedRandomLocation() +
+                PreCache(request, cache_size=2, num_workers=2))
+
+        # each worker draws its own sequence of labels
+        sequences = {}
+        with build(pipeline):
+            for i in range(40):
+                batch = pipeline.request_batch(request)
+                worker = batch.volumes[VolumeType.GT_MASK].data[0,0,0]
+                sequences.setdefault(worker, []).append(batch.volumes[VolumeType.GT_LABELS].data.max())
+
+        sequences = [ s[:8] for s in sequences.values() if len(s) >= 8 ]
+        self.assertEqual(len(sequences), 2)
+        self.assertNotEqual(sequences[0], sequences[1])
@@ -0,0 +1,89 @@
+from .provider_test import ProviderTest
+from gunpowder import *
+import numpy as np
+
+class TestSourceRaw(BatchProvider):
+
+    def get_spec(self):
+
+        spec = ProviderSpec()
+        spec.volumes[VolumeType.RAW] = Roi((0,0,0), (100,100,100))
+        return spec
+
+    def provide(self, request):
+
+        batch = Batch()
+        roi = request.volumes[VolumeType.RAW]
+        batch.volumes[VolumeType.RAW] = Volume(
+                np.zeros(roi.get_shape(), dtype=np.float32),
+                roi,
+                (1,1,1),
+                True)
+        return batch
+
+class TestArtifactSource(BatchProvider):
+
+    def get_spec(self):
+
+        spec = ProviderSpec()
+        spec.volumes[VolumeType.RAW] = None
+        spec.volumes[VolumeType.ALPHA_MASK] = None
+        return spec
+
+    def provide(self, request):
+
+        batch = Batch()
+        for volume_type in [VolumeType.RAW, VolumeType.ALPHA_MASK]:
+            roi = request.volumes[volume_type]
+            data = np.ones(roi.get_shape(), dtype=np.float32)
+            if volume_type == VolumeType.RAW:
+                data *= np.random.random()
+            batch.volumes[volume_type] = Volume(data, roi, (1,1,1), True)
+        return batch
+
+class TestDefectAugment(ProviderTest):
+
+    def test_artifact_bank(self):
+
+        request = BatchRequest()
+        request.volumes[VolumeType.RAW] = Roi((0,0,0), (5,10,10))
+
+        defect_augment = DefectAugment(
+                prob_missing=0.0,
+                prob_low_contrast=0.0,
+                prob_artifact=1.0,
+                artifact_source=TestArtifactSource(),
+                num_artifact_workers=2,
+                artifact_shape=(1,20,20))
+
+        pipeline = (
+                TestSourceRaw() +
+                defect_augment +
+                PreCache(request, cache_size=4, num_workers=2))
+
+        np.random.seed(42)
+        with build(pipeline):
+
+            # the bank was started once during setup, not in the PreCache 
+            # workers
+            pool = defect_augment.artifact_pool
+            self.assertTrue(pool is not None)
+            self.assertTrue(pool.alive())
+
+            artifacts = []
+            for i in range(4):
+                batch = pipeline.request_batch(request)
+                raw = batch.volumes[VolumeType.RAW].data
+                for section in raw:
+                    self.assertTrue((section == section[0,0]).all())
+                    artifacts.append(section[0,0])
+
+            self.assertTrue(defect_augment.artifact_pool is pool)
+
+        # stopped in teardown
+        self.assertTrue(defect_augment.artifact_pool is None)
+        self.assertFalse(pool.alive())
+
+        # the bank workers were seeded differently, no artifact was produced 
+        # twice
+        self.assertEqual(len(set(artifacts)), len(artifacts))
@@ -0,0 +1,101 @@
+from .provider_test import ProviderTest, TestSourceLabels
+from gunpowder import *
+import numpy as np
+
+class TestDerivedData(ProviderTest):
+
+    def test_invalidation(self):
+
+        labels = np.arange(4*5*6, dtype=np.uint64).reshape((4,5,6))%7
+
+        batch = Batch()
+        volume = Volume(labels, Roi((0,0,0), (4,5,6)), (1,1,1), False)
+        batch.volumes[VolumeType.GT_LABELS] = volume
+
+        ids, counts = batch.get_unique_labels()
+        self.assertEqual(list(ids), list(range(7)))
+
+        # reading the data keeps derived data
+        volume.data.sum()
+        self.assertTrue(batch.get_unique_labels()[0] is ids)
+
+        # in-place writes have to be announced
+        volume.data[volume.data == 6] = 0
+        volume.invalidate()
+        self.assertEqual(list(batch.get_unique_labels()[0]), list(range(6)))
+        self.assertEqual(batch.get_max_label(), 5)
+
+        # replacing, casting, and cropping invalidate
+        volume.data = volume.data%3
+        self.assertEqual(batch.get_max_label(), 2)
+        volume.cast(np.uint8)
+        self.assertFalse(volume.has_derived('max_label'))
+        batch.get_max_label()
+        volume.crop(Roi((1,1,1), (2,2,2)))
+        self.assertFalse(volume.has_derived('max_label'))
+
+    def test_max_label_from_unique_labels(self):
+
+        batch = Batch()
+        volume = Volume(np.zeros((2,2,2), dtype=np.uint64), Roi((0,0,0), (2,2,2)), (1,1,1), False)
+        batch.volumes[VolumeType.GT_LABELS] = volume
+
+        # stored by the node that created the labels, the data is not scanned
+        volume.set_derived('unique_labels', (np.array([0, 7], dtype=np.uint64), np.array([6, 2])))
+        self.assertEqual(batch.get_max_label(), 7)
+
+    def test_label_nodes(self):
+
+        np.random.seed(42)
+        labels = np.random.randint(0, 3, size=(10,10,10)).astype(np.uint64)
+        labels[2:8,2:8,2:8] = 4
+
+        request = BatchRequest()
+        request.add_volume_request(VolumeType.GT_LABELS, labels.shape)
+        request.add_volume_request(VolumeType.GT_IGNORE, labels.shape)
+
+        # nodes writing to the labels in-place don't leave stale statistics 
+        # behind
+        pipeline = (
+                TestSourceLabels(labels) +
+                SplitAndRenumberSegmentationLabels() +
+                GrowBoundary(steps=1) +
+                ExcludeLabels([1], ignore_mask_erode=1))
+
+        with build(pipeline):
+            batch = pipeline.request_batch(request)
+
+        data = batch.volumes[VolumeType.GT_LABELS].data
+        ids, counts = batch.get_unique_labels()
+        expected_ids, expected_counts = np.unique(data, return_counts=True)
+        self.assertEqual(list(ids), list(expected_ids))
+        self.assertEqual(list(counts), list(expected_counts))
+        self.assertNotIn(1, ids)
+        self.assertEqual(batch.get_max_label(), data.max())
+
+    def test_empty(self):
+
+        for cache_unique_labels in [False, True]:
+
+            batch = Batch()
+            batch.volumes[VolumeType.GT_LABELS] = Volume(np.zeros((0,2,2), dtype=np.uint64), Roi((0,0,0), (0,2,2)), (1,1,1), False)
+
+            if cache_unique_labels:
+                self.assertEqual(len(batch.get_unique_labels()[0]), 0)
+            self.assertEqual(batch.get_max_label(), 0)
+
+    def test_raw_filters(self):
+
+        # pointwise filters writing to the raw data in-place invalidate 
+        # derived data
+        for node in [
+                Normalize(factor=0.5),
+                IntensityScaleShift(2, -1),
+                IntensityAugment(0.9, 1.1, -0.1, 0.1),
+                ZeroOutConstSections()]:
+
+            raw = Volume(np.full((2,3,3), 0.5, dtype=np.float32), Roi((0,0,0), (2,3,3)), (1,1,1), True)
+            raw.get_derived('mean', lambda data: data.mean())
+
+            node.process_raw(raw)
+            self.assertFalse(raw.has_derived('mean'), type(node).__name__)
@@ -0,0 +1,81 @@
+from .provider_test import ProviderTest, TestSource, TestSourceLabels
+from gunpowder import *
+from gunpowder.nodes.pointwise_filter import FusedPointwiseFilter
+import numpy as np
+
+class NoReadSourceLabels(TestSourceLabels):
+
+    def provide(self, request):
+        raise RuntimeError("data was read during dry run")
+
+class CountingSetup(BatchFilter):
+
+    def __init__(self):
+        self.num_setups = 0
+
+    def setup(self):
+        self.num_setups += 1
+
+    def process(self, batch, request):
+        pass
+
+class TestDryRun(ProviderTest):
+
+    def test_setup_once(self):
+
+        request = BatchRequest()
+        request.volumes[VolumeType.RAW] = Roi((0,0,0), (6,10,10))
+
+        counting = CountingSetup()
+        pipeline = (
+                TestSource() +
+                Normalize() +
+                IntensityScaleShift(2, -1) +
+                counting)
+
+        with build(pipeline, dry_run_request=request):
+            fused = pipeline.output.get_upstream_provider()
+            self.assertTrue(isinstance(fused, FusedPointwiseFilter))
+            self.assertEqual(counting.num_setups, 1)
+
+        # the second setup reuses the fused filter
+        with build(pipeline, dry_run_request=request):
+            self.assertTrue(pipeline.output.get_upstream_provider() is fused)
+            self.assertEqual(len(fused.filters), 2)
+            self.assertEqual(counting.num_setups, 2)
+
+    def test_output(self):
+
+        labels = np.zeros((30,40,50), dtype=np.uint64)
+
+        request = BatchRequest()
+        request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (6,10,10))
+        request.volumes[VolumeType.GT_AFFINITIES] = Roi((0,0,0), (6,10,10))
+
+        pipeline = (
+                NoReadSourceLabels(labels) +
+                RandomLocation() +
+                AddGtAffinities([[-1,0,0],[0,-1,0],[0,0,-1]], dtype=np.uint8) +
+                PreCache(request, cache_size=5, num_workers=2))
+
+        report = pipeline.dry_run(request)
+
+        # source, RandomLocation, AddGtAffinities, PreCache
+        self.assertEqual(len(report.nodes), 4)
+
+        name, process, received, delivered = report.nodes[2]
+        self.assertEqual(name, 'AddGtAffinities')
+        self.assertEqual(received[VolumeType.GT_LABELS].shape, (7,11,11))
+        self.assertEqual(delivered[VolumeType.GT_AFFINITIES].shape, (3,6,10,10))
+        self.assertEqual(delivered[VolumeType.GT_AFFINITIES].dtype, np.uint8)
+
+        batch_bytes = 600*4 + 3*600
+        self.assertEqual(report.get_queue_memory(), [('PreCache', 5*batch_bytes)])
+
+        peak_memory = dict(report.get_peak_memory())
+        self.assertEqual(len(peak_memory), 2)
+        self.assertEqual(peak_memory['main process'], batch_bytes)
+
+        # request that doesn't match the PreCache request
+        request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (6,10,12))
+        self.assertRaises(RuntimeError, pipeline.dry_run, request)
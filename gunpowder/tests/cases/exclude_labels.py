@@ -0,0 +1,60 @@
+from .provider_test import ProviderTest, TestSourceLabels
+from gunpowder import *
+from scipy import ndimage
+import numpy as np
+
+def exclude_labels(gt, labels, ignore_mask_erode, background_value):
+    '''Reference implementation, computing the distance transform on the 
+    complete volume. Returns the ignore mask.'''
+
+    include_mask = np.ones(gt.shape)
+    for label in np.unique(gt):
+        if label in labels:
+            gt[gt==label] = background_value
+        else:
+            include_mask[gt==label] = 0
+
+    distance_to_include = ndimage.distance_transform_edt(include_mask)
+    return (distance_to_include<ignore_mask_erode).astype(np.uint8)
+
+class TestExcludeLabels(ProviderTest):
+
+    def test_output(self):
+
+        np.random.seed(42)
+
+        # blocky labels with some background
+        labels = np.random.randint(0, 10, size=(5,6,6)).astype(np.uint64)
+        labels = labels.repeat(2, axis=0).repeat(3, axis=1).repeat(3, axis=2)
+        background = np.zeros(labels.shape, dtype=np.uint64)
+
+        cases = [
+            (labels, [2, 5]),
+            # all labels excluded
+            (labels, np.unique(labels).tolist()),
+            # background only
+            (background, [2, 5]),
+            (background, [0]),
+        ]
+
+        for data, excluded in cases:
+            for ignore_roi in [Roi((0,0,0), labels.shape), Roi((2,3,3), (6,12,12))]:
+                for ignore_mask_erode in [0, 2, 5]:
+
+                    request = BatchRequest()
+                    request.add_volume_request(VolumeType.GT_LABELS, labels.shape)
+                    request.volumes[VolumeType.GT_IGNORE] = ignore_roi
+
+                    pipeline = (
+                            TestSourceLabels(data) +
+                            ExcludeLabels(excluded, ignore_mask_erode, background_value=0))
+
+                    with build(pipeline):
+                        batch = pipeline.request_batch(request)
+
+                    expected_labels = np.array(data)
+                    expected_ignore = exclude_labels(expected_labels, excluded, ignore_mask_erode, 0)
+
+                    self.assertTrue((batch.volumes[VolumeType.GT_LABELS].data == expected_labels).all())
+                    self.assertEqual(batch.volumes[VolumeType.GT_IGNORE].roi, ignore_roi)
+                    self.assertTrue((batch.volumes[VolumeType.GT_IGNORE].data == expected_ignore[ignore_roi.get_bounding_box()]).all())
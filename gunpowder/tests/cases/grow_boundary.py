@@ -0,0 +1,61 @@
+from .provider_test import ProviderTest, TestSourceLabels
+from gunpowder import *
+from scipy import ndimage
+import numpy as np
+
+def grow_per_label(gt, gt_mask, steps, background, only_xy):
+    '''Reference implementation, eroding each label separately.'''
+
+    if only_xy:
+        for z in range(gt.shape[0]):
+            grow_per_label(gt[z], None if gt_mask is None else gt_mask[z], steps, background, False)
+        return
+
+    foreground = np.zeros(shape=gt.shape, dtype=bool)
+    masked = None
+    if gt_mask is not None:
+        masked = np.equal(gt_mask, 0)
+    for label in np.unique(gt):
+        if label == background:
+            continue
+        label_mask = gt==label
+        if masked is not None:
+            label_mask = np.logical_or(label_mask, masked)
+        eroded_label_mask = ndimage.binary_erosion(label_mask, iterations=steps, border_value=1)
+        foreground = np.logical_or(eroded_label_mask, foreground)
+
+    gt[np.logical_not(foreground)] = background
+
+class TestGrowBoundary(ProviderTest):
+
+    def test_output(self):
+
+        np.random.seed(42)
+
+        # blocky labels with some background
+        labels = np.random.randint(0, 10, size=(5,6,6)).astype(np.uint64)
+        labels = labels.repeat(2, axis=0).repeat(3, axis=1).repeat(3, axis=2)
+        mask = np.ones(labels.shape, dtype=np.uint8)
+        mask[:,4:9,4:9] = 0
+
+        request = BatchRequest()
+        request.add_volume_request(VolumeType.GT_LABELS, labels.shape)
+
+        for use_mask in [False, True]:
+            for only_xy in [False, True]:
+                for steps in [1, 2]:
+
+                    if use_mask:
+                        request.add_volume_request(VolumeType.GT_MASK, mask.shape)
+
+                    pipeline = (
+                            TestSourceLabels(labels, mask) +
+                            GrowBoundary(steps=steps, only_xy=only_xy))
+
+                    with build(pipeline):
+                        batch = pipeline.request_batch(request)
+
+                    expected = np.array(labels)
+                    grow_per_label(expected, mask if use_mask else None, steps, 0, only_xy)
+
+                    self.assertTrue((batch.volumes[VolumeType.GT_LABELS].data == expected).all())
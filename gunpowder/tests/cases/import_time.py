@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# modules that should not be loaded by a plain 'import gunpowder'
+heavy_modules = [
+    'scipy.ndimage',
+    'scipy.sparse',
+    'skimage',
+    'h5py',
+    'gunpowder.caffe',
+    'gunpowder.tests',
+]
+
+# maximal time in seconds for 'import gunpowder' and 'from gunpowder import 
+# *', can be raised on slow machines
+import_time_budget = float(os.environ.get('GUNPOWDER_IMPORT_TIME_BUDGET', 1.0))
+
+class TestImportTime(unittest.TestCase):
+
+    def test_output(self):
+
+        package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+        for statement in ['import gunpowder', 'from gunpowder import *']:
+
+            # import in a fresh interpreter, such that no module is cached
+            script = (
+                "import json, sys, time\n"
+                "start = time.time()\n"
+                "%s\n"
+                "print(json.dumps({'time': time.time() - start, 'modules': sorted(sys.modules.keys())}))\n")%statement
+
+            output = subprocess.check_output([sys.executable, '-c', script], cwd=package_dir)
+            result = json.loads(output.decode().splitlines()[-1])
+
+            for module in heavy_modules:
+                self.assertTrue(
+                        module not in result['modules'],
+                        "%s was imported by '%s'"%(module, statement))
+
+            self.assertLess(
+                    result['time'], import_time_budget,
+                    "'%s' took %.3fs, budget is %.3fs"%(statement, result['time'], import_time_budget))
+
+        # nodes are still available and get imported on access
+        output = subprocess.check_output(
+                [sys.executable, '-c', "from gunpowder import *; print(Hdf5Source.__module__)"],
+                cwd=package_dir)
+        self.assertEqual(output.decode().strip(), 'gunpowder.nodes.hdf5_source')
@@ -0,0 +1,87 @@
+from .provider_test import ProviderTest
+from gunpowder import *
+import h5py
+import numpy as np
+import os
+import shutil
+import tempfile
+
+class TestLazyVolume(ProviderTest):
+
+    def test_lazy_data(self):
+
+        array = np.arange(20*30*40, dtype=np.uint16).reshape((20,30,40))
+        reads = []
+
+        def read(bounding_box):
+            reads.append(bounding_box)
+            return array[bounding_box]
+
+        volume = Volume(
+                LazyData(read, (0,0,0), array.shape, array.dtype),
+                Roi((10,10,10), (20,30,40)),
+                (1,1,1),
+                True)
+
+        # crops and casts don't read
+        volume.crop(Roi((12,15,20), (10,10,10)))
+        volume.crop(Roi((14,15,21), (5,5,5)))
+        volume.cast(np.float32)
+        self.assertTrue(volume.is_lazy())
+        self.assertEqual(volume.get_shape(), (5,5,5))
+        self.assertEqual(volume.get_dtype(), np.float32)
+        self.assertEqual(volume.get_nbytes(), 5*5*5*4)
+        self.assertEqual(len(reads), 0)
+
+        # exactly the final ROI is read, once
+        data = volume.data
+        data = volume.data
+        self.assertFalse(volume.is_lazy())
+        self.assertEqual(reads, [(slice(4,9), slice(5,10), slice(11,16))])
+        self.assertEqual(data.dtype, np.float32)
+        self.assertTrue((data == array[4:9,5:10,11:16]).all())
+
+    def test_output(self):
+
+        labels = np.random.randint(0, 10, size=(20,30,40)).astype(np.uint64)
+        raw = (labels*10).astype(np.uint8)
+
+        tmp_dir = tempfile.mkdtemp()
+        filename = os.path.join(tmp_dir, 'test.hdf')
+
+        try:
+
+            with h5py.File(filename, 'w') as f:
+                f['raw'] = raw
+                f['labels'] = labels
+
+            request = BatchRequest()
+            request.volumes[VolumeType.RAW] = Roi((0,0,0), (5,6,7))
+            request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (5,6,7))
+
+            pipeline = (
+                    Hdf5Source(
+                        filename,
+                        datasets={VolumeType.RAW: 'raw', VolumeType.GT_LABELS: 'labels'},
+                        resolution=(1,1,1),
+                        lazy=True) +
+                    RandomLocation() +
+                    Cast(np.float32))
+
+            with build(pipeline):
+                batch = pipeline.request_batch(request)
+
+            # shifting and casting did not read the data
+            self.assertTrue(batch.volumes[VolumeType.RAW].is_lazy())
+            self.assertTrue(batch.volumes[VolumeType.GT_LABELS].is_lazy())
+
+            # the file is read when the data is accessed, at the same location 
+            # for both volumes
+            raw_data = batch.volumes[VolumeType.RAW].data
+            labels_data = batch.volumes[VolumeType.GT_LABELS].data
+            self.assertEqual(raw_data.dtype, np.float32)
+            self.assertEqual(raw_data.shape, (5,6,7))
+            self.assertTrue((raw_data == labels_data*10).all())
+
+        finally:
+            shutil.rmtree(tmp_dir)
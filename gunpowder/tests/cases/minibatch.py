@@ -0,0 +1,110 @@
+from .provider_test import ProviderTest, TestSourceLabels
+from gunpowder import *
+import numpy as np
+import random
+
+class CountingAddGtAffinities(AddGtAffinities):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingAddGtAffinities, self).__init__(*args, **kwargs)
+        self.num_processed = 0
+
+    def process(self, batch, request):
+        self.num_processed += 1
+        super(CountingAddGtAffinities, self).process(batch, request)
+
+class PerSampleAddGtAffinities(CountingAddGtAffinities):
+
+    supports_samples = False
+
+class CountingFilter(BatchFilter):
+    '''Records the number of samples of each batch it processes.'''
+
+    def __init__(self):
+        self.num_samples = []
+
+    def process(self, batch, request):
+        self.num_samples.append(batch.num_samples)
+
+class StatefulCountingFilter(CountingFilter):
+
+    def prepare(self, request):
+        pass
+
+class TestMinibatch(ProviderTest):
+
+    def test_output(self):
+
+        labels = np.random.randint(0, 4, size=(30,40,50)).astype(np.uint64)
+
+        request = BatchRequest(num_samples=4)
+        request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (6,10,10))
+        request.volumes[VolumeType.GT_AFFINITIES] = Roi((0,0,0), (6,10,10))
+
+        batches = []
+        num_processed = []
+        for add_gt_affinities in [
+                CountingAddGtAffinities([[-1,0,0],[0,-1,0],[0,0,-1]]),
+                PerSampleAddGtAffinities([[-1,0,0],[0,-1,0],[0,0,-1]])]:
+
+            pipeline = (
+                    TestSourceLabels(labels) +
+                    RandomLocation() +
+                    add_gt_affinities)
+
+            random.seed(42)
+            with build(pipeline):
+                batches.append(pipeline.request_batch(request))
+            num_processed.append(add_gt_affinities.num_processed)
+
+        # RandomLocation does not support samples and was run per sample, 
+        # AddGtAffinities processed the stacked batch at once
+        self.assertEqual(num_processed, [1, 4])
+        self.assertEqual(batches[0].num_samples, 4)
+        self.assertEqual(batches[0].volumes[VolumeType.GT_LABELS].get_shape(), (4,6,10,10))
+        self.assertEqual(batches[0].volumes[VolumeType.GT_AFFINITIES].get_shape(), (4,3,6,10,10))
+
+        # same result as stacking single samples
+        for volume_type in [VolumeType.GT_LABELS, VolumeType.GT_AFFINITIES]:
+            self.assertTrue((batches[0].volumes[volume_type].data == batches[1].volumes[volume_type].data).all())
+
+        # the samples are different locations
+        gt_labels = batches[0].volumes[VolumeType.GT_LABELS].data
+        self.assertFalse((gt_labels[0] == gt_labels[1]).all())
+
+    def test_downstream_of_native(self):
+
+        labels = np.random.randint(0, 4, size=(30,40,50)).astype(np.uint64)
+
+        request = BatchRequest(num_samples=4)
+        request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (6,10,10))
+        request.volumes[VolumeType.GT_AFFINITIES] = Roi((0,0,0), (6,10,10))
+
+        batches = []
+        for counting_filter, num_processed in [
+                (CountingFilter(), 1),
+                (StatefulCountingFilter(), 4)]:
+
+            add_gt_affinities = CountingAddGtAffinities([[-1,0,0],[0,-1,0],[0,0,-1]])
+            pipeline = (
+                    TestSourceLabels(labels) +
+                    RandomLocation() +
+                    add_gt_affinities +
+                    counting_filter +
+                    PrintProfilingStats())
+
+            random.seed(42)
+            with build(pipeline):
+                batches.append(pipeline.request_batch(request))
+
+            # the filter sees single samples in either case, but only one 
+            # with a stateful 'prepare' requests them one by one from upstream
+            self.assertEqual(counting_filter.num_samples, [1]*4)
+            self.assertEqual(add_gt_affinities.num_processed, num_processed)
+
+        for batch in batches:
+            self.assertEqual(batch.num_samples, 4)
+            self.assertEqual(batch.volumes[VolumeType.GT_AFFINITIES].get_shape(), (4,3,6,10,10))
+
+        for volume_type in [VolumeType.GT_LABELS, VolumeType.GT_AFFINITIES]:
+            self.assertTrue((batches[0].volumes[volume_type].data == batches[1].volumes[volume_type].data).all())
@@ -0,0 +1,67 @@
+from .provider_test import ProviderTest
+from gunpowder import *
+import numpy as np
+
+class RawSource(BatchProvider):
+
+    def __init__(self):
+        self.raw = np.random.randint(1, 255, size=(40,50,60)).astype(np.uint8)
+
+    def get_spec(self):
+
+        spec = ProviderSpec()
+        spec.volumes[VolumeType.RAW] = Roi((0,0,0), self.raw.shape)
+        return spec
+
+    def provide(self, request):
+
+        roi = request.volumes[VolumeType.RAW]
+        batch = Batch()
+        batch.volumes[VolumeType.RAW] = Volume(np.array(self.raw[roi.get_bounding_box()]), roi, (1,1,1), True)
+        return batch
+
+class CheckPadded(BatchFilter):
+    '''Compares the raw data with the padded source, as seen below Pad.'''
+
+    def __init__(self, padded, offset):
+        self.padded = padded
+        self.offset = offset
+        self.num_checked = 0
+
+    def process(self, batch, request):
+
+        raw = batch.volumes[VolumeType.RAW]
+        assert raw.roi == request.volumes[VolumeType.RAW]
+
+        begin = raw.roi.get_begin() - self.offset
+        end = raw.roi.get_end() - self.offset
+        expected = self.padded[tuple(slice(b, e) for b, e in zip(begin, end))]
+        assert (raw.data == expected).all()
+        self.num_checked += 1
+
+class TestPad(ProviderTest):
+
+    def test_shifted_requests(self):
+
+        source = RawSource()
+        pad = Pad({VolumeType.RAW: Coordinate((5,5,5))})
+
+        # raw with padding, starting at (-5,-5,-5)
+        padded = np.pad(source.raw, 5, 'constant')
+
+        request = BatchRequest()
+        request.volumes[VolumeType.RAW] = Roi((0,0,0), (10,10,10))
+
+        check = CheckPadded(padded, Coordinate((-5,-5,-5)))
+        pipeline = source + pad + check + RandomLocation()
+
+        with build(pipeline):
+            for i in range(50):
+                batch = pipeline.request_batch(request)
+                self.assertEqual(batch.volumes[VolumeType.RAW].data.shape, (10,10,10))
+
+        self.assertEqual(check.num_checked, 50)
+
+        # all requests inside of the upstream ROI share one plan
+        shift_invariant = [key for key in pad.request_plans if key[1]]
+        self.assertEqual(len(shift_invariant), 1)
@@ -0,0 +1,112 @@
+from .provider_test import ProviderTest, TestSource
+from gunpowder import *
+import threading
+import time
+
+class SlowSetupSource(TestSource):
+
+    def __init__(self, log):
+        self.log = log
+
+    def setup(self):
+        time.sleep(0.3)
+        self.log.append(self)
+
+class LoggingRandomProvider(RandomProvider):
+
+    def __init__(self, log, sources):
+        super(LoggingRandomProvider, self).__init__()
+        self.log = log
+        self.sources = sources
+
+    def setup(self):
+        assert all(s in self.log for s in self.sources), "set up before upstream providers"
+        super(LoggingRandomProvider, self).setup()
+        self.log.append(self)
+
+class MainThreadPreCache(PreCache):
+
+    def setup(self):
+        assert threading.current_thread() is threading.main_thread(), "not set up in main thread"
+        super(MainThreadPreCache, self).setup()
+
+class TreeOwner(BatchFilter):
+    '''Sets up another tree, which starts processes.'''
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def setup(self):
+        self.tree.setup()
+
+    def teardown(self):
+        self.tree.teardown()
+
+    def process(self, batch, request):
+        pass
+
+class MainThreadTreeOwner(TreeOwner):
+
+    setup_in_main_thread = True
+
+class TestParallelSetup(ProviderTest):
+
+    def test_output(self):
+
+        log = []
+        sources = [ SlowSetupSource(log) for i in range(3) ]
+        pipeline = (
+                tuple(sources) +
+                LoggingRandomProvider(log, sources) +
+                MainThreadPreCache(self.test_request, cache_size=2, num_workers=1))
+
+        start = time.time()
+        with build(pipeline, num_setup_threads=3):
+            duration = time.time() - start
+            batch = pipeline.request_batch(self.test_request)
+
+        self.assertTrue(VolumeType.RAW in batch.volumes)
+
+        # the three sources were set up concurrently
+        self.assertLess(duration, 0.8)
+
+        self.assertEqual(len(pipeline.setup_timings), 5)
+        self.assertEqual(pipeline.setup_timings[-1].get_name(), 'MainThreadPreCache')
+        for timing in pipeline.setup_timings[:3]:
+            self.assertEqual(timing.get_name(), 'SlowSetupSource')
+            self.assertGreaterEqual(timing.elapsed(), 0.3)
+
+    def test_nested(self):
+
+        for tree_owner_type in [TreeOwner, MainThreadTreeOwner]:
+
+            sources = [ SlowSetupSource([]) for i in range(3) ]
+            tree_owner = tree_owner_type(
+                    TestSource() +
+                    MainThreadPreCache(self.test_request, cache_size=2, num_workers=1))
+            pipeline = tuple(sources) + RandomProvider() + tree_owner
+
+            if tree_owner_type is TreeOwner:
+
+                # would start processes in a setup thread
+                with self.assertRaises(RuntimeError):
+                    with build(pipeline, num_setup_threads=3):
+                        pass
+
+            else:
+
+                with build(pipeline, num_setup_threads=3):
+                    batch = pipeline.request_batch(self.test_request)
+                self.assertTrue(VolumeType.RAW in batch.volumes)
+
+    def test_default_serial(self):
+
+        log = []
+        sources = [ SlowSetupSource(log) for i in range(3) ]
+        pipeline = tuple(sources) + LoggingRandomProvider(log, sources)
+
+        start = time.time()
+        with build(pipeline):
+            duration = time.time() - start
+
+        self.assertGreaterEqual(duration, 0.9)
@@ -0,0 +1,67 @@
+from .provider_test import ProviderTest
+from gunpowder import *
+from gunpowder.nodes.pointwise_filter import FusedPointwiseFilter
+import numpy as np
+
+class SharedSource(BatchProvider):
+    '''Provides the same raw array with each batch, like a cache would.'''
+
+    def __init__(self):
+        self.raw = np.full((100,100,100), 0.5, dtype=np.float32)
+
+    def get_spec(self):
+
+        spec = ProviderSpec()
+        spec.volumes[VolumeType.RAW] = Roi((0,0,0), self.raw.shape)
+        return spec
+
+    def provide(self, request):
+
+        roi = request.volumes[VolumeType.RAW]
+        batch = Batch()
+        batch.volumes[VolumeType.RAW] = Volume(self.raw[roi.get_bounding_box()], roi, (1,1,1), True)
+        return batch
+
+class TestPointwiseFusion(ProviderTest):
+
+    def test_output(self):
+
+        pipeline = (
+                self.test_source +
+                Normalize() +
+                IntensityScaleShift(2, -1) +
+                ZeroOutConstSections() +
+                Cast(np.float16)
+        )
+
+        with build(pipeline):
+
+            self.assertTrue(isinstance(pipeline.output, FusedPointwiseFilter))
+            self.assertEqual(len(pipeline.output.filters), 4)
+
+            batch = pipeline.request_batch(self.test_request)
+
+            raw = batch.volumes[VolumeType.RAW]
+            self.assertEqual(raw.data.dtype, np.float16)
+            # the test source is constant, all sections are zeroed out
+            self.assertTrue((raw.data == 0).all())
+
+    def test_shared_raw(self):
+
+        for filters in [
+                [Normalize(factor=0.5)],
+                [IntensityScaleShift(2, -1)],
+                [Normalize(factor=0.5), IntensityScaleShift(2, -1), ZeroOutConstSections()],
+                [Cast(np.float32), IntensityAugment(0.9, 1.1, -0.1, 0.1)]]:
+
+            source = SharedSource()
+            pipeline = source
+            for f in filters:
+                pipeline += f
+
+            with build(pipeline):
+                batch = pipeline.request_batch(self.test_request)
+
+            # the filters did not write to the upstream array
+            self.assertTrue((source.raw == 0.5).all())
+            self.assertFalse((batch.volumes[VolumeType.RAW].data == 0.5).all())
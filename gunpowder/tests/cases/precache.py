@@ -0,0 +1,118 @@
+from .provider_test import ProviderTest, TestSource
+from gunpowder import *
+from gunpowder.producer_pool import get_worker_path
+import numpy as np
+import time
+
+class WorkerSource(TestSource):
+    '''Marks batches that were produced in a ProducerPool worker with 1.'''
+
+    def provide(self, request):
+
+        batch = super(WorkerSource, self).provide(request)
+        batch.volumes[VolumeType.RAW].data[:] = get_worker_path() != ()
+        return batch
+
+class TestPreCache(ProviderTest):
+
+    def test_output(self):
+
+        # each batch has 1000 bytes
+        precache = PreCache(self.test_request, cache_size=10, num_workers=4, max_bytes=2500)
+        pipeline = self.test_source + precache
+
+        with build(pipeline):
+
+            # give the workers time to fill the cache
+            time.sleep(0.5)
+
+            for i in range(10):
+                batch = pipeline.request_batch(self.test_request)
+
+            current_bytes, peak_bytes = precache.workers.get_queued_bytes()
+            self.assertTrue(peak_bytes >= 1000)
+            self.assertTrue(peak_bytes <= 2500)
+            self.assertTrue(current_bytes <= 2500)
+            self.assertTrue('PreCache: ' in str(batch.profiling_stats))
+
+    def test_batch_ids(self):
+
+        try:
+
+            for deterministic in [False, True]:
+
+                Batch.set_deterministic_ids(deterministic)
+
+                pipeline = self.test_source + PreCache(self.test_request, cache_size=4, num_workers=3)
+                with build(pipeline):
+                    ids = [ pipeline.request_batch(self.test_request).id for i in range(20) ]
+
+                self.assertEqual(len(set(ids)), len(ids))
+
+        finally:
+            Batch.set_deterministic_ids(False)
+
+    def test_sibling_batch_ids(self):
+
+        try:
+
+            for deterministic in [False, True]:
+
+                Batch.set_deterministic_ids(deterministic)
+
+                runs = []
+                for run in range(2):
+
+                    # two pools side by side in the same process
+                    pipeline_a = self.test_source + PreCache(self.test_request, cache_size=4, num_workers=1)
+                    pipeline_b = TestSource() + PreCache(self.test_request, cache_size=4, num_workers=1)
+                    with build(pipeline_a), build(pipeline_b):
+                        ids = [
+                            pipeline.request_batch(self.test_request).id
+                            for i in range(10)
+                            for pipeline in [pipeline_a, pipeline_b]
+                        ]
+
+                    self.assertEqual(len(set(ids)), len(ids))
+                    runs.append(ids)
+
+                if deterministic:
+                    self.assertEqual(runs[0], runs[1])
+
+            # stopping a pool again does not release an index that another 
+            # pool took since
+            precache_a = PreCache(self.test_request, cache_size=4, num_workers=1)
+            pipeline_a = self.test_source + precache_a
+            with build(pipeline_a):
+                pass
+            pipeline_b = TestSource() + PreCache(self.test_request, cache_size=4, num_workers=1)
+            pipeline_c = TestSource() + PreCache(self.test_request, cache_size=4, num_workers=1)
+            with build(pipeline_b):
+                precache_a.workers.stop()
+                with build(pipeline_c):
+                    ids = [
+                        pipeline.request_batch(self.test_request).id
+                        for i in range(10)
+                        for pipeline in [pipeline_b, pipeline_c]
+                    ]
+            self.assertEqual(len(set(ids)), len(ids))
+
+        finally:
+            Batch.set_deterministic_ids(False)
+
+    def test_samples(self):
+
+        # samples requested from a cache of single samples are taken from the 
+        # cache and stacked
+        pipeline = WorkerSource() + PreCache(self.test_request, cache_size=4, num_workers=2)
+
+        request = BatchRequest(num_samples=3)
+        request.volumes[VolumeType.RAW] = self.test_request.volumes[VolumeType.RAW]
+
+        with build(pipeline):
+            batch = pipeline.request_batch(request)
+
+        raw = batch.volumes[VolumeType.RAW].data
+        self.assertEqual(raw.shape, (3,10,10,10))
+        self.assertTrue((raw == 1).all())
+        self.assertTrue('PreCache: ' in str(batch.profiling_stats))
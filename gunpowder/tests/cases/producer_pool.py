@@ -0,0 +1,120 @@
+from gunpowder.producer_pool import ProducerPool, WorkersDied
+import multiprocessing
+import numpy as np
+import os
+import signal
+import time
+import unittest
+
+# makes producers slow while set
+slow = multiprocessing.Event()
+
+def produce_item():
+    if slow.is_set():
+        time.sleep(0.1)
+    return np.ones((64*1024,), dtype=np.uint8)
+
+def produce_large_item():
+    # larger than a pipe buffer, such that the worker is still sending it when 
+    # it gets killed
+    return (os.getpid(), np.ones((1024*1024,), dtype=np.uint8))
+
+def kill(pid):
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except OSError:
+        # killed already
+        pass
+
+class TestProducerPool(unittest.TestCase):
+
+    def test_autoscale(self):
+
+        pool = ProducerPool(
+                [produce_item]*4,
+                queue_size=8,
+                get_nbytes=lambda item: item.nbytes,
+                min_workers=1,
+                autoscale_window=1,
+                autoscale_wait=0.05,
+                autoscale_patience=1)
+
+        pool.start()
+        try:
+
+            # slow producers, workers are added
+            slow.set()
+            for i in range(10):
+                pool.get(timeout=10)
+            self.assertGreater(pool.get_num_workers(), 1)
+
+            # fast producers, consume without waiting from a full queue until 
+            # scaled down
+            slow.clear()
+            for i in range(40):
+                time.sleep(0.1)
+                pool.get(timeout=10)
+            self.assertEqual(pool.get_num_workers(), 1)
+
+            # no items got lost by retiring workers: the bytes counted are 
+            # those of the queue and at most one item per running worker
+            time.sleep(0.5)
+            current_bytes, peak_bytes = pool.get_queued_bytes()
+            self.assertLessEqual(current_bytes, (8 + pool.get_num_workers())*64*1024)
+            for i in range(20):
+                pool.get(timeout=10)
+
+        finally:
+            slow.clear()
+            pool.stop()
+
+    def test_restart(self):
+
+        pool = ProducerPool(
+                [produce_large_item]*2,
+                queue_size=1,
+                get_nbytes=lambda item: item[1].nbytes,
+                max_restarts=100)
+
+        pool.start()
+        try:
+
+            # kill the workers while they are blocked sending their next item
+            for i in range(10):
+                pid, data = pool.get(timeout=10)
+                self.assertEqual(data.sum(), 1024*1024)
+                kill(pid)
+
+            self.assertGreater(pool.get_num_restarts(), 0)
+            self.assertTrue(pool.alive())
+
+            for i in range(10):
+                pid, data = pool.get(timeout=10)
+                self.assertEqual(data.sum(), 1024*1024)
+
+            # only items in the queue are counted, killed workers don't leave 
+            # bytes behind
+            time.sleep(0.5)
+            current_bytes, peak_bytes = pool.get_queued_bytes()
+            self.assertLessEqual(current_bytes, 1024*1024)
+            self.assertLessEqual(peak_bytes, 1024*1024)
+
+        finally:
+            pool.stop()
+
+    def test_worker_died(self):
+
+        pool = ProducerPool([produce_large_item]*2, queue_size=1)
+
+        pool.start()
+        try:
+
+            pid, data = pool.get(timeout=10)
+            kill(pid)
+
+            with self.assertRaises(WorkersDied):
+                for i in range(10):
+                    pool.get(timeout=10)
+
+        finally:
+            pool.stop()
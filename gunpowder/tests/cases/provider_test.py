@@ -24,6 +24,33 @@ class TestSource(BatchProvider):
         )
         return batch
 
+class TestSourceLabels(BatchProvider):
+
+    def __init__(self, labels, mask=None):
+        self.labels = labels
+        self.mask = mask
+
+    def get_spec(self):
+
+        spec = ProviderSpec()
+        spec.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), self.labels.shape)
+        if self.mask is not None:
+            spec.volumes[VolumeType.GT_MASK] = Roi((0,0,0), self.mask.shape)
+        return spec
+
+    def provide(self, request):
+
+        batch = Batch()
+        for (volume_type, data) in [(VolumeType.GT_LABELS, self.labels), (VolumeType.GT_MASK, self.mask)]:
+            if volume_type not in request.volumes:
+                continue
+            roi = request.volumes[volume_type]
+            batch.volumes[volume_type] = Volume(
+                    np.array(data[roi.get_bounding_box()]),
+                    roi,
+                    (1,1,1),
+                    False)
+        return batch
 
 class ProviderTest(unittest.TestCase):
 
@@ -0,0 +1,191 @@
+from .provider_test import ProviderTest, TestSourceLabels
+from gunpowder import *
+import h5py
+import numpy as np
+import os
+import shutil
+import tempfile
+
+class TestRandomLocation(ProviderTest):
+
+    def test_output(self):
+
+        np.random.seed(42)
+        mask = (np.random.rand(30,40,50) < 0.02).astype(np.uint8)
+        mask[10:20,10:30,5:25] = 1
+        labels = np.zeros(mask.shape, dtype=np.uint64)
+
+        request = BatchRequest()
+        request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (6,10,10))
+        request.volumes[VolumeType.GT_MASK] = Roi((1,2,2), (4,6,6))
+
+        tmp_dir = tempfile.mkdtemp()
+        index_file = os.path.join(tmp_dir, 'index.npz')
+
+        try:
+
+            for i in range(2):
+
+                random_location = RandomLocation(min_masked=0.5, index_file=index_file)
+                pipeline = TestSourceLabels(labels, mask) + random_location
+
+                with build(pipeline):
+
+                    # the second time, the index is loaded during setup
+                    self.assertEqual(len(random_location.valid_shifts), i)
+
+                    for j in range(10):
+                        batch = pipeline.request_batch(request)
+                        self.assertTrue(batch.volumes[VolumeType.GT_MASK].data.mean() >= 0.5)
+
+                    self.assertEqual(len(random_location.valid_shifts), 1)
+
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_index_requests(self):
+
+        np.random.seed(42)
+        mask = (np.random.rand(30,40,50) < 0.02).astype(np.uint8)
+        mask[10:20,10:30,5:25] = 1
+        labels = np.zeros(mask.shape, dtype=np.uint64)
+
+        request = BatchRequest()
+        request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (6,10,10))
+        request.volumes[VolumeType.GT_MASK] = Roi((1,2,2), (4,6,6))
+
+        other_request = BatchRequest()
+        other_request.volumes[VolumeType.GT_MASK] = Roi((0,0,0), (5,5,5))
+
+        tmp_dir = tempfile.mkdtemp()
+        index_file = os.path.join(tmp_dir, 'index.npz')
+
+        try:
+
+            # indices for different requests end up in the same file
+            for i, r in enumerate([request, other_request]):
+                random_location = RandomLocation(min_masked=0.5, index_file=index_file, index_requests=[r])
+                with build(TestSourceLabels(labels, mask) + random_location):
+                    self.assertEqual(len(random_location.valid_shifts), i + 1)
+
+            with np.load(index_file) as index:
+                self.assertEqual(len(index.files), 2)
+            self.assertEqual(os.listdir(tmp_dir), ['index.npz'])
+
+            # the index is computed before the workers are started
+            random_location = RandomLocation(min_masked=0.5)
+            pipeline = (
+                TestSourceLabels(labels, mask) +
+                random_location +
+                PreCache(request, cache_size=2, num_workers=2))
+
+            with build(pipeline):
+
+                self.assertEqual(len(random_location.valid_shifts), 1)
+
+                for j in range(5):
+                    batch = pipeline.request_batch(request)
+                    self.assertTrue(batch.volumes[VolumeType.GT_MASK].data.mean() >= 0.5)
+
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_mask_downsample(self):
+
+        # a mask that is constant in blocks of 4x4x4, with partial blocks at 
+        # the end of each dimension
+        np.random.seed(42)
+        blocks = (np.random.rand(8,10,13) < 0.5).astype(np.uint8)
+        mask = blocks.repeat(4, axis=0).repeat(4, axis=1).repeat(4, axis=2)[:30,:39,:50]
+        labels = np.zeros(mask.shape, dtype=np.uint64)
+
+        request = BatchRequest()
+        request.volumes[VolumeType.GT_LABELS] = Roi((0,0,0), (6,10,10))
+        request.volumes[VolumeType.GT_MASK] = Roi((1,2,2), (4,6,7))
+
+        num_valid = []
+        for mask_downsample in [None, (4,4,4), (1,4,2)]:
+
+            random_location = RandomLocation(
+                    min_masked=0.501,
+                    mask_downsample=mask_downsample,
+                    index_requests=[request])
+            pipeline = TestSourceLabels(labels, mask) + random_location
+
+            with build(pipeline):
+
+                valid_shifts = list(random_location.valid_shifts.values())[0]
+                num_valid.append(valid_shifts.sum())
+
+                # one count per block of shifts
+                block_shape = (1,1,1) if mask_downsample is None else mask_downsample
+                self.assertEqual(
+                        valid_shifts.shape,
+                        tuple(-(-s//b) for s, b in zip((24,29,40), block_shape)))
+
+                for j in range(20):
+                    batch = pipeline.request_batch(request)
+                    self.assertTrue(batch.volumes[VolumeType.GT_MASK].data.mean() >= 0.501)
+
+        # for block-wise constant masks, the estimate is exact
+        self.assertTrue(num_valid[0] > 0)
+        self.assertEqual(num_valid[1], num_valid[0])
+        self.assertEqual(num_valid[2], num_valid[0])
+
+    def test_mask_integral_cache(self):
+
+        np.random.seed(42)
+        mask = (np.random.rand(30,40,50) < 0.5).astype(np.uint8)
+
+        tmp_dir = tempfile.mkdtemp()
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        filename = os.path.join(tmp_dir, 'mask.hdf')
+
+        with h5py.File(filename, 'w') as f:
+            f['labels'] = np.zeros(mask.shape, dtype=np.uint64)
+            f['mask'] = mask
+            f['other_mask'] = 1 - mask
+
+        request = BatchRequest()
+        request.volumes[VolumeType.GT_MASK] = Roi((0,0,0), (4,6,6))
+
+        def build_index(dataset, mask_downsample=None):
+
+            random_location = RandomLocation(
+                    min_masked=0.6,
+                    mask_integral_cache_dir=cache_dir,
+                    mask_downsample=mask_downsample)
+            source = Hdf5Source(
+                    filename,
+                    {
+                        VolumeType.GT_LABELS: 'labels',
+                        VolumeType.GT_MASK: dataset
+                    },
+                    resolution=(1,1,1))
+
+            with build(source + random_location):
+                batch = random_location.request_batch(request)
+                # with mask_downsample, the ratio is only estimated
+                if mask_downsample is None:
+                    self.assertTrue(batch.volumes[VolumeType.GT_MASK].data.mean() >= 0.6)
+                self.assertTrue(isinstance(random_location.mask_integral, np.memmap))
+                return list(random_location.valid_shifts.values())[0]
+
+        try:
+
+            shifts = build_index('mask')
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # reused
+            self.assertTrue(np.array_equal(build_index('mask'), shifts))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # different dataset or downsampling
+            other_shifts = build_index('other_mask')
+            self.assertFalse(np.array_equal(other_shifts, shifts))
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            build_index('mask', (2,2,2))
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,120 @@
+from .provider_test import ProviderTest
+from gunpowder import *
+from gunpowder.producer_pool import get_worker_path
+import numpy as np
+import random
+import time
+
+class ConstantSource(BatchProvider):
+    '''Provides RAW filled with a constant value, after an optional delay.'''
+
+    def __init__(self, value, shape=(100,100,100), delay=0):
+        self.value = value
+        self.shape = shape
+        self.delay = delay
+
+    def get_spec(self):
+
+        spec = ProviderSpec()
+        spec.volumes[VolumeType.RAW] = Roi((0,0,0), self.shape)
+        return spec
+
+    def provide(self, request):
+
+        time.sleep(self.delay)
+
+        batch = Batch()
+        batch.volumes[VolumeType.RAW] = Volume(
+                np.full(request.volumes[VolumeType.RAW].get_shape(), self.value, dtype=np.uint8),
+                request.volumes[VolumeType.RAW],
+                (1,1,1),
+                True)
+        return batch
+
+class WorkerConstantSource(ConstantSource):
+    '''Also stores the index of the ProducerPool worker in RAW.'''
+
+    def provide(self, request):
+
+        batch = super(WorkerConstantSource, self).provide(request)
+        batch.volumes[VolumeType.RAW].data[0,0,1] = get_worker_path()[-1][1]
+        return batch
+
+class TestRandomProvider(ProviderTest):
+
+    def count_selected(self, pipeline, num_providers, num_batches):
+
+        counts = np.zeros(num_providers, dtype=np.int64)
+        with build(pipeline):
+            for i in range(num_batches):
+                batch = pipeline.request_batch(self.test_request)
+                counts[batch.volumes[VolumeType.RAW].data[0,0,0]] += 1
+        return counts
+
+    def test_weights(self):
+
+        random.seed(42)
+
+        pipeline = (
+            tuple(ConstantSource(i) for i in range(3)) +
+            RandomProvider(weights=[1, 3, 0]))
+        counts = self.count_selected(pipeline, 3, 400)
+
+        self.assertEqual(counts[2], 0)
+        self.assertTrue(abs(counts[0]/400.0 - 0.25) < 0.05)
+
+        # without weights, proportional to the size of the ROIs
+        pipeline = (
+            (ConstantSource(0, (100,100,100)), ConstantSource(1, (100,100,300))) +
+            RandomProvider())
+        counts = self.count_selected(pipeline, 2, 400)
+
+        self.assertTrue(abs(counts[0]/400.0 - 0.25) < 0.05)
+
+    def test_adaptive(self):
+
+        random.seed(42)
+
+        tolerance = 0.1
+        random_provider = RandomProvider(adaptive=True, tolerance=tolerance)
+        pipeline = (
+            (ConstantSource(0), ConstantSource(1, delay=0.005)) +
+            random_provider)
+        counts = self.count_selected(pipeline, 2, 100)
+
+        # the fast provider is preferred, as long as the slow one does not 
+        # fall behind more than the tolerance
+        fraction_slow = counts[1]/100.0
+        self.assertTrue(fraction_slow < 0.5)
+        self.assertTrue(fraction_slow >= 0.5 - tolerance - 0.02)
+
+        # both latencies were measured
+        self.assertTrue(random_provider.latencies[1] > random_provider.latencies[0])
+        self.assertTrue(random_provider.latencies[1] >= 0.005)
+        self.assertEqual(list(random_provider.num_selected), list(counts))
+
+        # without tolerance, the probabilities are followed exactly
+        pipeline = (
+            (ConstantSource(0), ConstantSource(1, delay=0.001)) +
+            RandomProvider(adaptive=True, tolerance=0))
+        counts = self.count_selected(pipeline, 2, 20)
+
+        self.assertEqual(list(counts), [10, 10])
+
+    def test_precache(self):
+
+        # each worker draws its own sequence of providers
+        pipeline = (
+            tuple(WorkerConstantSource(i) for i in range(5)) +
+            RandomProvider() +
+            PreCache(self.test_request, cache_size=2, num_workers=2))
+
+        sequences = {}
+        with build(pipeline):
+            for i in range(40):
+                raw = pipeline.request_batch(self.test_request).volumes[VolumeType.RAW].data
+                sequences.setdefault(raw[0,0,1], []).append(raw[0,0,0])
+
+        sequences = [ s[:8] for s in sequences.values() if len(s) >= 8 ]
+        self.assertEqual(len(sequences), 2)
+        self.assertNotEqual(sequences[0], sequences[1])
@@ -0,0 +1,92 @@
+from .provider_test import ProviderTest
+from gunpowder import *
+import gunpowder.nodes.hdf5_source
+import h5py
+import numpy as np
+import os
+import shutil
+import tempfile
+
+class TestReject(ProviderTest):
+
+    def test_output(self):
+
+        np.random.seed(42)
+        mask = np.zeros((30,40,50), dtype=np.uint8)
+        mask[10:20,10:30,5:25] = 1
+        labels = np.arange(mask.size, dtype=np.uint64).reshape(mask.shape)
+        raw = (labels%251).astype(np.uint8)
+
+        # RAW is larger than the mask, such that RandomLocation's valid shifts 
+        # depend on it
+        request = BatchRequest()
+        request.volumes[VolumeType.RAW] = Roi((0,0,0), (10,20,20))
+        request.volumes[VolumeType.GT_LABELS] = Roi((2,5,5), (6,10,10))
+        request.volumes[VolumeType.GT_MASK] = Roi((2,5,5), (6,10,10))
+
+        tmp_dir = tempfile.mkdtemp()
+        filename = os.path.join(tmp_dir, 'test.hdf')
+
+        # count reads per dataset
+        reads = {'raw': 0, 'labels': 0, 'mask': 0}
+        read_dataset = gunpowder.nodes.hdf5_source.read_dataset
+        def counting_read_dataset(filename, dataset, bounding_box):
+            reads[dataset] += 1
+            return read_dataset(filename, dataset, bounding_box)
+
+        try:
+
+            with h5py.File(filename, 'w') as f:
+                f['raw'] = raw
+                f['labels'] = labels
+                f['mask'] = mask
+
+            gunpowder.nodes.hdf5_source.read_dataset = counting_read_dataset
+
+            reject = Reject(min_masked=0.5)
+            pipeline = (
+                    Hdf5Source(
+                        filename,
+                        datasets={
+                            VolumeType.RAW: 'raw',
+                            VolumeType.GT_LABELS: 'labels',
+                            VolumeType.GT_MASK: 'mask'},
+                        resolution=(1,1,1),
+                        lazy=True) +
+                    Normalize() +
+                    RandomLocation() +
+                    reject)
+
+            with build(pipeline):
+
+                for i in range(10):
+
+                    batch = pipeline.request_batch(request)
+                    self.assertTrue(batch.volumes[VolumeType.GT_MASK].data.mean() >= 0.5)
+
+                    # all volumes were read from the same location
+                    offset = np.array(np.unravel_index(batch.volumes[VolumeType.GT_LABELS].data[0,0,0], mask.shape))
+                    self.assertTrue(np.array_equal(
+                        batch.volumes[VolumeType.GT_MASK].data,
+                        mask[tuple(slice(o, o + s) for o, s in zip(offset, (6,10,10)))]))
+
+                    raw_offset = offset - np.array((2,5,5))
+                    raw_data = batch.volumes[VolumeType.RAW].data
+                    self.assertEqual(raw_data.dtype, np.float32)
+                    self.assertTrue(np.allclose(
+                        raw_data,
+                        raw[tuple(slice(o, o + s) for o, s in zip(raw_offset, (10,20,20)))]/255.0))
+
+        finally:
+            gunpowder.nodes.hdf5_source.read_dataset = read_dataset
+            shutil.rmtree(tmp_dir)
+
+        statistics = reject.get_statistics()
+        self.assertEqual(statistics['batches'], 10)
+        self.assertEqual(statistics['accepted'], 10)
+        self.assertTrue(statistics['candidates'] > 10)
+
+        # only the mask was read for rejected candidates
+        self.assertEqual(reads['mask'], statistics['candidates'])
+        self.assertEqual(reads['labels'], 10)
+        self.assertEqual(reads['raw'], 10)
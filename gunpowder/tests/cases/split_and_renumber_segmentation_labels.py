@@ -0,0 +1,72 @@
+from .provider_test import ProviderTest, TestSourceLabels
+from gunpowder import *
+from gunpowder.nodes.split_and_renumber_segmentation_labels import split_and_renumber
+from scipy import ndimage
+import numpy as np
+
+class TestSplitAndRenumberSegmentationLabels(ProviderTest):
+
+    def test_output(self):
+
+        np.random.seed(42)
+        labels = np.random.randint(0, 5, size=(10,10,10)).astype(np.uint64)
+        labels[0,0,0] = 100
+
+        request = BatchRequest()
+        request.add_volume_request(VolumeType.GT_LABELS, labels.shape)
+
+        pipeline = TestSourceLabels(labels) + SplitAndRenumberSegmentationLabels()
+
+        with build(pipeline):
+            batch = pipeline.request_batch(request)
+
+        # statistics are passed on downstream, get them before accessing the 
+        # data
+        ids, counts = batch.get_unique_labels()
+        max_label = batch.get_max_label()
+
+        components = batch.volumes[VolumeType.GT_LABELS].data
+        self.assertEqual(max_label, components.max())
+        expected_ids, expected_counts = np.unique(components, return_counts=True)
+        self.assertTrue((ids == expected_ids).all())
+        self.assertTrue((counts == expected_counts).all())
+
+        self.assertEqual(components.dtype, np.min_scalar_type(components.max() + 1))
+
+        ids = np.unique(components)
+        self.assertTrue((ids == np.arange(len(ids))).all())
+
+        # each component lies in one label, and each connected component of a 
+        # label (apart from single voxels) is one component
+        structure = ndimage.generate_binary_structure(3, 1)
+        for label in range(1, 5):
+            label_components, n = ndimage.label(labels == label, structure=structure)
+            for i in range(1, n + 1):
+                ids = np.unique(components[label_components == i])
+                self.assertEqual(len(ids), 1)
+                if np.count_nonzero(label_components == i) == 1:
+                    self.assertEqual(ids[0], 0)
+                else:
+                    self.assertNotEqual(ids[0], 0)
+
+        self.assertTrue((components[labels == 0] == 0).all())
+
+        # writing to the data and invalidating drops cached statistics
+        self.assertNotEqual(batch.get_max_label(), 0)
+        batch.volumes[VolumeType.GT_LABELS].data[:] = 0
+        batch.volumes[VolumeType.GT_LABELS].invalidate()
+        self.assertEqual(batch.get_max_label(), 0)
+
+    def test_chunks(self):
+
+        np.random.seed(42)
+        labels = np.random.randint(0, 3, size=(20,10,10)).astype(np.uint64)
+
+        # components spanning several chunks are merged, and the result does 
+        # not depend on the chunk size
+        components, counts = split_and_renumber(labels)
+        for chunk_size in [1, 100, 250]:
+            chunk_components, chunk_counts = split_and_renumber(labels, chunk_size=chunk_size)
+            self.assertTrue((chunk_components == components).all())
+            self.assertTrue((chunk_counts == counts).all())
+        self.assertTrue((np.bincount(components.ravel()) == counts).all())
@@ -1,4 +1,5 @@
 from enum import Enum
+import numpy as np
 
 from .freezable import Freezable
 
@@ -12,13 +13,241 @@ class VolumeType(Enum):
     PRED_AFFINITIES = 7
     LOSS_GRADIENT = 8
 
+class LazyData(Freezable):
+    '''A deferred read of an array, to be used as the data of a Volume.
+
+    Supports the parts of the numpy interface that do not need the data: 
+    'shape', 'dtype', 'ndim', 'nbytes', cropping with slices, and 'astype'. 
+    Crops and casts are recorded and only applied when the data is read, 
+    such that exactly the final region is read once.
+    '''
+
+    def __init__(self, read, offset, shape, dtype, cast_dtype=None):
+        '''
+        Args:
+
+            read: callable
+
+                Called with a tuple of slices (in the coordinates of the 
+                underlying array) to read the data.
+
+            offset: tuple of int
+
+                The offset of this region in the underlying array.
+
+            shape: tuple of int
+
+                The shape of the region.
+
+            dtype: numpy dtype
+
+                The dtype of the underlying array.
+
+            cast_dtype: numpy dtype
+
+                If given, the data will be cast to this dtype after reading.
+        '''
+        self.read_function = read
+        self.offset = tuple(int(o) for o in offset)
+        self.shape = tuple(int(s) for s in shape)
+        self.source_dtype = np.dtype(dtype)
+        self.dtype = self.source_dtype if cast_dtype is None else np.dtype(cast_dtype)
+        self.freeze()
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape, dtype=np.int64))*self.dtype.itemsize
+
+    def __getitem__(self, slices):
+
+        if not isinstance(slices, tuple):
+            slices = (slices,)
+        assert slices.count(Ellipsis) <= 1, "only one Ellipsis allowed"
+        assert len(slices) - slices.count(Ellipsis) <= self.ndim, "too many slices for %d-dimensional data"%self.ndim
+
+        # as in numpy, missing slices select everything in the trailing 
+        # dimensions, or where the Ellipsis is
+        missing = (slice(None),)*(self.ndim - len(slices) + slices.count(Ellipsis))
+        if Ellipsis in slices:
+            i = slices.index(Ellipsis)
+            slices = slices[:i] + missing + slices[i+1:]
+        else:
+            slices = slices + missing
+
+        offset = []
+        shape = []
+        for (s, o, d) in zip(slices, self.offset, self.shape):
+            assert isinstance(s, slice) and s.step in (None, 1), "LazyData can only be cropped with contiguous slices"
+            start, stop, _ = s.indices(d)
+            stop = max(start, stop)
+            offset.append(o + start)
+            shape.append(stop - start)
+
+        return LazyData(self.read_function, offset, shape, self.source_dtype, self.dtype)
+
+    def astype(self, dtype, copy=True):
+        return LazyData(self.read_function, self.offset, self.shape, self.source_dtype, dtype)
+
+    def read(self):
+        '''Read the data and apply the recorded cast.'''
+
+        data = self.read_function(tuple(
+                slice(o, o + s)
+                for (o, s) in zip(self.offset, self.shape)))
+        assert data.shape == self.shape, "read data has shape %s, expected %s"%(data.shape, self.shape)
+
+        return data.astype(self.dtype, copy=False)
+
+    def __repr__(self):
+        return "LazyData(offset %s, shape %s, %s)"%(self.offset, self.shape, self.dtype)
+
 class Volume(Freezable):
 
     def __init__(self, data, roi, resolution, interpolate):
 
+        self.__derived = {}
+        self.__data = data
+
+        # functions to call after reading lazy data, and the dtype of the data 
+        # afterwards
+        self.__deferred = []
+        self.__deferred_dtype = None
+
         self.roi = roi
         self.resolution = resolution
-        self.data = data
         self.interpolate = interpolate
 
         self.freeze()
+
+    @property
+    def data(self):
+        '''The data of this volume.
+
+        Replacing the data invalidates all derived data (see 'get_derived'). 
+        Callers that write to the returned array in-place have to call 
+        'invalidate' afterwards. If the data is lazy (see 'is_lazy'), it is 
+        read on first access.
+        '''
+        self.materialize()
+        return self.__data
+
+    @data.setter
+    def data(self, data):
+        self.__derived.clear()
+        self.__deferred = []
+        self.__deferred_dtype = None
+        self.__data = data
+
+    def get_shape(self):
+        '''Get the shape of the data, without reading lazy data.'''
+        return self.__data.shape
+
+    def get_nbytes(self):
+        '''Get the number of bytes of the data, without reading lazy data.'''
+        if self.__deferred_dtype is not None:
+            return int(np.prod(self.get_shape(), dtype=np.int64))*self.__deferred_dtype.itemsize
+        return self.__data.nbytes
+
+    def get_dtype(self):
+        '''Get the dtype of the data, without reading lazy data.'''
+        if self.__deferred_dtype is not None:
+            return self.__deferred_dtype
+        return self.__data.dtype
+
+    def is_lazy(self):
+        '''True if the data is a LazyData that has not been read, yet.'''
+        return isinstance(self.__data, LazyData)
+
+    def crop(self, roi):
+        '''Crop this volume to the given ROI, which has to be contained in the 
+        volume's ROI. Lazy data is not read, otherwise the data becomes a view 
+        of the previous data.'''
+
+        assert self.roi.contains(roi), "Can not crop volume with ROI %s to %s"%(self.roi, roi)
+
+        self.__derived.clear()
+        self.__data = self.__data[(Ellipsis,) + (roi - self.roi.get_offset()).get_bounding_box()]
+        self.roi = roi
+
+    def cast(self, dtype):
+        '''Cast the data to the given dtype. Lazy data is not read, but cast 
+        after reading. Does not copy if the data has this dtype already.'''
+
+        if self.get_dtype() == np.dtype(dtype):
+            return
+
+        # casts don't commute with deferred functions
+        if len(self.__deferred) > 0:
+            self.defer(lambda volume: volume.cast(dtype), dtype)
+            return
+
+        self.__derived.clear()
+        self.__data = self.__data.astype(dtype, copy=False)
+
+    def defer(self, function, dtype=None):
+        '''Call ``function(volume)`` once lazy data is read, or right away if 
+        the data is not lazy. Deferred functions have to be pointwise (i.e., 
+        commute with 'crop'), and are called in the order they were deferred.
+
+        Args:
+
+            function: callable
+
+                Called with this volume, changes its data.
+
+            dtype: numpy dtype
+
+                The dtype of the data after 'function' was called, if it 
+                changes it.
+        '''
+
+        if not self.is_lazy():
+            function(self)
+            return
+
+        self.__deferred.append(function)
+        if dtype is not None:
+            self.__deferred_dtype = np.dtype(dtype)
+
+    def get_derived(self, key, compute):
+        '''Get data derived from this volume, like unique labels or masks.
+
+        The result of ``compute(data)`` is stored under 'key' until the data of 
+        this volume is replaced, cropped, cast, or invalidated (see 
+        'invalidate').
+        '''
+        if key not in self.__derived:
+            self.materialize()
+            self.__derived[key] = compute(self.__data)
+        return self.__derived[key]
+
+    def set_derived(self, key, value):
+        '''Store derived data that is already known, e.g., by the node that 
+        created the data. Call this after the last write to 'data'.'''
+        self.__derived[key] = value
+
+    def has_derived(self, key):
+        '''Check if derived data is stored under 'key' already.'''
+        return key in self.__derived
+
+    def invalidate(self):
+        '''Drop all derived data. Has to be called after writing to 'data' 
+        in-place.'''
+        self.__derived.clear()
+
+    def materialize(self):
+        '''Read lazy data now.'''
+
+        if isinstance(self.__data, LazyData):
+
+            self.__data = self.__data.read()
+
+            deferred = self.__deferred
+            self.__deferred = []
+            self.__deferred_dtype = None
+            for function in deferred:
+                function(self)